@@ -0,0 +1,107 @@
+import random
+import uuid
+from time import perf_counter
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+
+from core.models import Food
+
+BENCH_EMAIL = 'sync@bench-sync.invalid'
+
+
+class Command(BaseCommand):
+    """ BaseCommand Wrapper """
+    help = '''
+    Compare the throughput of the bulk sync endpoints with one POST per
+    record, in process through the Django test client so only the
+    application and database costs are measured. A retry of the first
+    batch is sent to check that it only reports duplicates. The
+    synthetic user and its records are deleted at the end.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--records', type=int, default=2000)
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument(
+            '--kinds', nargs='+', default=['meals', 'workouts'],
+            choices=['meals', 'workouts'],
+        )
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        rng = random.Random(options['seed'])
+        User = get_user_model()
+        User.objects.filter(email=BENCH_EMAIL).delete()
+        user = User.objects.create_user(BENCH_EMAIL, sex='M')
+        client = Client(HTTP_HOST='localhost')
+        client.force_login(user)
+        food_ids = list(Food.objects.values_list('id', flat=True)[:1000])
+        try:
+            for kind in options['kinds']:
+                make = getattr(self, f'make_{kind}')
+                for label, batch_size in (
+                    ('bulk', max(1, options['batch_size'])),
+                    ('single', 1),
+                ):
+                    items = [make(rng, food_ids)
+                             for _ in range(options['records'])]
+                    elapsed = self.send(client, kind, items, batch_size)
+                    print(
+                        f"⏱️ \033[94m{kind:>8} {label:>6}\033[m: "
+                        f"{len(items) / elapsed:9.1f} records/s "
+                        f"({len(items)} records, {batch_size} per request)"
+                    )
+                retry = self.post(client, kind, items[:options['batch_size']])
+                print(f"🔁 {kind} retry: {retry['created']} created, "
+                      f"{retry['duplicate']} duplicates")
+        finally:
+            user.delete()
+
+    def send(self, client, kind: str, items: list, batch_size: int) -> float:
+        start = perf_counter()
+        for offset in range(0, len(items), batch_size):
+            batch = items[offset:offset + batch_size]
+            summary = self.post(client, kind, batch)
+            if summary['invalid']:
+                raise CommandError(f"Invalid records: {summary['results']}")
+        return perf_counter() - start
+
+    @staticmethod
+    def post(client, kind: str, items: list) -> dict:
+        response = client.post(
+            f'/api/sync/{kind}', {'items': items},
+            content_type='application/json',
+        )
+        if response.status_code != 200:
+            raise CommandError(f'{response.status_code}: {response.content}')
+        return response.json()
+
+    @staticmethod
+    def make_meals(rng, food_ids: list) -> dict:
+        return {
+            'client_id': str(uuid.uuid4()),
+            'meal_number': rng.randint(1, 5),
+            'value': f'{rng.uniform(10, 500):.2f}',
+            'foods': rng.sample(food_ids, min(len(food_ids), 3)),
+        }
+
+    @staticmethod
+    def make_workouts(rng, food_ids: list) -> dict:
+        return {
+            'client_id': str(uuid.uuid4()),
+            'adherence': f'{rng.uniform(50, 99):.1f}',
+            'exercises': [
+                {
+                    'client_id': str(uuid.uuid4()),
+                    'exercise_name': f'Exercise {number}',
+                    'reps_real': rng.randint(5, 15),
+                    'weight_real': rng.randint(5, 100),
+                    'reps_goal': 10,
+                    'weight_goal': 50,
+                }
+                for number in range(3)
+            ],
+        }
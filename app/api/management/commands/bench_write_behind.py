@@ -0,0 +1,103 @@
+import os
+import random
+import tempfile
+from time import perf_counter
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+from api import write_behind
+from api.management.commands.bench_sync import Command as BenchSync
+from core.models import Food
+
+BENCH_EMAIL = 'write-behind@bench-sync.invalid'
+
+
+class Command(BaseCommand):
+    """ BaseCommand Wrapper """
+    help = '''
+    Compare the latency of logging one record per request written
+    directly to the database with the write-behind mode, which queues it
+    in a scratch queue file, then flush the queue and check that every
+    record was stored once. The synthetic user and its records are
+    deleted at the end.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--records', type=int, default=500)
+        parser.add_argument(
+            '--kinds', nargs='+', default=['meals', 'workouts'],
+            choices=['meals', 'workouts'],
+        )
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        rng = random.Random(options['seed'])
+        User = get_user_model()
+        User.objects.filter(email=BENCH_EMAIL).delete()
+        user = User.objects.create_user(BENCH_EMAIL, sex='M')
+        client = Client(HTTP_HOST='localhost')
+        client.force_login(user)
+        food_ids = list(Food.objects.values_list('id', flat=True)[:1000])
+        records = max(1, options['records'])
+        try:
+            with tempfile.TemporaryDirectory() as workdir:
+                for kind in options['kinds']:
+                    make = getattr(BenchSync, f'make_{kind}')
+                    for label, enabled in (('direct', False),
+                                           ('queued', True)):
+                        items = [make(rng, food_ids) for _ in range(records)]
+                        with override_settings(WRITE_BEHIND={
+                            'ENABLED': enabled, 'KINDS': [kind],
+                            'PATH': os.path.join(workdir, 'queue.sqlite3'),
+                        }):
+                            latencies = self.send(client, kind, items)
+                            if enabled:
+                                self.flush(kind, items)
+                        latencies.sort()
+                        print(
+                            f"⏱️ \033[94m{kind:>8} {label:>6}\033[m: "
+                            f"p50 {self.percentile(latencies, 50):6.2f} ms, "
+                            f"p99 {self.percentile(latencies, 99):6.2f} ms "
+                            f"({records} requests)"
+                        )
+        finally:
+            user.delete()
+
+    @staticmethod
+    def send(client, kind: str, items: list) -> list:
+        latencies = []
+        for item in items:
+            start = perf_counter()
+            response = client.post(
+                f'/api/sync/{kind}', {'items': [item]},
+                content_type='application/json',
+            )
+            latencies.append((perf_counter() - start) * 1000)
+            if response.status_code not in (200, 202) \
+                    or response.json()['invalid']:
+                raise CommandError(
+                    f'{response.status_code}: {response.content}'
+                )
+        return latencies
+
+    @staticmethod
+    def flush(kind: str, items: list) -> None:
+        start = perf_counter()
+        created = 0
+        while True:
+            stats = write_behind.flush()
+            if not stats['records']:
+                break
+            if stats['failed']:
+                raise CommandError(f"{stats['failed']} records failed")
+            created += stats['created']
+        elapsed = perf_counter() - start
+        if created != len(items):
+            raise CommandError(f'{created} of {len(items)} records stored')
+        print(f"📦 {kind} flushed: {created} records in {elapsed:.2f}s, "
+              f"{created / elapsed:,.0f} records/s")
+
+    @staticmethod
+    def percentile(values: list, percent: int) -> float:
+        return values[min(len(values) - 1, len(values) * percent // 100)]
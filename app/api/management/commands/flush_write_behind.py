@@ -0,0 +1,81 @@
+import time
+from collections import Counter
+from time import perf_counter
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connections
+from api import write_behind
+
+# Longest pause between retries while the database is failing
+MAX_BACKOFF = 60
+
+
+class Command(BaseCommand):
+    """ BaseCommand Wrapper """
+    help = '''
+    Store the meals and workouts queued by the write-behind mode of the
+    sync endpoints, a batch per transaction, until the queue is empty;
+    then poll it every --interval seconds, unless --once. Run one per app
+    host, next to the queue file (WRITE_BEHIND_PATH). Interrupting it is
+    safe: records are removed from the queue once stored. Database errors
+    are retried, waiting twice as long after each failure in a row, up to
+    a minute.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int,
+            default=write_behind.options()['BATCH_SIZE'],
+            help='Records stored per transaction'
+        )
+        parser.add_argument(
+            '--interval', type=float, default=0.5,
+            help='Seconds between polls of an empty queue'
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Exit once the queue is empty'
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        queue = write_behind.queue()
+        batch_size = max(1, options['batch_size'])
+        print(f"\033[94mflush_write_behind\033[m draining {queue.path}, "
+              f"{queue.pending()} records waiting")
+        total = Counter()
+        errors = 0
+        try:
+            while True:
+                start = perf_counter()
+                try:
+                    stats = write_behind.flush(batch_size)
+                except DatabaseError as error:
+                    errors += 1
+                    delay = min(options['interval'] * 2 ** errors,
+                                MAX_BACKOFF)
+                    print(f"⚠️ \033[91m{error}\033[m, retrying in "
+                          f"{delay:.1f}s")
+                    # Reconnect on the next attempt
+                    connections.close_all()
+                    time.sleep(delay)
+                    continue
+                errors = 0
+                flushed = stats['records']
+                if flushed:
+                    total += stats
+                    print(
+                        f"📦 {flushed} records in "
+                        f"{(perf_counter() - start) * 1000:.0f} ms: "
+                        f"\033[92m{stats['created']}\033[m created, "
+                        f"{stats['duplicate']} duplicates, "
+                        f"\033[91m{stats['failed']}\033[m failed"
+                    )
+                if flushed < batch_size:
+                    if options['once']:
+                        break
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        print(f"📊 {total['created']} created, {total['duplicate']} "
+              f"duplicates, {total['failed']} failed, "
+              f"{queue.failures()} in the failed table")
@@ -0,0 +1,132 @@
+"""
+Serializers of the records synced by the mobile and wearable clients.
+
+Foreign keys are plain integers here: their existence is checked once per
+request by ``api.sync`` instead of one query per record.
+"""
+from rest_framework import serializers
+
+from core.models import (
+    ExerciseHistory, Ingestion, MealPlanItem, QuestionnaireSummary,
+    SleepHistory, WorkoutHistory, WorkoutPlanItem,
+)
+from core.questionnaires import PERIODS, SCORE_RANGE
+
+MAX_FOODS_PER_MEAL = 50
+MAX_EXERCISES_PER_WORKOUT = 100
+
+
+class MealSerializer(serializers.ModelSerializer):
+    """An Ingestion with the ids of the foods eaten."""
+    client_id = serializers.UUIDField()
+    foods = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        max_length=MAX_FOODS_PER_MEAL,
+        required=False,
+    )
+
+    class Meta:
+        model = Ingestion
+        fields = ['client_id', 'date', 'meal_number', 'value', 'foods']
+
+
+class ExerciseSerializer(serializers.ModelSerializer):
+    client_id = serializers.UUIDField()
+
+    class Meta:
+        model = ExerciseHistory
+        fields = [
+            'client_id', 'exercise_name', 'date',
+            'reps_real', 'weight_real', 'rest_real', 'duration_real',
+            'reps_goal', 'weight_goal', 'rest_goal', 'duration_goal',
+            'adherence',
+        ]
+
+
+class WorkoutSerializer(serializers.ModelSerializer):
+    """A WorkoutHistory with the exercises performed in it."""
+    client_id = serializers.UUIDField()
+    exercises = ExerciseSerializer(many=True, required=False)
+
+    class Meta:
+        model = WorkoutHistory
+        fields = ['client_id', 'date', 'adherence', 'exercises']
+
+    def validate_exercises(self, exercises):
+        if len(exercises) > MAX_EXERCISES_PER_WORKOUT:
+            raise serializers.ValidationError(
+                f'At most {MAX_EXERCISES_PER_WORKOUT} exercises per workout.'
+            )
+        client_ids = [exercise['client_id'] for exercise in exercises]
+        if len(set(client_ids)) != len(client_ids):
+            raise serializers.ValidationError('Duplicated client_id.')
+        return exercises
+
+
+class SleepSerializer(serializers.ModelSerializer):
+    client_id = serializers.UUIDField()
+    sleep_question_id = serializers.IntegerField(min_value=1)
+    # Summaries scale the scores from SCORE_RANGE to 0-100
+    score = serializers.IntegerField(
+        min_value=SCORE_RANGE[0], max_value=SCORE_RANGE[1],
+        required=False, allow_null=True,
+    )
+
+    class Meta:
+        model = SleepHistory
+        fields = ['client_id', 'sleep_question_id', 'date', 'score']
+
+
+class AnswerSerializer(serializers.Serializer):
+    question = serializers.IntegerField(min_value=1)
+    score = serializers.IntegerField(
+        min_value=SCORE_RANGE[0], max_value=SCORE_RANGE[1]
+    )
+
+
+class QuestionnaireSerializer(serializers.Serializer):
+    """Every answer of one questionnaire, for the given day or today."""
+    date = serializers.DateField(required=False)
+    answers = AnswerSerializer(many=True)
+
+
+class QuestionnaireSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = QuestionnaireSummary
+        fields = [
+            'date', 'sleep_score', 'sleep_answers',
+            'recovery_score', 'recovery_answers',
+        ]
+
+
+class TrendQuerySerializer(serializers.Serializer):
+    start = serializers.DateField()
+    end = serializers.DateField(required=False)
+    period = serializers.ChoiceField(PERIODS, default='day')
+
+
+class MealPlanItemSerializer(serializers.ModelSerializer):
+    food_name = serializers.CharField(source='food.name', read_only=True)
+
+    class Meta:
+        model = MealPlanItem
+        fields = ['meal_number', 'food', 'food_name', 'grams']
+
+
+class PlanQuerySerializer(serializers.Serializer):
+    """Day of a meal or workout plan, today by default."""
+    date = serializers.DateField(required=False)
+
+
+class WorkoutPlanItemSerializer(serializers.ModelSerializer):
+    exercise_name = serializers.CharField(
+        source='exercise.exercise_name', read_only=True
+    )
+    target_muscle = serializers.CharField(
+        source='exercise.target_muscle', read_only=True
+    )
+
+    class Meta:
+        model = WorkoutPlanItem
+        fields = ['position', 'workout', 'exercise', 'exercise_name',
+                  'target_muscle']
@@ -0,0 +1,287 @@
+"""
+Bulk and idempotent sync of history records.
+
+Clients buffer records while offline and send them in batches. Each
+record carries a client generated UUID, and the ``(user, client_id)``
+unique constraints of the history tables make retries safe: records
+already stored are reported as duplicates instead of inserted twice.
+
+A batch is validated record by record, foreign keys are checked with one
+query per table, and the new rows and their bridge rows are inserted
+with ``bulk_create`` in a single transaction.
+"""
+from collections import Counter
+from typing import Dict, List, Tuple
+
+from django.db import IntegrityError, transaction
+from rest_framework.exceptions import ValidationError
+
+from api.serializers import (
+    MealSerializer, SleepSerializer, WorkoutSerializer,
+)
+from core.models import (
+    ExerciseHistory, ExerciseWorkoutHistory, Food, FoodIngestion, Ingestion,
+    SleepHistory, SleepQuestion, WorkoutHistory,
+)
+from core.questionnaires import summarize_pairs
+from core.rollups import pairs_of, refresh_buckets
+
+MAX_ITEMS = 500
+INSERT_BATCH_SIZE = 500
+
+CREATED = 'created'
+DUPLICATE = 'duplicate'
+INVALID = 'invalid'
+# Stored later by the write-behind flusher, see api/write_behind.py
+QUEUED = 'queued'
+STATUSES = (CREATED, DUPLICATE, INVALID, QUEUED)
+
+# (index in the request, validated data, unsaved instance)
+Row = Tuple[int, dict, object]
+
+
+class BulkSync:
+    """Validate, deduplicate and insert one batch of records of a user."""
+    model = None
+    serializer_class = None
+    # Validated keys that are not columns of ``model``
+    nested = ()
+
+    def __init__(self, user):
+        self.user = user
+        self.results: List[dict] = []
+
+    def run(self, items: list) -> List[dict]:
+        self.results = [None] * len(items)
+        rows = []
+        # One serializer validates every item, building its fields once
+        serializer = self.serializer_class()
+        for index, item in enumerate(items):
+            try:
+                data = serializer.run_validation(item)
+            except ValidationError as error:
+                client_id = item.get('client_id') \
+                    if isinstance(item, dict) else None
+                self.report(index, client_id, INVALID, errors=error.detail)
+            else:
+                rows.append((index, data, self.build(data)))
+
+        with transaction.atomic():
+            rows, repeats = self.skip_duplicates(rows)
+            rows = self.check_references(rows)
+            if rows:
+                self.insert(rows)
+        for index, data, instance in rows:
+            self.report(index, data['client_id'], CREATED, id=instance.id)
+        for index, client_id, original in repeats:
+            self.report(index, client_id, DUPLICATE, id=original.id)
+        return self.results
+
+    def report(self, index: int, client_id, status: str, **extra) -> None:
+        self.results[index] = {
+            'index': index,
+            'client_id': None if client_id is None else str(client_id),
+            'status': status,
+            **extra,
+        }
+
+    def build(self, data: dict):
+        return self.model(user=self.user, **{
+            name: value for name, value in data.items()
+            if name not in self.nested
+        })
+
+    def skip_duplicates(self, rows: List[Row]) -> Tuple[List[Row], list]:
+        """
+        Report the records already stored as duplicates. Repeats of a
+        client id inside the batch are returned to be reported once the
+        first occurrence has an id.
+        """
+        stored = dict(
+            self.model.objects
+            .filter(user=self.user,
+                    client_id__in=[data['client_id'] for _, data, _ in rows])
+            .values_list('client_id', 'id')
+        )
+        fresh, repeats, seen = [], [], {}
+        for index, data, instance in rows:
+            client_id = data['client_id']
+            if client_id in stored:
+                self.report(index, client_id, DUPLICATE, id=stored[client_id])
+            elif client_id in seen:
+                repeats.append((index, client_id, seen[client_id]))
+            else:
+                seen[client_id] = instance
+                fresh.append((index, data, instance))
+        return fresh, repeats
+
+    def check_references(self, rows: List[Row]) -> List[Row]:
+        """Hook rejecting records pointing to missing rows."""
+        return rows
+
+    def reject(self, rows: List[Row], errors: Dict[int, dict]) -> List[Row]:
+        for index, data, _ in rows:
+            if index in errors:
+                self.report(index, data['client_id'], INVALID,
+                            errors=errors[index])
+        return [row for row in rows if row[0] not in errors]
+
+    def insert(self, rows: List[Row]) -> None:
+        self.model.objects.bulk_create(
+            [instance for _, _, instance in rows],
+            batch_size=INSERT_BATCH_SIZE,
+        )
+        # MySQL doesn't return the ids of bulk inserts, the client ids do
+        ids = dict(
+            self.model.objects
+            .filter(user=self.user,
+                    client_id__in=[data['client_id'] for _, data, _ in rows])
+            .values_list('client_id', 'id')
+        )
+        for _, data, instance in rows:
+            instance.id = ids[data['client_id']]
+        self.create_children(rows)
+
+    def create_children(self, rows: List[Row]) -> None:
+        """Hook inserting the rows that reference the new records."""
+
+
+class MealSync(BulkSync):
+    model = Ingestion
+    serializer_class = MealSerializer
+    nested = ('foods',)
+
+    def check_references(self, rows):
+        referenced = {food for _, data, _ in rows
+                      for food in data.get('foods', [])}
+        known = set(
+            Food.objects.filter(id__in=referenced)
+            .values_list('id', flat=True)
+        )
+        errors = {}
+        for index, data, _ in rows:
+            missing = sorted(set(data.get('foods', [])) - known)
+            if missing:
+                errors[index] = {'foods': [f'Unknown food ids: {missing}']}
+        return self.reject(rows, errors)
+
+    def create_children(self, rows):
+        FoodIngestion.objects.bulk_create([
+            FoodIngestion(food_id_id=food, ingestion_id_id=instance.id)
+            for _, data, instance in rows
+            for food in data.get('foods', [])
+        ], batch_size=INSERT_BATCH_SIZE)
+
+
+class WorkoutSync(BulkSync):
+    model = WorkoutHistory
+    serializer_class = WorkoutSerializer
+    nested = ('exercises',)
+
+    def check_references(self, rows):
+        """Exercise client ids must be new and unique in the batch."""
+        client_ids = Counter(
+            exercise['client_id'] for _, data, _ in rows
+            for exercise in data.get('exercises', [])
+        )
+        stored = set(
+            ExerciseHistory.objects
+            .filter(user=self.user, client_id__in=list(client_ids))
+            .values_list('client_id', flat=True)
+        )
+        errors = {}
+        for index, data, _ in rows:
+            clashes = sorted(
+                str(exercise['client_id'])
+                for exercise in data.get('exercises', [])
+                if exercise['client_id'] in stored
+                or client_ids[exercise['client_id']] > 1
+            )
+            if clashes:
+                errors[index] = {'exercises': [
+                    f'client_id already used by another exercise: {clashes}'
+                ]}
+        return self.reject(rows, errors)
+
+    def create_children(self, rows):
+        exercises = [
+            (workout, ExerciseHistory(
+                user=self.user, **{'date': workout.date, **exercise}
+            ))
+            for _, data, workout in rows
+            for exercise in data.get('exercises', [])
+        ]
+        ExerciseHistory.objects.bulk_create(
+            [exercise for _, exercise in exercises],
+            batch_size=INSERT_BATCH_SIZE,
+        )
+        ids = dict(
+            ExerciseHistory.objects
+            .filter(user=self.user, client_id__in=[
+                exercise.client_id for _, exercise in exercises
+            ])
+            .values_list('client_id', 'id')
+        )
+        ExerciseWorkoutHistory.objects.bulk_create([
+            ExerciseWorkoutHistory(
+                exercise_history_id_id=ids[exercise.client_id],
+                workout_history_id_id=workout.id,
+            )
+            for workout, exercise in exercises
+        ], batch_size=INSERT_BATCH_SIZE)
+
+        # bulk_create sends no signals, refresh the rollups explicitly
+        pairs = pairs_of([workout for _, _, workout in rows]) | pairs_of(
+            [exercise for _, exercise in exercises]
+        )
+        transaction.on_commit(lambda: refresh_buckets(pairs))
+
+
+class SleepSync(BulkSync):
+    model = SleepHistory
+    serializer_class = SleepSerializer
+    nested = ('sleep_question_id',)
+
+    def build(self, data):
+        instance = super().build(data)
+        instance.sleep_question_id_id = data['sleep_question_id']
+        return instance
+
+    def check_references(self, rows):
+        known = set(
+            SleepQuestion.objects
+            .filter(id__in={data['sleep_question_id'] for _, data, _ in rows})
+            .values_list('id', flat=True)
+        )
+        return self.reject(rows, {
+            index: {'sleep_question_id': ['Unknown sleep question.']}
+            for index, data, _ in rows
+            if data['sleep_question_id'] not in known
+        })
+
+    def create_children(self, rows):
+        # bulk_create sends no signals, refresh the day scores explicitly
+        pairs = {(self.user.id, instance.date) for _, _, instance in rows}
+        transaction.on_commit(lambda: summarize_pairs(pairs))
+
+
+SYNCS = {
+    'meals': MealSync,
+    'workouts': WorkoutSync,
+    'sleep': SleepSync,
+}
+
+
+def sync_batch(kind: str, user, items: list) -> List[dict]:
+    """Store a batch of ``kind`` records of ``user``, one result per item."""
+    try:
+        return SYNCS[kind](user).run(items)
+    except IntegrityError:
+        # A concurrent retry of the same batch committed first, running
+        # again reports its records as duplicates
+        return SYNCS[kind](user).run(items)
+
+
+def summarize(results: List[dict]) -> Dict[str, int]:
+    counts = Counter(result['status'] for result in results)
+    return {status: counts[status] for status in STATUSES}
@@ -0,0 +1,19 @@
+from django.urls import path
+from drf_spectacular.views import SpectacularAPIView
+
+from . import views
+
+urlpatterns = [
+    path('sync/meals', views.sync_meals, name="sync_meals"),
+    path('sync/workouts', views.sync_workouts, name="sync_workouts"),
+    path('sync/sleep', views.sync_sleep, name="sync_sleep"),
+    path('questionnaires/sleep', views.submit_sleep_questionnaire,
+         name="submit_sleep_questionnaire"),
+    path('questionnaires/evaluation', views.submit_evaluation_questionnaire,
+         name="submit_evaluation_questionnaire"),
+    path('questionnaires/trend', views.questionnaire_trend,
+         name="questionnaire_trend"),
+    path('meal-plan', views.meal_plan, name="meal_plan"),
+    path('workout-plan', views.workout_plan, name="workout_plan"),
+    path('schema', SpectacularAPIView.as_view(), name="schema"),
+]
@@ -0,0 +1,178 @@
+from django.core.exceptions import ValidationError
+from drf_spectacular.utils import extend_schema, inline_serializer
+from rest_framework import serializers, status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+
+from core.meal_plans import user_plan
+from core.questionnaires import submit, trend
+from core.sessions import user_sessions
+
+from .serializers import (
+    MealPlanItemSerializer, MealSerializer, PlanQuerySerializer,
+    QuestionnaireSerializer, QuestionnaireSummarySerializer, SleepSerializer,
+    TrendQuerySerializer, WorkoutPlanItemSerializer, WorkoutSerializer,
+)
+from . import write_behind
+from .sync import MAX_ITEMS, STATUSES, summarize, sync_batch
+
+SYNC_RESPONSE = inline_serializer('SyncResponse', {
+    **{name: serializers.IntegerField() for name in STATUSES},
+    'results': inline_serializer('SyncResult', {
+        'index': serializers.IntegerField(),
+        'client_id': serializers.CharField(allow_null=True),
+        'status': serializers.ChoiceField(STATUSES),
+        'id': serializers.IntegerField(required=False),
+        'errors': serializers.DictField(required=False),
+    }, many=True),
+})
+# 202 when the records were queued by the write-behind mode
+SYNC_RESPONSES = {200: SYNC_RESPONSE, 202: SYNC_RESPONSE}
+
+
+def _sync_request(name: str, serializer_class):
+    return inline_serializer(name, {
+        'items': serializer_class(many=True),
+    })
+
+
+def _sync(request, kind: str) -> Response:
+    items = request.data.get('items') \
+        if isinstance(request.data, dict) else None
+    if not isinstance(items, list):
+        return Response(
+            {'error': 'items must be a list of records'},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    if len(items) > MAX_ITEMS:
+        return Response(
+            {'error': f'At most {MAX_ITEMS} items per request'},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    if write_behind.enabled(kind):
+        results = write_behind.enqueue(kind, request.user, items)
+        if results is not None:
+            return Response({**summarize(results), 'results': results},
+                            status=status.HTTP_202_ACCEPTED)
+    results = sync_batch(kind, request.user, items)
+    return Response({**summarize(results), 'results': results})
+
+
+@extend_schema(
+    request=_sync_request('MealSyncRequest', MealSerializer),
+    responses=SYNC_RESPONSES,
+)
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def sync_meals(request):
+    """ Store a batch of meals (Ingestion and its FoodIngestion rows) """
+    return _sync(request, 'meals')
+
+
+@extend_schema(
+    request=_sync_request('WorkoutSyncRequest', WorkoutSerializer),
+    responses=SYNC_RESPONSES,
+)
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def sync_workouts(request):
+    """ Store a batch of workouts with their exercises """
+    return _sync(request, 'workouts')
+
+
+@extend_schema(
+    request=_sync_request('SleepSyncRequest', SleepSerializer),
+    responses=SYNC_RESPONSES,
+)
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def sync_sleep(request):
+    """ Store a batch of sleep history records """
+    return _sync(request, 'sleep')
+
+
+def _submit(request, questionnaire: str) -> Response:
+    serializer = QuestionnaireSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    data = serializer.validated_data
+    try:
+        summary = submit(
+            questionnaire, request.user.id,
+            [(answer['question'], answer['score'])
+             for answer in data['answers']],
+            data.get('date'),
+        )
+    except ValidationError as error:
+        return Response(
+            error.message_dict, status=status.HTTP_400_BAD_REQUEST
+        )
+    return Response(QuestionnaireSummarySerializer(summary).data)
+
+
+@extend_schema(
+    request=QuestionnaireSerializer,
+    responses=QuestionnaireSummarySerializer,
+)
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def submit_sleep_questionnaire(request):
+    """ Store the answers of a sleep survey, returns the day's scores """
+    return _submit(request, 'sleep')
+
+
+@extend_schema(
+    request=QuestionnaireSerializer,
+    responses=QuestionnaireSummarySerializer,
+)
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def submit_evaluation_questionnaire(request):
+    """ Store the answers of a workout evaluation """
+    return _submit(request, 'evaluation')
+
+
+@extend_schema(
+    parameters=[TrendQuerySerializer],
+    responses=inline_serializer('QuestionnaireTrend', {
+        'date': serializers.DateField(required=False),
+        'period_start': serializers.DateField(required=False),
+        'sleep_score': serializers.DecimalField(4, 1, allow_null=True),
+        'recovery_score': serializers.DecimalField(4, 1, allow_null=True),
+    }, many=True),
+)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def questionnaire_trend(request):
+    """ Daily, weekly or monthly sleep and recovery scores """
+    query = TrendQuerySerializer(data=request.query_params)
+    query.is_valid(raise_exception=True)
+    return Response(trend(request.user.id, **query.validated_data))
+
+
+@extend_schema(
+    parameters=[PlanQuerySerializer],
+    responses=MealPlanItemSerializer(many=True),
+)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def meal_plan(request):
+    """ Foods and portions planned for the day's meals """
+    query = PlanQuerySerializer(data=request.query_params)
+    query.is_valid(raise_exception=True)
+    items = user_plan(request.user.id, query.validated_data.get('date'))
+    return Response(MealPlanItemSerializer(items, many=True).data)
+
+
+@extend_schema(
+    parameters=[PlanQuerySerializer],
+    responses=WorkoutPlanItemSerializer(many=True),
+)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def workout_plan(request):
+    """ Exercises of the day's session of the user's program """
+    query = PlanQuerySerializer(data=request.query_params)
+    query.is_valid(raise_exception=True)
+    items = user_sessions(request.user.id, query.validated_data.get('date'))
+    return Response(WorkoutPlanItemSerializer(items, many=True).data)
@@ -0,0 +1,404 @@
+"""
+Write-behind mode of the sync endpoints.
+
+Meals and workouts are logged in bursts (meal times, gym peak hours) and
+each sync request otherwise waits for its MySQL transaction to commit.
+With write-behind enabled, a request only validates its records and
+appends them to a local queue, a SQLite file in WAL mode on the app
+host, then answers ``202`` with a ``queued`` result per record. The
+``flush_write_behind`` command drains the queue into the database with
+``api.sync``: records are grouped per user and kind, and each flush
+commits once for all of them, each group within its own savepoint.
+
+Delivery is at least once. A flusher leases the records it reads and
+deletes them only after its transaction committed; records of a flusher
+that died are leased again once the lease expires. Replays are harmless:
+the queue keeps one record per ``(kind, user, client_id)`` and the
+history tables report the records already stored as duplicates. Records
+rejected at flush time (unknown foods, deleted users), records of a
+group whose write raised a database error, and records leased
+MAX_ATTEMPTS times without being stored are moved to the queue's
+``failed`` table. When the database is unreachable (TRANSIENT_ERRORS),
+the batch is released for the next flush without counting an attempt,
+and the next flush leases half of its records, down to the oldest
+record alone: a record breaking every batch it is in (e.g. data that
+MySQL rejects with an OperationalError) ends up flushed on its own. A
+record failing TRANSIENT_RETRIES times in a row counts its attempts
+again, so it reaches the failed table instead of blocking the queue.
+
+When the queue holds MAX_PENDING records, requests write synchronously
+again, which slows clients down to the pace of the database until the
+flusher catches up.
+
+Settings::
+
+    WRITE_BEHIND = {
+        'ENABLED': False,
+        'KINDS': ['meals', 'workouts'],   # sync kinds queued
+        'PATH': 'write_behind.sqlite3',   # queue file, local to the host
+        'MAX_PENDING': 100000,
+        'BATCH_SIZE': 1000,               # records per flush
+        'LEASE_SECONDS': 60,
+        'MAX_ATTEMPTS': 5,
+        'TRANSIENT_RETRIES': 12,          # before attempts count again
+    }
+"""
+import json
+import sqlite3
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DatabaseError, InterfaceError, OperationalError
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+
+from api.sync import INVALID, QUEUED, SYNCS, sync_batch
+
+DEFAULTS = {
+    'ENABLED': False,
+    'KINDS': ['meals', 'workouts'],
+    'PATH': 'write_behind.sqlite3',
+    'MAX_PENDING': 100000,
+    'BATCH_SIZE': 1000,
+    'LEASE_SECONDS': 60,
+    'MAX_ATTEMPTS': 5,
+    'TRANSIENT_RETRIES': 12,
+}
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS records (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    client_id TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    enqueued REAL NOT NULL,
+    leased_until REAL NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    transient INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (kind, user_id, client_id)
+);
+CREATE TABLE IF NOT EXISTS failed (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    client_id TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    enqueued REAL NOT NULL,
+    failed REAL NOT NULL,
+    errors TEXT NOT NULL
+);
+'''
+
+# Lost connections, timeouts, deadlocks: the same batch may succeed later
+TRANSIENT_ERRORS = (InterfaceError, OperationalError)
+
+
+def options() -> dict:
+    return {**DEFAULTS, **getattr(settings, 'WRITE_BEHIND', {})}
+
+
+def enabled(kind: str) -> bool:
+    config = options()
+    return config['ENABLED'] and kind in config['KINDS']
+
+
+class Record(NamedTuple):
+    id: int
+    kind: str
+    user_id: int
+    client_id: str
+    payload: str
+    enqueued: float
+    # Leases of the record, the current one included
+    attempts: int
+    # Flushes in a row failed by TRANSIENT_ERRORS
+    transient: int
+
+
+class Queue:
+    """Durable FIFO of sync records in a SQLite file."""
+
+    def __init__(self, path: str):
+        self.path = str(path)
+        self._local = threading.local()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        # One connection per thread, opened on first use in each worker
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(
+                self.path, timeout=30, isolation_level=None,
+                check_same_thread=False,
+            )
+            connection.execute('PRAGMA journal_mode=WAL')
+            # An acknowledged record survives a power loss
+            connection.execute('PRAGMA synchronous=FULL')
+            connection.executescript(SCHEMA)
+            columns = {row[1] for row in connection.execute(
+                'PRAGMA table_info(records)'
+            )}
+            if 'transient' not in columns:
+                # Queue files written before the column existed
+                connection.execute(
+                    'ALTER TABLE records ADD COLUMN '
+                    'transient INTEGER NOT NULL DEFAULT 0'
+                )
+            self._local.connection = connection
+        return connection
+
+    def _write(self, function):
+        """Run ``function(connection)`` in a write transaction."""
+        connection = self.connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            result = function(connection)
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+        return result
+
+    def pending(self) -> int:
+        """
+        Upper bound of the records waiting, read from the ids at both
+        ends of the queue instead of counting every row.
+        """
+        low, high = self.connection.execute(
+            'SELECT MIN(id), MAX(id) FROM records'
+        ).fetchone()
+        return 0 if low is None else high - low + 1
+
+    def put(self, kind: str, user_id: int, records: List[tuple],
+            max_pending: int) -> bool:
+        """
+        Append ``(client_id, payload)`` records, False when the queue is
+        full. Records already waiting are kept once.
+        """
+        def put(connection):
+            if self.pending() + len(records) > max_pending:
+                return False
+            now = time.time()
+            connection.executemany(
+                'INSERT OR IGNORE INTO records '
+                '(kind, user_id, client_id, payload, enqueued) '
+                'VALUES (?, ?, ?, ?, ?)',
+                [(kind, user_id, client_id, payload, now)
+                 for client_id, payload in records],
+            )
+            return True
+        return self._write(put)
+
+    def lease(self, limit: int, seconds: float,
+              max_attempts: int) -> Tuple[List[Record], int]:
+        """
+        Oldest records not leased by another flusher, leased for
+        ``seconds``. Records already leased ``max_attempts`` times are
+        moved to the failed table instead; returns their number too.
+        After a transient failure of the oldest record, only half of the
+        records that failed with it are leased.
+        """
+        def lease(connection):
+            now = time.time()
+            size = limit
+            oldest = connection.execute(
+                'SELECT transient FROM records WHERE leased_until < ? '
+                'ORDER BY id LIMIT 1', (now,),
+            ).fetchone()
+            if oldest and oldest[0]:
+                # Records of one failed batch share their transient count
+                failed_together = connection.execute(
+                    'SELECT COUNT(*) FROM (SELECT transient FROM records '
+                    'WHERE leased_until < ? ORDER BY id LIMIT ?) '
+                    'WHERE transient = ?', (now, limit, oldest[0]),
+                ).fetchone()[0]
+                size = max(1, failed_together // 2)
+            records, exhausted = [], {}
+            for row in connection.execute(
+                'SELECT id, kind, user_id, client_id, payload, enqueued, '
+                'attempts + 1, transient FROM records '
+                'WHERE leased_until < ? ORDER BY id LIMIT ?', (now, size),
+            ):
+                record = Record(*row)
+                if record.attempts > max_attempts:
+                    exhausted[record.id] = (
+                        record, {'error': 'Too many attempts.'}
+                    )
+                else:
+                    records.append(record)
+            connection.executemany(
+                'UPDATE records SET leased_until = ?, '
+                'attempts = attempts + 1 WHERE id = ?',
+                [(now + seconds, record.id) for record in records],
+            )
+            self._fail(connection, exhausted)
+            return records, len(exhausted)
+        return self._write(lease)
+
+    def release(self, ids: Iterable[int], retries: int) -> None:
+        """
+        End the leases of ``ids`` after a transient failure, without
+        counting them as attempts unless they failed ``retries`` times
+        in a row.
+        """
+        self._write(lambda connection: connection.executemany(
+            'UPDATE records SET leased_until = 0, '
+            'transient = transient + 1, '
+            'attempts = attempts - (transient + 1 < ?) WHERE id = ?',
+            [(retries, record_id) for record_id in ids],
+        ))
+
+    def ack(self, done: Iterable[int], failed: Dict[int, tuple]) -> None:
+        """
+        Remove the records ``done`` and move ``failed`` ones, a
+        ``{id: (record, errors)}`` dict, to the failed table.
+        """
+        def ack(connection):
+            self._fail(connection, failed)
+            connection.executemany(
+                'DELETE FROM records WHERE id = ?',
+                [(record_id,) for record_id in done],
+            )
+        self._write(ack)
+
+    @staticmethod
+    def _fail(connection, failed: Dict[int, tuple]) -> None:
+        now = time.time()
+        connection.executemany(
+            'INSERT OR REPLACE INTO failed (id, kind, user_id, '
+            'client_id, payload, enqueued, failed, errors) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            [(record.id, record.kind, record.user_id, record.client_id,
+              record.payload, record.enqueued, now, json.dumps(errors))
+             for record, errors in failed.values()],
+        )
+        connection.executemany(
+            'DELETE FROM records WHERE id = ?',
+            [(record_id,) for record_id in failed],
+        )
+
+    def failures(self) -> int:
+        return self.connection.execute(
+            'SELECT COUNT(*) FROM failed'
+        ).fetchone()[0]
+
+
+_queues: Dict[str, Queue] = {}
+_queues_lock = threading.Lock()
+
+
+def queue() -> Queue:
+    """The queue of the configured PATH, shared by the threads."""
+    path = str(options()['PATH'])
+    with _queues_lock:
+        if path not in _queues:
+            _queues[path] = Queue(path)
+        return _queues[path]
+
+
+def enqueue(kind: str, user, items: list) -> Optional[List[dict]]:
+    """
+    Validate the records of a sync request and queue the valid ones.
+    Returns one result per item like ``api.sync.sync_batch``, or None
+    when the queue is full and the records must be written directly.
+    Foreign keys and duplicates are checked when the records are flushed.
+    """
+    config = options()
+    serializer = SYNCS[kind].serializer_class()
+    results, records = [], []
+    for index, item in enumerate(items):
+        client_id = item.get('client_id') if isinstance(item, dict) else None
+        try:
+            data = serializer.run_validation(item)
+        except ValidationError as error:
+            results.append({
+                'index': index,
+                'client_id': None if client_id is None else str(client_id),
+                'status': INVALID,
+                'errors': error.detail,
+            })
+            continue
+        client_id = str(data['client_id'])
+        records.append((client_id, json.dumps(item)))
+        results.append({'index': index, 'client_id': client_id,
+                        'status': QUEUED})
+    if records and not queue().put(kind, user.id, records,
+                                   config['MAX_PENDING']):
+        return None
+    return results
+
+
+def _store(groups: Dict[tuple, List[Record]], failed: dict) -> Counter:
+    """
+    Store the record groups in one transaction, each in a savepoint. The
+    records of rejected groups are added to ``failed``.
+    """
+    stats = Counter()
+    users = get_user_model().objects.in_bulk(
+        {user_id for _, user_id in groups}
+    )
+    with transaction.atomic():
+        for (kind, user_id), group in groups.items():
+            user = users.get(user_id)
+            if user is None:
+                for record in group:
+                    failed[record.id] = (record, {'error': 'Unknown user.'})
+                continue
+            try:
+                with transaction.atomic():
+                    results = sync_batch(kind, user, [
+                        json.loads(record.payload) for record in group
+                    ])
+            except TRANSIENT_ERRORS:
+                raise
+            except DatabaseError as error:
+                # Rolled back to the savepoint, the other groups commit
+                for record in group:
+                    failed[record.id] = (record, {'error': str(error)})
+                continue
+            for record, result in zip(group, results):
+                stats[result['status']] += 1
+                if result['status'] == INVALID:
+                    failed[record.id] = (record, result['errors'])
+    return stats
+
+
+def flush(batch_size: Optional[int] = None) -> Counter:
+    """
+    Store one batch of queued records in a single transaction. Returns
+    the number of ``records`` read, of records per sync status and of
+    ``failed`` ones. TRANSIENT_ERRORS are raised once the batch was
+    released.
+    """
+    config = options()
+    records, exhausted = queue().lease(
+        batch_size or config['BATCH_SIZE'], config['LEASE_SECONDS'],
+        config['MAX_ATTEMPTS'],
+    )
+    stats = Counter(records=exhausted, failed=exhausted)
+    if not records:
+        return +stats
+
+    failed = {}
+    groups = defaultdict(list)
+    for record in records:
+        groups[(record.kind, record.user_id)].append(record)
+    try:
+        stats += _store(groups, failed)
+    except TRANSIENT_ERRORS:
+        # Nothing was stored, and the records are most likely not the
+        # cause: retried in smaller batches, see the module docstring
+        queue().release([record.id for record in records],
+                        config['TRANSIENT_RETRIES'])
+        raise
+    # Only once committed: a crash before replays the batch, whose
+    # records are then reported as duplicates
+    queue().ack([record.id for record in records if record.id not in failed],
+                failed)
+    stats.update(records=len(records), failed=len(failed))
+    return stats
@@ -12,5 +12,12 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "app.settings")
+# Read by the settings: persistent connections are not reused under ASGI
+os.environ["DJANGO_SERVER_INTERFACE"] = "asgi"
 
 application = get_asgi_application()
+
+# Load the reference catalogs before the first request hits this worker
+from core.catalog_cache import catalog_cache  # noqa: E402
+
+catalog_cache.warm_up()
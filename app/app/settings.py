@@ -27,9 +27,9 @@ SECRET_KEY = (
 )
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = os.environ.get('DEBUG', '1') == '1'
 
-ALLOWED_HOSTS = ['localhost', '127.0.0.1']
+ALLOWED_HOSTS = os.environ.get('ALLOWED_HOSTS', 'localhost,127.0.0.1').split(',')
 
 
 # Application definition
@@ -45,15 +45,25 @@ INSTALLED_APPS = [
 
     # Utilities
     'django.contrib.humanize',
+    'rest_framework',
+    'drf_spectacular',
 
     # Local Apps
     'core',
     'home_page',
-    'user'
+    'user',
+    'food',
+    'api',
 ]
 
 MIDDLEWARE = [
+    # First, so its timings cover the whole middleware stack
+    "core.middleware.instrumentation_middleware",
     "django.middleware.security.SecurityMiddleware",
+    # Serves collected static files when DEBUG is off, see core/static.py
+    "core.static.static_files_middleware",
+    # Before sessions, whose writes pin the client to default
+    "core.routers.replica_pinning_middleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -64,12 +74,22 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = "app.urls"
 
+_TEMPLATE_LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+if not DEBUG:
+    # Compile each template once per worker instead of on every render
+    _TEMPLATE_LOADERS = [
+        ('django.template.loaders.cached.Loader', _TEMPLATE_LOADERS),
+    ]
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, 'templates')],
-        'APP_DIRS': True,
         'OPTIONS': {
+            'loaders': _TEMPLATE_LOADERS,
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
@@ -93,9 +113,55 @@ DATABASES = {
         "NAME": os.environ.get("DB_NAME"),
         "USER": os.environ.get("DB_USER"),
         "PASSWORD": os.environ.get("DB_PASS"),
+        "PORT": os.environ.get("DB_PORT", ""),
+        # Keep connections open between requests instead of reconnecting
+        "CONN_MAX_AGE": int(os.environ.get("DB_CONN_MAX_AGE", 60)),
     }
 }
 
+# Under ASGI each sync_to_async call may run in a new thread with its own
+# connection, which Django never reuses: close them after each request
+# instead of leaving them open until MySQL times them out
+if os.environ.get("DJANGO_SERVER_INTERFACE") == "asgi":
+    DATABASES["default"]["CONN_MAX_AGE"] = 0
+
+# Local scale tests and benchmarks can run on SQLite instead of MySQL
+if os.environ.get("DB_ENGINE") == "sqlite":
+    DATABASES["default"] = {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": os.environ.get("DB_NAME") or BASE_DIR / "db.sqlite3",
+    }
+
+
+def _copy_of_default(location: str) -> dict:
+    """Settings of a copy of default at a MySQL host or SQLite file."""
+    sqlite = DATABASES["default"]["ENGINE"].endswith("sqlite3")
+    return {
+        **DATABASES["default"],
+        "NAME" if sqlite else "HOST": location,
+        "TEST": {"MIRROR": "default"},
+    }
+
+
+# Read replicas of default, and a database for analytics and batch jobs,
+# see core/routers.py
+for _index, _location in enumerate(
+    filter(None, os.environ.get("DB_REPLICAS", "").split(","))
+):
+    DATABASES[f"replica_{_index}"] = _copy_of_default(_location)
+if os.environ.get("DB_ANALYTICS"):
+    DATABASES["analytics"] = _copy_of_default(os.environ["DB_ANALYTICS"])
+
+DATABASE_ROUTERS = ["core.routers.ReplicaRouter"]
+
+DB_ROUTING = {
+    # Seconds a client that wrote keeps reading from default
+    "STICKY_SECONDS": int(os.environ.get("DB_STICKY_SECONDS", 5)),
+}
+
+# Seconds between pings of an idle persistent connection, see core/db.py
+DB_HEALTH_CHECK_INTERVAL = int(os.environ.get("DB_HEALTH_CHECK_INTERVAL", 10))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -143,6 +209,16 @@ STATICFILES_FINDERS = [
     'django.contrib.staticfiles.finders.AppDirectoriesFinder',
 ]
 
+# collectstatic target, served by core.static when DEBUG is off
+STATIC_ROOT = os.environ.get('STATIC_ROOT') or BASE_DIR / 'staticfiles'
+
+if not DEBUG:
+    # Content hashed names and pre-compressed variants, see core/static.py
+    STATICFILES_STORAGE = 'core.static.CompressedManifestStorage'
+
+# Browser cache lifetime (seconds) of static files without a hashed name
+STATIC_MAX_AGE = int(os.environ.get('STATIC_MAX_AGE', 60))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.0/ref/settings/#default-auto-field
 
@@ -150,6 +226,77 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 AUTH_USER_MODEL = "core.User"
 
-# REST_FRAMEWORK = {
-#     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
-# }
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Rendered template fragments ({% cache ... using="fragments" %}),
+    # kept per worker so a deploy, which restarts the workers, drops them
+    'fragments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'fragments',
+    },
+}
+if DEBUG:
+    # Template edits show up on the next request during development
+    CACHES['fragments'] = {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+    }
+
+# Read-through cache of the reference catalogs, see core/catalog_cache.py
+CATALOG_CACHE = {
+    'MAX_ENTRIES': 2048,
+    # Alias in CACHES shared by all workers, e.g. a memcached instance
+    'SHARED_BACKEND': os.environ.get('CATALOG_CACHE_BACKEND') or None,
+}
+# Seconds a cached catalog read is served: without a shared backend, how
+# long the other workers take to see a catalog change
+CATALOG_CACHE['TIMEOUT'] = int(os.environ.get(
+    'CATALOG_CACHE_TIMEOUT', 300 if CATALOG_CACHE['SHARED_BACKEND'] else 30
+))
+
+# Sessions and their users read from a cache, and throttled last_login
+# writes, see core/auth.py
+AUTH_CACHE = {
+    # Alias in CACHES shared by all workers, e.g. a memcached instance
+    'CACHE': os.environ.get('AUTH_CACHE_BACKEND') or 'default',
+    # Seconds a cached session or user is trusted: how long the other
+    # workers take to see a logout when the cache isn't shared
+    'TIMEOUT': int(os.environ.get('AUTH_CACHE_TIMEOUT', 60)),
+    'LAST_LOGIN_INTERVAL': int(os.environ.get('LAST_LOGIN_INTERVAL', 3600)),
+}
+SESSION_ENGINE = os.environ.get('SESSION_ENGINE', 'core.auth')
+SESSION_CACHE_ALIAS = AUTH_CACHE['CACHE']
+AUTHENTICATION_BACKENDS = ['core.auth.CachedModelBackend']
+
+# Body composition reports per user, see core/anthropometrics.py
+ANTHROPOMETRICS_CACHE = {
+    # Alias in CACHES shared by all workers, e.g. a memcached instance
+    'CACHE': os.environ.get('ANTHROPOMETRICS_CACHE_BACKEND') or 'default',
+    # Seconds a report is kept: how long the other workers may serve it
+    # after a change when the cache isn't shared
+    'TIMEOUT': int(os.environ.get('ANTHROPOMETRICS_CACHE_TIMEOUT', 300)),
+}
+
+# Request latency and SQL histograms, see core/instrumentation.py
+INSTRUMENTATION = {
+    'ENABLED': os.environ.get('INSTRUMENTATION', '1') == '1',
+    'PROFILE_SAMPLE_RATE': float(os.environ.get('PROFILE_SAMPLE_RATE', 0)),
+    'PROFILE_DIR': os.environ.get('PROFILE_DIR') or None,
+    # Lets Prometheus scrape /metrics without a staff session
+    'TOKEN': os.environ.get('METRICS_TOKEN') or None,
+}
+
+# Queue synced meals and workouts locally and store them in batches with
+# the flush_write_behind command, see api/write_behind.py
+WRITE_BEHIND = {
+    'ENABLED': os.environ.get('WRITE_BEHIND', '0') == '1',
+    'KINDS': ['meals', 'workouts'],
+    'PATH': os.environ.get('WRITE_BEHIND_PATH')
+    or BASE_DIR / 'write_behind.sqlite3',
+    'MAX_PENDING': int(os.environ.get('WRITE_BEHIND_MAX_PENDING', 100000)),
+}
+
+REST_FRAMEWORK = {
+    'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+}
@@ -14,8 +14,10 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path
+from django.urls import include, path
 
+from core.views import export_view, metrics_view
+from food.views import food_search_view
 from home_page.views import home_view
 from user.views import user_view
 
@@ -23,5 +25,9 @@ from user.views import user_view
 urlpatterns = [
     path('', home_view, name="home"),
     path('user', user_view, name="user"),
+    path('food/search', food_search_view, name="food_search"),
+    path('api/', include('api.urls')),
+    path('metrics', metrics_view, name="metrics"),
+    path('export/<str:dataset>', export_view, name="export"),
     path('admin/', admin.site.urls)
 ]
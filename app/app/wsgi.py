@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "app.settings")
 
 application = get_wsgi_application()
+
+# Load the reference catalogs before the first request hits this worker
+from core.catalog_cache import catalog_cache  # noqa: E402
+
+catalog_cache.warm_up()
@@ -1,20 +1,137 @@
 """
 Django admin customization.
+
+Changelists of the big tables (users, foods, exercises, program
+assignments) stay cheap at millions of rows:
+
+* unfiltered changelists take their row count from the table statistics
+  of MySQL instead of a COUNT(*) over the whole table, and no changelist
+  counts the unfiltered table a second time
+* searches are prefix searches (``^``) and filters are on columns with
+  an index, so neither scans the table; the choices of a filter on a
+  free text column are a bounded, cached DISTINCT (``ValuesFilter``)
+* foreign keys are edited with autocomplete or raw id widgets instead of
+  a dropdown of every row, and listed with ``list_select_related``
+* bulk actions run one ``update()`` per action instead of a save per row
+
+``bench_admin`` reports the queries of every changelist.
 """
-from django.contrib import admin
+from decimal import Decimal
+
+from django.contrib import admin, messages
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.core.paginator import Paginator
+from django.db import connections, transaction
+from django.db.models import F
+from django.db.models.functions import Least, Now
+from django.utils.functional import cached_property
 
 # integrates with the django translation system
 from django.utils.translation import gettext_lazy as _
 
 from core import models
+from core.auth import forget_users
+from core.catalog_cache import catalog_cache
+from core.meal_plans import ATWATER
+from core.sessions import sync_muscles
+
+# Tables with fewer rows are counted exactly
+ESTIMATE_THRESHOLD = 100000
+# Largest value of a Food macro column (MACRO_FIELDS)
+MAX_CALORIES = Decimal('999.9')
+# Choices listed by a ValuesFilter
+MAX_FILTER_CHOICES = 100
+
+
+def estimated_count(queryset):
+    """
+    Row count of an unfiltered queryset from the table statistics, None
+    when the database keeps none (only MySQL's are used).
+    """
+    if queryset.query.where or queryset.query.distinct:
+        return None
+    connection = connections[queryset.db]
+    if connection.vendor != 'mysql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT table_rows FROM information_schema.tables '
+            'WHERE table_schema = DATABASE() AND table_name = %s',
+            [queryset.model._meta.db_table],
+        )
+        row = cursor.fetchone()
+    return row[0] if row and row[0] is not None else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator counting big unfiltered tables from their statistics."""
+
+    @cached_property
+    def count(self):
+        estimate = estimated_count(self.object_list)
+        if estimate is not None and estimate > ESTIMATE_THRESHOLD:
+            return estimate
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Changelist settings of tables too big to count or scan."""
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
+
+
+class ValuesFilter(admin.SimpleListFilter):
+    """
+    Filter on the values of an indexed text column. Unlike a field in
+    ``list_filter``, which runs a SELECT DISTINCT over the whole table on
+    every page, the choices are the first MAX_FILTER_CHOICES values, read
+    once per catalog version from the index.
+    """
+
+    def lookups(self, request, model_admin):
+        model = model_admin.model
+        field = self.parameter_name
+        values = catalog_cache.get_or_load(
+            model, f'choices:{field}',
+            lambda: list(
+                model.objects.order_by(field)
+                .values_list(field, flat=True)
+                .distinct()[:MAX_FILTER_CHOICES]
+            ),
+        )
+        return [(value, value) for value in values]
+
+    def queryset(self, request, queryset):
+        if self.value() is None:
+            return queryset
+        return queryset.filter(**{self.parameter_name: self.value()})
+
+
+class WorkoutTypeFilter(ValuesFilter):
+    title = _('workout type')
+    parameter_name = 'workout_type'
+
+
+class TargetMuscleFilter(ValuesFilter):
+    title = _('target muscle')
+    parameter_name = 'target_muscle'
 
 
-class UserAdmin(BaseUserAdmin):
+def _on_commit_invalidate(model) -> None:
+    # update() sends no signals, drop the cached catalog by hand
+    transaction.on_commit(lambda: catalog_cache.invalidate(model))
+
+
+class UserAdmin(BaseUserAdmin, LargeTableAdmin):
     """Define the admin pages for users."""
 
     ordering = ["id"]
-    list_display = ["email", "name"]
+    list_display = ["email", "name", "sex", "is_active", "is_staff"]
+    list_filter = ["is_staff", "sex"]
+    search_fields = ["^email", "^name"]
+    actions = ["activate", "deactivate"]
     fieldsets = (
         (None, {'fields': ('email', 'password')}),
         (_('Personal Info'), {'fields': ('name',)}),
@@ -41,11 +158,94 @@ class UserAdmin(BaseUserAdmin):
         ),
     )
 
+    @admin.action(description=_('Activate selected users'))
+    def activate(self, request, queryset):
+        user_ids = list(queryset.values_list('id', flat=True))
+        count = queryset.update(is_active=True)
+        forget_users(user_ids)
+        self.message_user(request, f'{count} users activated.',
+                          messages.SUCCESS)
+
+    @admin.action(description=_('Deactivate selected users'))
+    def deactivate(self, request, queryset):
+        queryset = queryset.exclude(id=request.user.id)
+        user_ids = list(queryset.values_list('id', flat=True))
+        count = queryset.update(is_active=False)
+        forget_users(user_ids)
+        self.message_user(request, f'{count} users deactivated.',
+                          messages.SUCCESS)
+
+
+class FoodAdmin(LargeTableAdmin):
+    list_display = ["name", "brand", "type", "calories"]
+    list_filter = ["type"]
+    search_fields = ["^name", "^brand"]
+    actions = ["estimate_calories"]
+
+    @admin.action(description=_('Estimate missing calories from macros'))
+    def estimate_calories(self, request, queryset):
+        estimate = sum((F(macro) * Decimal(str(factor))
+                        for macro, factor in ATWATER.items()), Decimal(0))
+        count = queryset.filter(calories=0).update(
+            calories=Least(estimate, MAX_CALORIES), updated_at=Now()
+        )
+        _on_commit_invalidate(models.Food)
+        self.message_user(request, f'Calories of {count} foods estimated.',
+                          messages.SUCCESS)
+
+
+class ExcercisesAdmin(LargeTableAdmin):
+    list_display = ["exercise_name", "target_muscle", "workout_type"]
+    list_filter = [WorkoutTypeFilter, TargetMuscleFilter]
+    search_fields = ["^exercise_name"]
+    actions = ["sync_exercise_muscles"]
+
+    @admin.action(description=_('Parse muscles again'))
+    def sync_exercise_muscles(self, request, queryset):
+        count = sync_muscles(queryset.values_list('id', flat=True))
+        self.message_user(request, f'Muscles of {count} exercises updated.',
+                          messages.SUCCESS)
+
+
+class QuestionAdmin(admin.ModelAdmin):
+    list_display = ["question_name", "question_type"]
+    search_fields = ["question_name"]
+
+
+class SleepQuestionAdmin(admin.ModelAdmin):
+    list_display = ["id", "question_id", "date", "score"]
+    list_select_related = ["question_id"]
+    autocomplete_fields = ["question_id"]
+
+
+class ProgramTypeAdmin(admin.ModelAdmin):
+    list_display = ["program_name", "sex", "available_workout_days"]
+    list_filter = ["sex"]
+    search_fields = ["program_name"]
+
+
+class WorkoutsAdmin(admin.ModelAdmin):
+    list_display = ["workout_type", "program_type"]
+    list_select_related = ["program_type"]
+    autocomplete_fields = ["program_type"]
+
+
+class ProgramTypeUserAdmin(LargeTableAdmin):
+    list_display = ["user", "program_type"]
+    list_select_related = ["user", "program_type"]
+    list_filter = ["program_type"]
+    search_fields = ["^user__email"]
+    raw_id_fields = ["user"]
+    autocomplete_fields = ["program_type"]
+
 
 # ask the guys what other models should be modifiable by the admin
 
 admin.site.register(models.User, UserAdmin)
-admin.site.register(models.Food)
-admin.site.register(models.Excercises)
-admin.site.register(models.Question)
-admin.site.register(models.SleepQuestion)
+admin.site.register(models.Food, FoodAdmin)
+admin.site.register(models.Excercises, ExcercisesAdmin)
+admin.site.register(models.Question, QuestionAdmin)
+admin.site.register(models.SleepQuestion, SleepQuestionAdmin)
+admin.site.register(models.ProgramType, ProgramTypeAdmin)
+admin.site.register(models.Workouts, WorkoutsAdmin)
+admin.site.register(models.ProgramTypeUser, ProgramTypeUserAdmin)
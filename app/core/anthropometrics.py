@@ -0,0 +1,334 @@
+"""
+Body composition analytics over AntrhopometricHistory.
+
+Measurements (cm and kg) are pulled with a single query into numpy
+arrays ordered by user and date, and every metric is computed for all
+rows at once:
+
+* BMI, weight / height (m) squared
+* body fat percentage with the US Navy formula (metric version)
+* waist to hip and waist to height ratios
+* per user trailing moving averages and weekly rates of change
+
+Per row metrics are stored on the history rows by ``backfill`` and on
+single saves by a pre_save signal. Per user reports with trends are
+cached until the user records or deletes a measurement. Only the cache
+of the process that saw the change is cleared, so with the default
+per-process cache the other workers serve a report for up to TIMEOUT
+seconds; with a cache shared by the workers
+(ANTHROPOMETRICS_CACHE_BACKEND) the change is seen at once.
+
+Settings (all optional)::
+
+    ANTHROPOMETRICS_CACHE = {
+        'CACHE': 'default',   # alias in CACHES
+        'TIMEOUT': 300,       # seconds a report is kept
+    }
+"""
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.db.models import QuerySet
+
+from core.models import AntrhopometricHistory
+
+INPUTS = ('height', 'weight', 'neck', 'waist', 'hip')
+METRICS = ('bmi', 'body_fat', 'waist_hip_ratio', 'waist_height_ratio')
+TREND_METRICS = ('weight', 'bmi', 'body_fat', 'waist')
+
+# Measurements averaged by the moving averages
+DEFAULT_WINDOW = 4
+DEFAULT_BATCH_SIZE = 2000
+# Rows written per UPDATE statement
+UPDATE_BATCH_SIZE = 1000
+
+# Body fat percentages outside this range come from bad measurements
+BODY_FAT_RANGE = (2.0, 75.0)
+
+CACHE_PREFIX = 'anthropometrics'
+CACHE_DEFAULTS = {
+    'CACHE': 'default',
+    'TIMEOUT': 300,
+}
+
+Arrays = Dict[str, np.ndarray]
+
+
+def load(queryset: QuerySet) -> Arrays:
+    """Measurements of ``queryset`` as arrays, ordered by user and date."""
+    rows = list(
+        queryset.order_by('user_id', 'date', 'id')
+        .values_list('id', 'user_id', 'user__sex', 'date', *INPUTS)
+    )
+    columns = list(zip(*rows)) or [()] * (4 + len(INPUTS))
+    data = {
+        'id': np.array(columns[0], dtype=np.int64),
+        'user_id': np.array(columns[1], dtype=np.int64),
+        'sex': np.array(columns[2], dtype='U1'),
+        'date': np.array(columns[3], dtype='datetime64[D]'),
+    }
+    for name, column in zip(INPUTS, columns[4:]):
+        data[name] = np.array(column, dtype=np.float64)
+    return data
+
+
+def _valid(values: np.ndarray) -> np.ndarray:
+    """Replace infinities and non positive results with NaN."""
+    return np.where(np.isfinite(values) & (values > 0), values, np.nan)
+
+
+def body_composition(data: Arrays) -> Arrays:
+    """BMI, body fat and ratios of every row, NaN where undefined."""
+    height, weight = data['height'], data['weight']
+    neck, waist, hip = data['neck'], data['waist'], data['hip']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        male = 495 / (
+            1.0324 - 0.19077 * np.log10(waist - neck)
+            + 0.15456 * np.log10(height)
+        ) - 450
+        female = 495 / (
+            1.29579 - 0.35004 * np.log10(waist + hip - neck)
+            + 0.22100 * np.log10(height)
+        ) - 450
+        body_fat = np.where(
+            data['sex'] == 'M', male,
+            np.where(data['sex'] == 'F', female, np.nan),
+        )
+        low, high = BODY_FAT_RANGE
+        body_fat = np.where(
+            (body_fat >= low) & (body_fat <= high), body_fat, np.nan
+        )
+        return {
+            'bmi': _valid(weight / (height / 100) ** 2),
+            'body_fat': body_fat,
+            'waist_hip_ratio': _valid(waist / hip),
+            'waist_height_ratio': _valid(waist / height),
+        }
+
+
+def group_starts(user_ids: np.ndarray) -> np.ndarray:
+    """Index of the first row of each row's user."""
+    index = np.arange(len(user_ids))
+    first = np.ones(len(user_ids), dtype=bool)
+    first[1:] = user_ids[1:] != user_ids[:-1]
+    return np.maximum.accumulate(np.where(first, index, 0))
+
+
+def moving_average(
+    values: np.ndarray, starts: np.ndarray, window: int
+) -> np.ndarray:
+    """Mean of the last ``window`` values of the same user, NaN skipped."""
+    known = ~np.isnan(values)
+    sums = np.concatenate(([0.0], np.cumsum(np.where(known, values, 0.0))))
+    counts = np.concatenate(([0], np.cumsum(known)))
+    index = np.arange(len(values))
+    lower = np.maximum(index - window + 1, starts)
+    count = counts[index + 1] - counts[lower]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(
+            count > 0, (sums[index + 1] - sums[lower]) / count, np.nan
+        )
+
+
+def weekly_change(
+    values: np.ndarray, dates: np.ndarray, starts: np.ndarray
+) -> np.ndarray:
+    """Change per 7 days since the previous measurement of the user."""
+    change = np.full(len(values), np.nan)
+    if len(values) < 2:
+        return change
+    days = (dates[1:] - dates[:-1]).astype(np.float64)
+    follows = starts[1:] != np.arange(1, len(values))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        change[1:] = np.where(
+            follows & (days > 0), (values[1:] - values[:-1]) / days * 7,
+            np.nan,
+        )
+    return change
+
+
+def analyze(data: Arrays, window: int = DEFAULT_WINDOW) -> Arrays:
+    """Body composition of every row plus the trends of TREND_METRICS."""
+    metrics = {**data, **body_composition(data)}
+    starts = group_starts(data['user_id'])
+    for name in TREND_METRICS:
+        metrics[f'{name}_average'] = moving_average(
+            metrics[name], starts, window
+        )
+        metrics[f'{name}_weekly_change'] = weekly_change(
+            metrics[name], data['date'], starts
+        )
+    return metrics
+
+
+def _none_if_nan(value) -> Optional[float]:
+    value = float(value)
+    return None if np.isnan(value) else value
+
+
+def _row(metrics: Arrays, index: int, names: Iterable[str]) -> dict:
+    row = {'id': int(metrics['id'][index]),
+           'date': metrics['date'][index].item()}
+    for name in names:
+        value = _none_if_nan(metrics[name][index])
+        row[name] = None if value is None else round(value, 2)
+    return row
+
+
+def _report_names() -> List[str]:
+    return [*INPUTS, *METRICS] + [
+        f'{name}_{suffix}' for name in TREND_METRICS
+        for suffix in ('average', 'weekly_change')
+    ]
+
+
+def cache_options() -> dict:
+    return {**CACHE_DEFAULTS, **getattr(settings, 'ANTHROPOMETRICS_CACHE', {})}
+
+
+def _cache():
+    return caches[cache_options()['CACHE']]
+
+
+def _cache_key(user_id: int) -> str:
+    return f'{CACHE_PREFIX}:{user_id}'
+
+
+def user_report(user_id: int, window: int = DEFAULT_WINDOW) -> List[dict]:
+    """
+    Every measurement of a user, oldest first, with its metrics and
+    trends. Cached until the user's measurements change, see the module
+    docstring.
+    """
+    cache = _cache()
+    reports = cache.get(_cache_key(user_id)) or {}
+    if window not in reports:
+        metrics = analyze(
+            load(AntrhopometricHistory.objects.filter(user_id=user_id)),
+            window,
+        )
+        names = _report_names()
+        reports[window] = [
+            _row(metrics, index, names)
+            for index in range(len(metrics['id']))
+        ]
+        cache.set(_cache_key(user_id), reports,
+                  cache_options()['TIMEOUT'])
+    return reports[window]
+
+
+def invalidate_user(user_id: int) -> None:
+    _cache().delete(_cache_key(user_id))
+
+
+def cohort_report(
+    user_ids: Iterable[int], window: int = DEFAULT_WINDOW
+) -> dict:
+    """
+    Latest metrics and trends of each user of a cohort, and the cohort
+    mean and median of each of them, from a single query.
+    """
+    metrics = analyze(load(
+        AntrhopometricHistory.objects.filter(user_id__in=list(user_ids))
+    ), window)
+    user_ids = metrics['user_id']
+    last = np.ones(len(user_ids), dtype=bool)
+    last[:-1] = user_ids[:-1] != user_ids[1:]
+    latest = np.flatnonzero(last)
+    names = _report_names()
+    summary = {}
+    for name in names:
+        values = metrics[name][latest]
+        values = values[~np.isnan(values)]
+        summary[name] = {
+            'mean': round(float(values.mean()), 2) if len(values) else None,
+            'median': (round(float(np.median(values)), 2)
+                       if len(values) else None),
+        }
+    return {
+        'users': len(latest),
+        'latest': {
+            int(user_ids[index]): _row(metrics, index, names)
+            for index in latest
+        },
+        'summary': summary,
+    }
+
+
+def derive(instance: AntrhopometricHistory) -> None:
+    """Fill the derived fields of a single unsaved measurement."""
+    data = {name: np.array([getattr(instance, name)], dtype=np.float64)
+            for name in INPUTS}
+    data['sex'] = np.array([instance.user.sex], dtype='U1')
+    for name, values in body_composition(data).items():
+        setattr(instance, name, _none_if_nan(values[0]))
+
+
+def _update_columns(ids: np.ndarray, columns: Arrays) -> None:
+    """
+    Write per row values with one ``UPDATE ... SET c = CASE id ...`` per
+    batch of rows. bulk_update builds an ORM expression per row and
+    value, which costs more than the database work for this table.
+    """
+    quote = connection.ops.quote_name
+    table = quote(AntrhopometricHistory._meta.db_table)
+    names = list(columns)
+    # Each row takes two parameters per column plus one in the IN list
+    per_row = 2 * len(names) + 1
+    size = min(
+        UPDATE_BATCH_SIZE,
+        (connection.features.max_query_params or UPDATE_BATCH_SIZE * per_row)
+        // per_row,
+    )
+    with connection.cursor() as cursor:
+        for start in range(0, len(ids), size):
+            batch = [int(row_id) for row_id in ids[start:start + size]]
+            assignments, params = [], []
+            for name in names:
+                values = columns[name][start:start + size]
+                assignments.append(
+                    f'{quote(name)} = CASE {quote("id")} '
+                    + 'WHEN %s THEN %s ' * len(batch) + 'END'
+                )
+                for row_id, value in zip(batch, values):
+                    params += [row_id, _none_if_nan(value)]
+            cursor.execute(
+                f'UPDATE {table} SET {", ".join(assignments)} '
+                f'WHERE {quote("id")} IN ({", ".join(["%s"] * len(batch))})',
+                params + batch,
+            )
+
+
+def _user_batches(queryset: QuerySet, size: int) -> Iterator[List[int]]:
+    user_ids = list(
+        queryset.order_by('user_id').values_list('user_id', flat=True)
+        .distinct()
+    )
+    for start in range(0, len(user_ids), size):
+        yield user_ids[start:start + size]
+
+
+def backfill(
+    batch_size: int = DEFAULT_BATCH_SIZE, missing_only: bool = False
+) -> Dict[str, int]:
+    """
+    Compute and store the derived fields of every measurement, or only
+    of rows that have none yet, ``batch_size`` users at a time.
+    """
+    queryset = AntrhopometricHistory.objects.all()
+    if missing_only:
+        queryset = queryset.filter(bmi__isnull=True)
+    stats = {'users': 0, 'rows': 0}
+    for user_ids in _user_batches(queryset, batch_size):
+        data = load(queryset.filter(user_id__in=user_ids))
+        with transaction.atomic():
+            _update_columns(data['id'], body_composition(data))
+        _cache().delete_many(
+            [_cache_key(user_id) for user_id in user_ids]
+        )
+        stats['users'] += len(user_ids)
+        stats['rows'] += len(data['id'])
+    return stats
@@ -0,0 +1,133 @@
+"""
+Archive layout for the largest history tables.
+
+Ingestion (with its FoodIngestion rows) and SleepHistory grow with every
+user interaction, while reads almost always target recent days. Rows
+older than a retention window are moved, with their ids, to archive
+tables of the same shape, in chunks that each run in a short
+transaction. The hot tables and their ``(user, date)`` indexes stay
+small, and ``history_range`` reads across both tables when a range
+reaches into the archive.
+
+ExerciseHistory and WorkoutHistory are not archived: the training
+rollups are recomputed from them, so their rows must stay in place.
+"""
+import time
+from datetime import date, datetime
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+from django.db import transaction
+from django.utils import timezone
+
+from core.models import (
+    FoodIngestion, FoodIngestionArchive, Ingestion, IngestionArchive,
+    SleepHistory, SleepHistoryArchive,
+)
+
+DEFAULT_CHUNK_SIZE = 5000
+DEFAULT_RETENTION_DAYS = 365
+
+
+class ArchiveSpec(NamedTuple):
+    """A hot table, its archive table and the child rows moved along."""
+    model: type
+    archive: type
+    # (child model, child archive model, FK field pointing to ``model``)
+    children: Tuple[Tuple[type, type, str], ...] = ()
+
+
+ARCHIVES = {
+    'ingestion': ArchiveSpec(
+        Ingestion, IngestionArchive,
+        children=((FoodIngestion, FoodIngestionArchive, 'ingestion_id'),),
+    ),
+    'sleep': ArchiveSpec(SleepHistory, SleepHistoryArchive),
+}
+
+
+def _columns(model) -> List[str]:
+    return [field.attname for field in model._meta.concrete_fields]
+
+
+def _copy(model, archive, queryset) -> int:
+    """Insert the rows of ``queryset`` into ``archive``, ids included."""
+    rows = [archive(**values)
+            for values in queryset.values(*_columns(model))]
+    archive.objects.bulk_create(rows)
+    return len(rows)
+
+
+def _cutoff(spec: ArchiveSpec, before: date) -> Union[date, datetime]:
+    if spec.model._meta.get_field('date').get_internal_type() == 'DateField':
+        return before
+    return timezone.make_aware(datetime.combine(before, datetime.min.time()))
+
+
+def archive_chunk(spec: ArchiveSpec, ids: List[int]) -> int:
+    """Move the rows ``ids`` of ``spec.model`` and their children."""
+    with transaction.atomic():
+        moved = _copy(
+            spec.model, spec.archive, spec.model.objects.filter(id__in=ids)
+        )
+        for child, child_archive, field in spec.children:
+            children = child.objects.filter(**{f'{field}__in': ids})
+            _copy(child, child_archive, children)
+            children.delete()
+        spec.model.objects.filter(id__in=ids).delete()
+    return moved
+
+
+def archive_before(
+    spec: ArchiveSpec,
+    before: date,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    pause: float = 0,
+) -> Iterator[int]:
+    """
+    Move the rows dated before ``before`` to the archive, oldest ids
+    first. Yields the number of rows moved by each chunk, so callers can
+    report progress; ``pause`` seconds are slept between chunks to leave
+    room for the regular traffic.
+    """
+    cutoff = _cutoff(spec, before)
+    last_id = 0
+    while True:
+        ids = list(
+            spec.model.objects
+            .filter(date__lt=cutoff, id__gt=last_id)
+            .order_by('id')
+            .values_list('id', flat=True)[:chunk_size]
+        )
+        if not ids:
+            return
+        yield archive_chunk(spec, ids)
+        last_id = ids[-1]
+        if pause:
+            time.sleep(pause)
+
+
+def history_range(
+    name: str,
+    user_id: int,
+    start: date,
+    end: Optional[date] = None,
+    include_archive: bool = True,
+) -> List[Dict]:
+    """
+    Rows of a user's ``name`` history dated in ``[start, end)``, oldest
+    first, as dicts. Both tables are read through their ``(user, date)``
+    index, so a range entirely in the hot table costs one cheap probe of
+    the archive; pass ``include_archive=False`` to skip it.
+    """
+    spec = ARCHIVES[name]
+    models = [spec.model, spec.archive] if include_archive else [spec.model]
+    rows = []
+    for model in models:
+        queryset = model.objects.filter(
+            user_id=user_id, date__gte=_cutoff(spec, start)
+        )
+        if end is not None:
+            queryset = queryset.filter(date__lt=_cutoff(spec, end))
+        rows.extend(queryset.values(*_columns(spec.model)))
+    rows.sort(key=lambda row: (row['date'], row['id']))
+    return rows
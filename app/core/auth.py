@@ -0,0 +1,112 @@
+"""
+Authentication without queries or writes on the hot path.
+
+Every authenticated request reads its session and then its user. Here
+both come from a cache:
+
+* ``SessionStore`` (``SESSION_ENGINE = 'core.auth'``) is the cached_db
+  engine of Django, reading the session from the cache and falling back
+  to the database, with cache entries kept for at most
+  ``AUTH_CACHE['TIMEOUT']`` seconds instead of the session lifetime
+* ``CachedModelBackend`` caches the user of a session for the same
+  time; saving or deleting a user drops it, and the bulk ``update()``
+  calls on users drop it with ``forget_users``
+* ``update_last_login`` replaces Django's receiver of ``user_logged_in``
+  and writes ``last_login`` at most once per LAST_LOGIN_INTERVAL
+
+With the default per-process cache, a logout or a deactivation is seen
+by the other workers once their entry expires, so TIMEOUT is short; with
+a cache shared by the workers (AUTH_CACHE_BACKEND) it is immediate and
+TIMEOUT can be raised.
+
+Settings (all optional)::
+
+    AUTH_CACHE = {
+        'CACHE': 'default',           # alias in CACHES
+        'TIMEOUT': 60,                # seconds an entry is trusted
+        'LAST_LOGIN_INTERVAL': 3600,  # seconds between last_login writes
+    }
+"""
+from datetime import timedelta
+from typing import Iterable
+
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.sessions.backends import cached_db
+from django.core.cache import caches
+from django.utils import timezone
+
+DEFAULTS = {
+    'CACHE': 'default',
+    'TIMEOUT': 60,
+    'LAST_LOGIN_INTERVAL': 3600,
+}
+KEY_PREFIX = 'auth:user:'
+
+
+def options() -> dict:
+    return {**DEFAULTS, **getattr(settings, 'AUTH_CACHE', {})}
+
+
+def _cache():
+    return caches[options()['CACHE']]
+
+
+def forget_users(user_ids: Iterable[int]) -> None:
+    """Drop the cached users, after they were changed with update()."""
+    _cache().delete_many([f'{KEY_PREFIX}{user_id}' for user_id in user_ids])
+
+
+class CachedModelBackend(ModelBackend):
+    """ModelBackend reading the users of sessions from the cache."""
+
+    def get_user(self, user_id):
+        cache = _cache()
+        key = f'{KEY_PREFIX}{user_id}'
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is None:
+                return None
+            cache.set(key, user, options()['TIMEOUT'])
+        return user if self.user_can_authenticate(user) else None
+
+
+def update_last_login(sender, user, **kwargs):
+    """Store the login time, unless one was stored recently."""
+    now = timezone.now()
+    interval = timedelta(seconds=options()['LAST_LOGIN_INTERVAL'])
+    if user.last_login and now - user.last_login < interval:
+        return
+    # One column, and no post_save reaching every receiver of users
+    type(user)._base_manager.filter(pk=user.pk).update(last_login=now)
+    user.last_login = now
+    forget_users([user.pk])
+
+
+class SessionStore(cached_db.SessionStore):
+    """cached_db sessions, cached for at most AUTH_CACHE['TIMEOUT']."""
+
+    def _cache_timeout(self, **kwargs) -> int:
+        return min(self.get_expiry_age(**kwargs), options()['TIMEOUT'])
+
+    def load(self):
+        try:
+            data = self._cache.get(self.cache_key)
+        except Exception:
+            # Some backends (e.g. memcache) raise an exception on
+            # invalid cache keys
+            data = None
+        if data is None:
+            session = self._get_session_from_db()
+            if not session:
+                return {}
+            data = self.decode(session.session_data)
+            self._cache.set(self.cache_key, data,
+                            self._cache_timeout(expiry=session.expire_date))
+        return data
+
+    def save(self, must_create=False):
+        # The database write of cached_db's parent, then a capped entry
+        super(cached_db.SessionStore, self).save(must_create)
+        self._cache.set(self.cache_key, self._session, self._cache_timeout())
@@ -0,0 +1,346 @@
+"""
+Benchmark suite of the main read and write paths.
+
+Each benchmark runs ``repeat`` times against the synthetic users of
+core.synthetic, picking its inputs with a seeded generator, and records
+wall time percentiles and the SQL statements each run executes. Setup
+work such as clearing a cache is not timed, and writes are rolled back
+so the suite can run again on the same data.
+
+``run_suite`` returns a JSON serializable report and ``compare`` lists
+the benchmarks whose median got slower than in a baseline report.
+"""
+import csv
+import os
+import platform
+import random
+import tempfile
+from datetime import date, timedelta
+from decimal import Decimal
+from statistics import mean, median
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional
+
+import django
+from django.db import connection, transaction
+from django.utils import timezone
+
+from core import anthropometrics
+from core.archive import history_range
+from core.catalog_cache import catalog_cache
+from core.meal_plans import plan_users
+from core.management.commands.load_data import Command as LoadData
+from core.models import (
+    AntrhopometricHistory, Excercises, ExerciseHistory, Food,
+    FoodIngestion, Ingestion, NutritionHistory, SleepHistory,
+    TrainingRollup, WorkoutHistory,
+)
+from core.nutrition import daily_totals
+from core.sessions import exercise_index
+from core.synthetic import synthetic_users
+from food.search import search_foods
+from user.views import EXCERCISES_PAGE_SIZE, excercises_page
+
+DEFAULT_REPEAT = 50
+# Slower medians within this share of the baseline are noise
+DEFAULT_TOLERANCE = 0.2
+# Nor are slowdowns below this many milliseconds
+MIN_REGRESSION_MS = 0.5
+LOAD_DATA_ROWS = 2000
+MEAL_PLAN_USERS = 100
+
+REPORT_MODELS = (
+    Ingestion, FoodIngestion, WorkoutHistory, ExerciseHistory,
+    SleepHistory, AntrhopometricHistory, NutritionHistory, TrainingRollup,
+    Food, Excercises,
+)
+
+
+class Context(NamedTuple):
+    """Inputs shared by the benchmarks of one run."""
+    user_ids: List[int]
+    today: date
+    food_words: List[str]
+    target_muscles: List[str]
+    workdir: str
+
+
+# name -> function(rng, context) doing the untimed setup and returning
+# the callable to time, which may return the number of rows it handled
+BENCHMARKS: Dict[str, Callable[[random.Random, Context], Callable]] = {}
+
+
+def benchmark(name: str):
+    def register(function):
+        BENCHMARKS[name] = function
+        return function
+    return register
+
+
+def dashboard(user_id: int, today: date) -> dict:
+    """The reads behind a user's dashboard: last days of every history."""
+    week = {today - timedelta(days=offset) for offset in range(7)}
+    month = today - timedelta(days=30)
+    return {
+        'nutrition_week': daily_totals([user_id], week),
+        'nutrition_history': list(
+            NutritionHistory.objects
+            .filter(user_id=user_id, date__date__gte=month)
+            .order_by('date')
+        ),
+        'workouts': list(
+            WorkoutHistory.objects.filter(user_id=user_id)
+            .order_by('-date')[:10]
+        ),
+        'training_weeks': list(
+            TrainingRollup.objects
+            .filter(user_id=user_id, period='week',
+                    period_start__gte=today - timedelta(weeks=12))
+            .order_by('period_start')
+        ),
+        'sleep': history_range('sleep', user_id, month, today),
+        'body': anthropometrics.user_report(user_id)[-12:],
+    }
+
+
+@benchmark('dashboard')
+def _dashboard(rng, context):
+    user_id = rng.choice(context.user_ids)
+    # Measure the anthropometric report as computed, not as cached
+    anthropometrics.invalidate_user(user_id)
+    return lambda: dashboard(user_id, context.today)
+
+
+@benchmark('catalog_page_cold')
+def _catalog_page_cold(rng, context):
+    catalog_cache.clear()
+    return lambda: excercises_page({}, 0, EXCERCISES_PAGE_SIZE)
+
+
+@benchmark('catalog_page_filtered')
+def _catalog_page_filtered(rng, context):
+    catalog_cache.clear()
+    filters = {}
+    if context.target_muscles:
+        filters['target_muscle'] = rng.choice(context.target_muscles)
+    return lambda: excercises_page(filters, 0, EXCERCISES_PAGE_SIZE)
+
+
+@benchmark('food_search')
+def _food_search(rng, context):
+    word = rng.choice(context.food_words or ['a'])
+    prefix = word[:rng.randint(1, len(word))]
+    return lambda: search_foods(prefix)
+
+
+@benchmark('history_ingestion_90d')
+def _history_ingestion(rng, context):
+    user_id = rng.choice(context.user_ids)
+    start = context.today - timedelta(days=90)
+    return lambda: history_range('ingestion', user_id, start)
+
+
+@benchmark('history_sleep_365d')
+def _history_sleep(rng, context):
+    user_id = rng.choice(context.user_ids)
+    start = context.today - timedelta(days=365)
+    return lambda: history_range('sleep', user_id, start)
+
+
+def _rolled_back(function: Callable[[], Any]) -> Callable[[], Any]:
+    def run():
+        with transaction.atomic():
+            result = function()
+            transaction.set_rollback(True)
+        return result
+    return run
+
+
+@benchmark('meal_log')
+def _meal_log(rng, context):
+    user_id = rng.choice(context.user_ids)
+    food_ids = list(Food.objects.values_list('id', flat=True)[:50])
+
+    def log():
+        ingestion = Ingestion.objects.create(
+            user_id=user_id, meal_number=rng.randint(1, 5),
+            value=Decimal(rng.randint(5000, 50000)) / 100,
+        )
+        FoodIngestion.objects.bulk_create([
+            FoodIngestion(food_id_id=food_id, ingestion_id=ingestion)
+            for food_id in rng.sample(food_ids, min(len(food_ids), 3))
+        ])
+    return _rolled_back(log)
+
+
+@benchmark('measurement_log')
+def _measurement_log(rng, context):
+    user_id = rng.choice(context.user_ids)
+    return _rolled_back(lambda: AntrhopometricHistory.objects.create(
+        user_id=user_id, height=rng.uniform(155, 190),
+        weight=rng.uniform(55, 110), neck=rng.uniform(30, 42),
+        waist=rng.uniform(65, 110), hip=rng.uniform(85, 115),
+    ))
+
+
+@benchmark('meal_plan')
+def _meal_plan(rng, context):
+    user_ids = rng.sample(context.user_ids,
+                          min(len(context.user_ids), MEAL_PLAN_USERS))
+    return _rolled_back(
+        lambda: plan_users(user_ids, context.today)['planned']
+    )
+
+
+@benchmark('workout_session')
+def _workout_session(rng, context):
+    index = exercise_index()
+    days = rng.randint(2, 6)
+    day, rotation = rng.randrange(days), rng.randrange(52)
+    return lambda: index.session(None, days, day, rotation)
+
+
+@benchmark('load_data')
+def _load_data(rng, context):
+    file_path = os.path.join(context.workdir, 'food.csv')
+    if not os.path.exists(file_path):
+        _write_food_csv(file_path, LOAD_DATA_ROWS)
+    options = {'restart': True, 'workers': 1, 'batch_size': 1000,
+               'on_conflict': 'skip'}
+    return _rolled_back(lambda: LoadData().load_file(
+        file_path, 'food', options
+    )['rows'])
+
+
+def _write_food_csv(file_path: str, rows: int) -> None:
+    rng = random.Random(rows)
+    with open(file_path, 'w', newline='') as output:
+        writer = csv.writer(output)
+        writer.writerow(['name', 'enter_by', 'brand', 'type',
+                         'carbohydrates', 'proteins', 'fats', 'fibers',
+                         'sodium', 'calories'])
+        for number in range(rows):
+            writer.writerow([
+                f'Benchmark food {number}', 'bench', 'Benchmark', 'solid',
+                *(f'{rng.uniform(0, 99):.1f}' for _ in range(6)),
+            ])
+
+
+class _QueryCounter:
+    """Execute wrapper counting the statements run while installed."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def _percentile(timings: List[float], percentile: float) -> float:
+    return timings[min(len(timings) - 1, int(len(timings) * percentile))]
+
+
+def run_benchmark(
+    name: str, context: Context, repeat: int, seed: int
+) -> Dict[str, Any]:
+    rng = random.Random(f'{seed}:{name}')
+    timings, queries, rows = [], [], 0
+    for _ in range(repeat):
+        function = BENCHMARKS[name](rng, context)
+        counter = _QueryCounter()
+        with connection.execute_wrapper(counter):
+            start = perf_counter()
+            result = function()
+            timings.append((perf_counter() - start) * 1000)
+        queries.append(counter.count)
+        if isinstance(result, int):
+            rows += result
+    timings.sort()
+    stats = {
+        'runs': repeat,
+        'p50_ms': round(median(timings), 3),
+        'p95_ms': round(_percentile(timings, 0.95), 3),
+        'max_ms': round(timings[-1], 3),
+        'mean_ms': round(mean(timings), 3),
+        'queries': median(queries),
+    }
+    if rows:
+        stats['rows_per_second'] = round(rows / (sum(timings) / 1000))
+    return stats
+
+
+def build_context(seed: int) -> Context:
+    user_ids = list(synthetic_users().order_by('id')
+                    .values_list('id', flat=True))
+    rng = random.Random(seed)
+    names = list(Food.objects.values_list('name', flat=True)[:1000])
+    words = sorted({word.lower() for name in names for word in name.split()
+                    if word.isalpha() and len(word) > 2})
+    return Context(
+        user_ids=user_ids,
+        today=timezone.localdate(),
+        food_words=rng.sample(words, min(len(words), 200)),
+        target_muscles=sorted(set(
+            Excercises.objects.values_list('target_muscle', flat=True)
+        )),
+        workdir=tempfile.mkdtemp(prefix='bench_suite-'),
+    )
+
+
+def run_suite(
+    names: Optional[Iterable[str]] = None,
+    repeat: int = DEFAULT_REPEAT,
+    seed: int = 42,
+    progress: Optional[Callable[[str, dict], None]] = None,
+) -> Dict[str, Any]:
+    """Run the ``names`` benchmarks (all by default) and report them."""
+    context = build_context(seed)
+    if not context.user_ids:
+        raise LookupError('No synthetic users, run generate_data first')
+    results = {}
+    try:
+        for name in names or BENCHMARKS:
+            results[name] = run_benchmark(name, context, repeat, seed)
+            if progress:
+                progress(name, results[name])
+    finally:
+        for entry in os.scandir(context.workdir):
+            os.remove(entry.path)
+        os.rmdir(context.workdir)
+    return {
+        'created': timezone.now().isoformat(),
+        'environment': {
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'machine': platform.machine(),
+        },
+        'seed': seed,
+        'repeat': repeat,
+        'data': {
+            'synthetic_users': len(context.user_ids),
+            **{model._meta.object_name: model.objects.count()
+               for model in REPORT_MODELS},
+        },
+        'benchmarks': results,
+    }
+
+
+def compare(
+    report: dict, baseline: dict, tolerance: float = DEFAULT_TOLERANCE
+) -> List[Dict[str, Any]]:
+    """Benchmarks of ``report`` whose median regressed from ``baseline``."""
+    regressions = []
+    for name, stats in report['benchmarks'].items():
+        previous = baseline.get('benchmarks', {}).get(name)
+        if previous is None:
+            continue
+        before, after = previous['p50_ms'], stats['p50_ms']
+        if after > before * (1 + tolerance) \
+                and after - before >= MIN_REGRESSION_MS:
+            regressions.append({
+                'benchmark': name, 'baseline_ms': before, 'p50_ms': after,
+                'change': round(after / before - 1, 3) if before else None,
+            })
+    return regressions
@@ -0,0 +1,205 @@
+"""
+Read-through cache for the reference catalogs.
+
+Excercises, Food, Question, SleepQuestion, ProgramType and Workouts are
+near-static, so reads of them are cached in process with a TTL and LRU
+eviction. Optionally a Django cache alias (e.g. memcached or redis) is
+used as a second, shared tier. Every cached key embeds the version of
+its catalog; saving, deleting or bulk loading rows bumps the version,
+which makes every entry of that catalog unreachable at once.
+
+Versions live in the process unless SHARED_BACKEND is set: a change
+then only reaches the process that made it, and the other workers (or
+all of them, after a command such as load_data) serve their entries
+until TIMEOUT expires. Keep TIMEOUT short without a shared backend.
+
+Settings (all optional)::
+
+    CATALOG_CACHE = {
+        'MAX_ENTRIES': 2048,     # in-process entries before LRU eviction
+        'TIMEOUT': 30,           # seconds an entry stays valid
+        'SHARED_BACKEND': None,  # alias in CACHES used as shared tier
+        'VERSION_TIMEOUT': 1,    # seconds a shared version is trusted
+        'WARM_UP': ['core.Excercises', 'core.ProgramType'],
+    }
+"""
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DatabaseError
+
+from core.models import (
+    Excercises, Food, ProgramType, Question, SleepQuestion, Workouts,
+)
+
+logger = logging.getLogger(__name__)
+
+CATALOG_MODELS = (
+    Excercises, Food, Question, SleepQuestion, ProgramType, Workouts,
+)
+
+DEFAULTS = {
+    'MAX_ENTRIES': 2048,
+    'TIMEOUT': 30,
+    'SHARED_BACKEND': None,
+    'VERSION_TIMEOUT': 1,
+    'WARM_UP': [
+        'core.Excercises', 'core.Question', 'core.ProgramType',
+        'core.Workouts',
+    ],
+}
+
+_MISSING = object()
+
+
+def _label(model) -> str:
+    return model._meta.label_lower
+
+
+class CatalogCache:
+    """Versioned two-tier (process, shared) cache of catalog reads."""
+
+    def __init__(self, options: Optional[dict] = None):
+        options = {**DEFAULTS, **(options or {})}
+        self.max_entries = options['MAX_ENTRIES']
+        self.timeout = options['TIMEOUT']
+        self.version_timeout = options['VERSION_TIMEOUT']
+        self.shared_alias = options['SHARED_BACKEND']
+        self.warm_up_models = options['WARM_UP']
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._versions: Dict[str, int] = defaultdict(int)
+        self._version_checked: Dict[str, float] = {}
+        self._stats = defaultdict(lambda: defaultdict(int))
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias] if self.shared_alias else None
+
+    # Versions ---------
+
+    def version(self, model) -> int:
+        """Current version of a catalog, shared across processes if set."""
+        label = _label(model)
+        if self.shared is None:
+            return self._versions[label]
+        now = time.monotonic()
+        if now - self._version_checked.get(label, 0) > self.version_timeout:
+            version = self.shared.get(f'catalog:{label}:version')
+            if version is None:
+                version = time.time_ns()
+                self.shared.add(f'catalog:{label}:version', version, None)
+            self._versions[label] = version
+            self._version_checked[label] = now
+        return self._versions[label]
+
+    def invalidate(self, model) -> None:
+        """
+        Drop every cached read of ``model`` in this process, and in all
+        processes when SHARED_BACKEND is set.
+        """
+        label = _label(model)
+        with self._lock:
+            self._versions[label] += 1
+            self._stats[label]['invalidations'] += 1
+            for key in [key for key in self._entries if key[0] == label]:
+                del self._entries[key]
+        if self.shared is not None:
+            # A timestamp version avoids incr() races on a missing key
+            self.shared.set(f'catalog:{label}:version', time.time_ns(), None)
+            self._version_checked.pop(label, None)
+
+    # Reads ---------
+
+    def get_or_load(
+        self, model, key: Hashable, loader: Callable[[], Any]
+    ) -> Any:
+        """
+        Return the cached value of ``key`` for the ``model`` catalog, or
+        call ``loader`` and cache its result.
+        """
+        label = _label(model)
+        entry_key = (label, self.version(model), key)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(entry_key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(entry_key)
+                self._stats[label]['hits'] += 1
+                return entry[1]
+
+        value = _MISSING
+        digest = hashlib.md5(repr(key).encode()).hexdigest()
+        shared_key = f'catalog:{label}:{entry_key[1]}:{digest}'
+        if self.shared is not None:
+            value = self.shared.get(shared_key, _MISSING)
+        counter = 'misses' if value is _MISSING else 'shared_hits'
+        if value is _MISSING:
+            value = loader()
+            if self.shared is not None:
+                self.shared.set(shared_key, value, self.timeout)
+
+        with self._lock:
+            self._stats[label][counter] += 1
+            self._entries[entry_key] = (now + self.timeout, value)
+            self._entries.move_to_end(entry_key)
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                self._stats[evicted[0]]['evictions'] += 1
+        return value
+
+    def all(self, model) -> list:
+        """Every row of a catalog, ordered by primary key."""
+        return self.get_or_load(
+            model, 'all', lambda: list(model.objects.order_by('pk'))
+        )
+
+    def get(self, model, pk) -> Optional[Any]:
+        """A single catalog row by primary key, None if it doesn't exist."""
+        return self.get_or_load(
+            model, f'pk={pk}', lambda: model.objects.filter(pk=pk).first()
+        )
+
+    def filter(self, model, **lookups) -> list:
+        """Rows matching ``lookups``, ordered by primary key."""
+        key = 'filter:' + '&'.join(
+            f'{name}={value}' for name, value in sorted(lookups.items())
+        )
+        return self.get_or_load(
+            model, key,
+            lambda: list(model.objects.filter(**lookups).order_by('pk')),
+        )
+
+    # Maintenance ---------
+
+    def warm_up(self, models: Optional[Iterable] = None) -> None:
+        """Load whole catalogs up front, e.g. when a worker starts."""
+        for model in models or self.warm_up_models:
+            if isinstance(model, str):
+                model = apps.get_model(model)
+            try:
+                self.all(model)
+            except DatabaseError:
+                logger.warning('Could not warm up %s', _label(model))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Hit, miss, eviction and invalidation counters per catalog."""
+        with self._lock:
+            return {
+                label: dict(counters)
+                for label, counters in self._stats.items()
+            }
+
+
+catalog_cache = CatalogCache(getattr(settings, 'CATALOG_CACHE', None))
@@ -0,0 +1,38 @@
+"""
+Database connection reuse helpers.
+
+With ``CONN_MAX_AGE`` each worker keeps its connection open across
+requests. Django 4.0 only tests a persistent connection after a query
+failed, so a connection dropped by MySQL (``wait_timeout``, restarts,
+failovers) breaks the first query of the next request. The handler below
+pings idle persistent connections when a request starts and reconnects
+if the ping fails.
+
+Persistent connections are only reused by the WSGI application: under
+ASGI the settings turn CONN_MAX_AGE off and the handler has nothing to
+check.
+"""
+import time
+
+from django.conf import settings
+from django.db import connections
+
+# Seconds between pings of the same connection (0 pings on every request)
+DEFAULT_HEALTH_CHECK_INTERVAL = 10
+
+
+def check_persistent_connections(**kwargs) -> None:
+    """request_started handler closing unusable persistent connections."""
+    interval = getattr(
+        settings, 'DB_HEALTH_CHECK_INTERVAL', DEFAULT_HEALTH_CHECK_INTERVAL
+    )
+    now = time.monotonic()
+    for connection in connections.all():
+        if connection.connection is None or connection.in_atomic_block:
+            continue
+        checked_at = getattr(connection, 'health_checked_at', 0)
+        if now - checked_at < interval:
+            continue
+        if not connection.is_usable():
+            connection.close()
+        connection.health_checked_at = now
@@ -0,0 +1,79 @@
+"""
+Merge of catalog rows stored several times under the same natural key.
+
+Food (``name``, ``brand``) and Excercises (``exercise_name``) have a
+unique constraint on their natural key, but databases loaded before it
+existed can hold a key several times (restarted ``load_data`` runs
+inserted their rows again), and ``migrate`` fails to add the constraint
+there. ``merge`` keeps the oldest row of each key, points the rows
+referencing the other ones to it and deletes them. Only the key columns
+and the foreign keys are read, so it runs before ``migrate`` on a schema
+that lacks the columns of newer models; tables not created yet are
+skipped.
+"""
+from typing import Dict, List
+
+from django.db import connection, transaction
+from django.db.models import Count, Min
+
+from core.catalog_cache import catalog_cache
+from core.management.commands.load_data import NATURAL_KEYS
+from core.retention import relations
+
+
+def _tables() -> set:
+    return set(connection.introspection.table_names())
+
+
+def duplicates(model) -> Dict[int, List[int]]:
+    """``{kept_id: [duplicate ids]}`` of the keys stored several times."""
+    fields = NATURAL_KEYS[model]
+    keys = (
+        model._base_manager.values(*fields)
+        .annotate(rows=Count('id'), kept=Min('id'))
+        .filter(rows__gt=1)
+        .order_by()
+    )
+    return {
+        key['kept']: list(
+            model._base_manager
+            .filter(**{field: key[field] for field in fields})
+            .exclude(id=key['kept'])
+            .values_list('id', flat=True)
+        )
+        for key in keys
+    }
+
+
+def merge(model) -> int:
+    """Merge the duplicates of ``model``, returns the rows deleted."""
+    tables = _tables()
+    if model._meta.db_table not in tables:
+        return 0
+    # Links of the many to many fields derive from the row itself: those
+    # of the duplicates go, the kept row has its own
+    throughs = {field.remote_field.through
+                for field in model._meta.many_to_many}
+    referencing = [relation for relation in relations(model)
+                   if relation.model._meta.db_table in tables]
+    deleted = 0
+    for kept, ids in duplicates(model).items():
+        with transaction.atomic():
+            for relation in referencing:
+                rows = relation.model._base_manager.filter(
+                    **{f'{relation.field}__in': ids}
+                )
+                if relation.model in throughs:
+                    _raw_delete(rows)
+                else:
+                    rows.update(**{relation.field: kept})
+            deleted += _raw_delete(model._base_manager.filter(id__in=ids))
+    if deleted:
+        catalog_cache.invalidate(model)
+    return deleted
+
+
+def _raw_delete(queryset) -> int:
+    # No collector: it would load whole rows, columns of newer models
+    # included, and nothing points to these rows anymore
+    return queryset._raw_delete(queryset.db)
@@ -0,0 +1,192 @@
+"""
+Bulk exports of user histories.
+
+Rows are read in id order with keyset pagination, ``chunk_size`` rows
+per query, so memory stays flat whatever the size of the export: unlike
+``QuerySet.iterator``, this doesn't depend on server-side cursors, which
+MySQLdb doesn't use (it buffers the whole result on the client). Each
+chunk is encoded as CSV, optionally gzip compressed on the fly, or
+appended as a record batch to a Parquet or Arrow IPC file (those need
+pyarrow, imported only when used).
+
+Exports read several queries outside of a transaction, from the
+analytics database when there is one (see core/routers.py): rows written
+during an export may or may not be part of it.
+"""
+import csv
+import io
+import zlib
+from datetime import datetime, time, timedelta
+from typing import Iterable, Iterator, List, NamedTuple, Optional
+
+from django.db import models
+from django.utils import timezone
+
+from core.models import (
+    ExerciseHistory, Ingestion, NutritionHistory, SleepHistory,
+    WorkoutHistory,
+)
+from core.routers import analytics
+
+DEFAULT_CHUNK_SIZE = 5000
+GZIP_LEVEL = 6
+
+
+class Dataset(NamedTuple):
+    model: type
+    # Exported columns (attnames), starting with the primary key
+    columns: tuple
+
+
+def _columns(model) -> tuple:
+    return tuple(field.attname for field in model._meta.concrete_fields)
+
+
+DATASETS = {
+    'meals': Dataset(Ingestion, _columns(Ingestion)),
+    'nutrition': Dataset(NutritionHistory, _columns(NutritionHistory)),
+    'workouts': Dataset(WorkoutHistory, _columns(WorkoutHistory)),
+    'exercises': Dataset(ExerciseHistory, _columns(ExerciseHistory)),
+    'sleep': Dataset(SleepHistory, _columns(SleepHistory)),
+}
+
+
+def _midnight(day) -> datetime:
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def chunks(
+    name: str,
+    user_ids: Optional[Iterable[int]] = None,
+    start=None,
+    end=None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Iterator[List[tuple]]:
+    """
+    Rows of a dataset as tuples of its columns, ``chunk_size`` at a time,
+    for ``user_ids`` (every user by default) and dates from ``start`` to
+    ``end`` included.
+    """
+    dataset = DATASETS[name]
+    queryset = dataset.model.objects.all()
+    if user_ids is not None:
+        queryset = queryset.filter(user_id__in=list(user_ids))
+    if isinstance(dataset.model._meta.get_field('date'),
+                  models.DateTimeField):
+        # Bounds on the column itself, so the (user, date) index applies
+        start = start and _midnight(start)
+        end = end and _midnight(end + timedelta(days=1))
+        end_lookup = 'date__lt'
+    else:
+        end_lookup = 'date__lte'
+    if start is not None:
+        queryset = queryset.filter(date__gte=start)
+    if end is not None:
+        queryset = queryset.filter(**{end_lookup: end})
+    queryset = queryset.order_by('id').values_list(*dataset.columns)
+    after = 0
+    while True:
+        with analytics():
+            chunk = list(queryset.filter(id__gt=after)[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        after = chunk[-1][0]
+
+
+def csv_stream(
+    name: str, stats: Optional[dict] = None, **filters
+) -> Iterator[bytes]:
+    """
+    A dataset as UTF-8 CSV, one piece per chunk of rows. The rows written
+    are counted in ``stats['rows']`` if given.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(DATASETS[name].columns)
+    for chunk in chunks(name, **filters):
+        writer.writerows(chunk)
+        if stats is not None:
+            stats['rows'] = stats.get('rows', 0) + len(chunk)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def gzip_stream(pieces: Iterable[bytes]) -> Iterator[bytes]:
+    """Compress a byte stream into a gzip stream as it is produced."""
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    for piece in pieces:
+        compressed = compressor.compress(piece)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def arrow_schema(name: str):
+    """pyarrow schema of a dataset, from its model fields."""
+    import pyarrow as pa
+
+    model = DATASETS[name].model
+    types = []
+    for column in DATASETS[name].columns:
+        field = next(field for field in model._meta.concrete_fields
+                     if field.attname == column)
+        if isinstance(field, models.DateTimeField):
+            arrow_type = pa.timestamp('us', tz='UTC')
+        elif isinstance(field, models.DateField):
+            arrow_type = pa.date32()
+        elif isinstance(field, models.DecimalField):
+            arrow_type = pa.decimal128(field.max_digits, field.decimal_places)
+        elif isinstance(field, models.FloatField):
+            arrow_type = pa.float64()
+        elif isinstance(field, (models.IntegerField, models.ForeignKey,
+                                models.AutoField)):
+            arrow_type = pa.int64()
+        else:
+            arrow_type = pa.string()
+        types.append(pa.field(column, arrow_type))
+    return pa.schema(types)
+
+
+def _tables(name: str, schema, **filters):
+    """One pyarrow table per chunk of rows."""
+    import pyarrow as pa
+
+    text = [index for index, field in enumerate(schema)
+            if pa.types.is_string(field.type)]
+    for chunk in chunks(name, **filters):
+        columns = [list(column) for column in zip(*chunk)]
+        for index in text:
+            columns[index] = [None if value is None else str(value)
+                              for value in columns[index]]
+        yield pa.Table.from_arrays(
+            [pa.array(column, type=field.type)
+             for column, field in zip(columns, schema)],
+            schema=schema,
+        )
+
+
+def write_columnar(
+    name: str, path: str, file_format: str = 'parquet', **filters
+) -> int:
+    """
+    Write a dataset to a Parquet or Arrow IPC file, one row group or
+    record batch per chunk, and return the number of rows.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = arrow_schema(name)
+    if file_format == 'parquet':
+        writer = pq.ParquetWriter(path, schema, compression='snappy')
+    else:
+        writer = pa.ipc.new_file(path, schema)
+    rows = 0
+    with writer:
+        for table in _tables(name, schema, **filters):
+            writer.write_table(table)
+            rows += table.num_rows
+    return rows
@@ -0,0 +1,360 @@
+"""
+Request instrumentation.
+
+Every request records its wall time, SQL query count and SQL time into
+rolling in-memory histograms per view, and requests running the same SQL
+statement several times (the N+1 pattern) are counted and logged. A
+fraction of the requests can run under cProfile, keeping the profiles of
+the slowest ones on disk. cProfile only sees the thread it was started
+in: for async views, code run through ``sync_to_async`` is missing from
+the profiles.
+
+Queries are captured by an execute wrapper installed on every database
+connection, which records into the request found in a context variable.
+Context variables follow ``sync_to_async``, so queries of async views are
+attributed to their request as well.
+
+Metrics live in the memory of each process: with several workers every
+worker reports its own share of the traffic.
+
+Settings (all optional)::
+
+    INSTRUMENTATION = {
+        'ENABLED': True,
+        'DUPLICATE_THRESHOLD': 3,     # same statement N times flags an N+1
+        'WINDOW': 600,                # seconds covered by the percentiles
+        'SLOTS': 10,                  # window slices rotated out in turn
+        'PROFILE_SAMPLE_RATE': 0.0,   # fraction of requests profiled
+        'PROFILE_DIR': None,          # where profiles are dumped
+        'PROFILE_KEEP': 20,           # slowest profiles kept on disk
+        'TOKEN': None,                # bearer token for scrapers
+    }
+"""
+import cProfile
+import heapq
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    'DUPLICATE_THRESHOLD': 3,
+    'WINDOW': 600,
+    'SLOTS': 10,
+    'PROFILE_SAMPLE_RATE': 0.0,
+    'PROFILE_DIR': None,
+    'PROFILE_KEEP': 20,
+    'TOKEN': None,
+}
+
+# Upper bounds of the histogram buckets
+SECONDS_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+PERCENTILES = (0.5, 0.9, 0.99)
+
+_current: ContextVar[Optional['RequestMetrics']] = ContextVar(
+    'request_metrics', default=None
+)
+
+
+def options() -> dict:
+    return {**DEFAULTS, **getattr(settings, 'INSTRUMENTATION', {})}
+
+
+class RequestMetrics:
+    """SQL statements executed while serving one request."""
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.statements = Counter()
+
+    def duplicates(self, threshold: int) -> Dict[str, int]:
+        return {sql: count for sql, count in self.statements.items()
+                if count >= threshold}
+
+
+def record_query(execute, sql, params, many, context):
+    """Execute wrapper adding each statement to the current request."""
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.sql_time += time.perf_counter() - start
+        metrics.statements[sql] += 1
+
+
+def install_query_recorder(connection, **kwargs) -> None:
+    """connection_created handler, wraps every new connection once."""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class Histogram:
+    """
+    Bucketed observations, cumulative since start for Prometheus and
+    per time slot for percentiles over a rolling window.
+    """
+
+    def __init__(self, bounds, window: float, slots: int):
+        self.bounds = tuple(bounds)
+        self.slot_length = window / slots
+        self.slots = slots
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0.0
+        # slot number -> bucket counts observed during that slot
+        self._recent: Dict[int, List[int]] = {}
+
+    def _bucket(self, value: float) -> int:
+        for index, bound in enumerate(self.bounds):
+            if value <= bound:
+                return index
+        return len(self.bounds)
+
+    def observe(self, value: float, now: float) -> None:
+        bucket = self._bucket(value)
+        self.counts[bucket] += 1
+        self.total += value
+        slot = int(now // self.slot_length)
+        counts = self._recent.get(slot)
+        if counts is None:
+            counts = self._recent[slot] = [0] * len(self.counts)
+            for old in [old for old in self._recent
+                        if old <= slot - self.slots]:
+                del self._recent[old]
+        counts[bucket] += 1
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def window(self, now: float) -> List[int]:
+        """Bucket counts of the rolling window ending at ``now``."""
+        oldest = int(now // self.slot_length) - self.slots
+        counts = [0] * len(self.counts)
+        for slot, slot_counts in self._recent.items():
+            if slot > oldest:
+                counts = [a + b for a, b in zip(counts, slot_counts)]
+        return counts
+
+    def percentiles(self, now: float) -> Dict[str, Optional[float]]:
+        """Upper bound of the bucket holding each percentile."""
+        counts = self.window(now)
+        observed = sum(counts)
+        result = {}
+        for percentile in PERCENTILES:
+            key = f'p{round(percentile * 100)}'
+            if not observed:
+                result[key] = None
+                continue
+            rank, seen = percentile * observed, 0
+            for index, count in enumerate(counts):
+                seen += count
+                if seen >= rank:
+                    result[key] = (self.bounds[index]
+                                   if index < len(self.bounds) else None)
+                    break
+        return result
+
+
+def _escape(label: str) -> str:
+    return label.replace('\\', '\\\\').replace('"', '\\"')
+
+
+class ViewStats:
+    def __init__(self, window: float, slots: int):
+        self.duration = Histogram(SECONDS_BUCKETS, window, slots)
+        self.sql_time = Histogram(SECONDS_BUCKETS, window, slots)
+        self.queries = Histogram(QUERY_BUCKETS, window, slots)
+        self.duplicate_requests = 0
+        self.last_duplicate: Optional[str] = None
+
+
+class Registry:
+    """Per-view statistics of this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views: Dict[str, ViewStats] = {}
+        self._profiles: List[tuple] = []
+        self.started = time.time()
+
+    def record(
+        self, view: str, duration: float, metrics: RequestMetrics
+    ) -> None:
+        config = options()
+        duplicates = metrics.duplicates(config['DUPLICATE_THRESHOLD'])
+        now = time.time()
+        with self._lock:
+            stats = self._views.get(view)
+            if stats is None:
+                stats = self._views[view] = ViewStats(
+                    config['WINDOW'], config['SLOTS']
+                )
+            stats.duration.observe(duration, now)
+            stats.sql_time.observe(metrics.sql_time, now)
+            stats.queries.observe(metrics.queries, now)
+            if duplicates:
+                sql = max(duplicates, key=duplicates.get)
+                stats.duplicate_requests += 1
+                stats.last_duplicate = sql
+        if duplicates:
+            logger.warning(
+                'Possible N+1 in %s: statement run %d times: %.200s',
+                view, duplicates[sql], sql,
+            )
+
+    def keep_profile(
+        self, view: str, duration: float, profile: cProfile.Profile
+    ) -> None:
+        """Dump ``profile`` if it is among the slowest ones seen."""
+        config = options()
+        directory = config['PROFILE_DIR']
+        if not directory:
+            return
+        with self._lock:
+            if len(self._profiles) >= config['PROFILE_KEEP'] \
+                    and duration <= self._profiles[0][0]:
+                return
+            name = re.sub(r'[^\w.-]+', '_', view)
+            path = os.path.join(
+                directory,
+                f'{duration * 1000:09.1f}ms-{name}-{os.getpid()}-'
+                f'{time.time_ns()}.prof',
+            )
+            heapq.heappush(self._profiles, (duration, path))
+            evicted = None
+            if len(self._profiles) > config['PROFILE_KEEP']:
+                evicted = heapq.heappop(self._profiles)[1]
+        os.makedirs(directory, exist_ok=True)
+        profile.dump_stats(path)
+        if evicted:
+            try:
+                os.remove(evicted)
+            except FileNotFoundError:
+                pass
+
+    def snapshot(self) -> dict:
+        now = time.time()
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'uptime': round(now - self.started, 1),
+                'window': options()['WINDOW'],
+                'views': {
+                    view: {
+                        'requests': stats.duration.count,
+                        'duration_seconds': stats.duration.percentiles(now),
+                        'sql_seconds': stats.sql_time.percentiles(now),
+                        'sql_queries': stats.queries.percentiles(now),
+                        'duplicate_query_requests': stats.duplicate_requests,
+                        'last_duplicate_query': stats.last_duplicate,
+                    }
+                    for view, stats in sorted(self._views.items())
+                },
+            }
+
+    def prometheus(self) -> str:
+        """The histograms in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            views = sorted(self._views.items())
+            for metric, attribute, help_text in (
+                ('http_request_duration_seconds', 'duration',
+                 'Wall time of the request'),
+                ('http_request_sql_seconds', 'sql_time',
+                 'Time spent in SQL statements'),
+                ('http_request_sql_queries', 'queries',
+                 'SQL statements executed'),
+            ):
+                lines.append(f'# HELP {metric} {help_text}')
+                lines.append(f'# TYPE {metric} histogram')
+                for view, stats in views:
+                    histogram = getattr(stats, attribute)
+                    label = _escape(view)
+                    seen = 0
+                    for bound, count in zip(
+                        histogram.bounds + ('+Inf',), histogram.counts
+                    ):
+                        seen += count
+                        lines.append(
+                            f'{metric}_bucket{{view="{label}",'
+                            f'le="{bound}"}} {seen}'
+                        )
+                    lines.append(
+                        f'{metric}_sum{{view="{label}"}} {histogram.total}'
+                    )
+                    lines.append(f'{metric}_count{{view="{label}"}} {seen}')
+            metric = 'http_request_duplicate_queries_total'
+            lines.append(f'# HELP {metric} Requests flagged as N+1')
+            lines.append(f'# TYPE {metric} counter')
+            for view, stats in views:
+                lines.append(
+                    f'{metric}{{view="{_escape(view)}"}} '
+                    f'{stats.duplicate_requests}'
+                )
+        return '\n'.join(lines) + '\n'
+
+    def reset(self) -> None:
+        with self._lock:
+            self._views.clear()
+
+
+registry = Registry()
+_profiling = threading.Lock()
+
+
+def view_name(request) -> str:
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return '<unresolved>'
+    return match.view_name or match.route or '<unnamed>'
+
+
+def start_request():
+    """Begin recording a request, returns the state for ``finish``."""
+    metrics = RequestMetrics()
+    token = _current.set(metrics)
+    profile = None
+    rate = options()['PROFILE_SAMPLE_RATE']
+    # The interpreter runs one profiler at a time, concurrent requests
+    # are not sampled while another one is profiled
+    if rate and random.random() < rate \
+            and _profiling.acquire(blocking=False):
+        profile = cProfile.Profile()
+        profile.enable()
+    return metrics, token, profile, time.perf_counter()
+
+
+def finish_request(request, state) -> None:
+    metrics, token, profile, start = state
+    duration = time.perf_counter() - start
+    if profile is not None:
+        profile.disable()
+        _profiling.release()
+    _current.reset(token)
+    view = view_name(request)
+    registry.record(view, duration, metrics)
+    if profile is not None:
+        registry.keep_profile(view, duration, profile)
+
+
+def enabled() -> bool:
+    return options()['ENABLED']
@@ -0,0 +1,43 @@
+from time import perf_counter
+from django.core.management.base import BaseCommand
+from core.nutrition import (
+    DEFAULT_BATCH_SIZE, aggregate_all, aggregate_incremental,
+)
+from core.routers import analytics
+
+
+class Command(BaseCommand):
+    """ BaseCommand Wrapper """
+    help = '''
+    Compute the real daily nutrition totals and adherence of every user
+    from their ingestions and store them in NutritionHistory.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+            help='Number of users aggregated per query and transaction'
+        )
+        parser.add_argument(
+            '--incremental', action='store_true',
+            help='Only reprocess days that received new ingestions'
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        batch_size = max(1, options['batch_size'])
+        mode = 'incremental' if options['incremental'] else 'full'
+        print(f"\033[94maggregate_nutrition\033[m running in {mode} mode")
+        start = perf_counter()
+        with analytics():
+            if options['incremental']:
+                stats = aggregate_incremental(batch_size)
+            else:
+                stats = aggregate_all(batch_size)
+        elapsed = perf_counter() - start
+        print(
+            f"📊 {stats['users']} users, {stats['days']} days: "
+            f"\033[92m{stats['created']}\033[m created, "
+            f"\033[94m{stats['updated']}\033[m updated "
+            f"in {elapsed:.2f}s\n"
+        )
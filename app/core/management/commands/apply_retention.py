@@ -0,0 +1,76 @@
+from collections import Counter
+from datetime import timedelta
+from time import perf_counter
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from core.retention import DEFAULT_CHUNK_SIZE, POLICIES, expire, expired
+from core.routers import primary
+
+
+class Command(BaseCommand):
+    """ BaseCommand Wrapper """
+    help = f'''
+    Delete the history rows older than the retention of their policy, in
+    chunks that each run in a short transaction. Raw meals only expire
+    once aggregate_nutrition summed them into the daily totals. Policies:
+    {', '.join(sorted(POLICIES))}. Without --days, only the policies with
+    a default retention run. Meant to be scheduled, e.g. daily after
+    aggregate_nutrition and archive_history.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--policies', nargs='+', choices=sorted(POLICIES),
+            help='Policies to apply, every one with a retention by default'
+        )
+        parser.add_argument(
+            '--days', type=int, default=None,
+            help='Days of history kept, instead of the policy default'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+            help='Rows deleted per transaction'
+        )
+        parser.add_argument(
+            '--pause', type=float, default=0,
+            help='Seconds to sleep between chunks'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only count the rows that would be deleted'
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        names = options['policies'] or sorted(POLICIES)
+        today = timezone.localdate()
+        print("\033[94mapply_retention\033[m")
+        for name in names:
+            policy = POLICIES[name]
+            days = options['days'] or policy.days
+            if days is None:
+                if options['policies']:
+                    raise CommandError(f'{name} has no default, use --days')
+                continue
+            before = today - timedelta(days=days)
+            # Rows are picked on default, not on a lagging replica
+            with primary():
+                if options['dry_run']:
+                    print(f"🔍 {name}: {expired(policy, before).count()} "
+                          f"rows dated before {before}")
+                    continue
+                start = perf_counter()
+                deleted = Counter()
+                for chunk in expire(policy, before,
+                                    max(1, options['chunk_size']),
+                                    options['pause']):
+                    deleted += chunk
+                    print(f"  {name}: {sum(deleted.values())} rows deleted",
+                          end='\r')
+            elapsed = perf_counter() - start
+            detail = ', '.join(f'{label} {count}'
+                               for label, count in sorted(deleted.items()))
+            print(f"🗑️ {name}: \033[92m{sum(deleted.values())}\033[m rows "
+                  f"dated before {before} deleted in {elapsed:.2f}s"
+                  f"{f' ({detail})' if detail else ''}")
+        print()
@@ -0,0 +1,42 @@
+from time import perf_counter
+from django.core.management.base import BaseCommand
+from core.programs import DEFAULT_BATCH_SIZE, assign_all, assign_new
+
+
+class Command(BaseCommand):
+    """ BaseCommand Wrapper """
+    help = '''
+    Assign the best fitting ProgramType to users, matching sex and
+    available workout days. By default only users signed up since the
+    previous run are processed; use --all after the program catalog
+    changed.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+            help='Number of users assigned per transaction'
+        )
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Re-check the programs of every user'
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        batch_size = max(1, options['batch_size'])
+        mode = 'full' if options['all'] else 'incremental'
+        print(f"\033[94massign_programs\033[m running in {mode} mode")
+        start = perf_counter()
+        if options['all']:
+            stats = assign_all(batch_size)
+        else:
+            stats = assign_new(batch_size)
+        elapsed = perf_counter() - start
+        print(
+            f"📊 {stats['users']} users: "
+            f"\033[92m{stats['assigned']}\033[m assigned, "
+            f"{stats['replaced']} replaced, "
+            f"\033[91m{stats['unmatched']}\033[m without a fitting program "
+            f"in {elapsed:.2f}s\n"
+        )
@@ -0,0 +1,35 @@
+from time import perf_counter
+from django.core.management.base import BaseCommand
+from core.anthropometrics import DEFAULT_BATCH_SIZE, backfill
+
+
+class Command(BaseCommand):
+    """ BaseCommand Wrapper """
+    help = '''
+    Compute BMI, body fat and waist ratios of every AntrhopometricHistory
+    row with vectorized numpy operations, a batch of users per query, and
+    store them on the rows.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+            help='Number of users loaded and updated per batch'
+        )
+        parser.add_argument(
+            '--missing', action='store_true',
+            help='Only rows without derived metrics yet'
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        print("\033[94mbackfill_anthropometrics\033[m running")
+        start = perf_counter()
+        stats = backfill(max(1, options['batch_size']), options['missing'])
+        elapsed = perf_counter() - start
+        rate = stats['rows'] / elapsed if elapsed else 0
+        print(
+            f"📊 {stats['users']} users: "
+            f"\033[92m{stats['rows']}\033[m measurements updated "
+            f"in {elapsed:.2f}s ({rate:,.0f} rows/s)\n"
+        )
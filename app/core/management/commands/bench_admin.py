@@ -0,0 +1,78 @@
+from contextlib import ExitStack
+from time import perf_counter
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+
+class Command(BaseCommand):
+    """ BaseCommand Wrapper """
+    help = '''
+    Render the changelist of every model registered in the admin, as a
+    superuser: unfiltered, searched (--search) and on its second page.
+    Report the queries and time of each page, and fail when a page runs
+    more than --max-queries queries, e.g. a missing list_select_related
+    running one query per row. Use generate_data or load_data first so
+    the pages are full.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-queries', type=int, default=10)
+        parser.add_argument(
+            '--search', default='a',
+            help='Search term of the searched pages'
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        factory = RequestFactory()
+        # Superusers pass every permission check without a query
+        user = get_user_model()(id=0, email='bench@admin.invalid',
+                                is_active=True, is_staff=True,
+                                is_superuser=True)
+        print("\033[94mbench_admin\033[m rendering changelists")
+        over_budget = []
+        for model, model_admin in sorted(
+            admin.site._registry.items(),
+            key=lambda item: item[0]._meta.label,
+        ):
+            url = reverse(f'admin:{model._meta.app_label}_'
+                          f'{model._meta.model_name}_changelist')
+            pages = [('list', {}), ('page 2', {'p': '2'})]
+            if model_admin.search_fields:
+                pages.append(('search', {'q': options['search']}))
+            for label, params in pages:
+                request = factory.get(url, params)
+                request.user = user
+                queries, elapsed, rows = self.render(model_admin, request)
+                name = f'{model._meta.label} {label}'
+                print(f"⏱️ \033[94m{name:>30}\033[m: {queries:2} queries, "
+                      f"{elapsed * 1000:7.1f} ms, {rows} rows")
+                if queries > options['max_queries']:
+                    over_budget.append(name)
+        if over_budget:
+            raise CommandError(
+                f"Over {options['max_queries']} queries: "
+                f"{', '.join(over_budget)}"
+            )
+        print(f"✔️ Every changelist within {options['max_queries']} queries")
+
+    @staticmethod
+    def render(model_admin, request):
+        with ExitStack() as stack:
+            contexts = [
+                stack.enter_context(CaptureQueriesContext(connection))
+                for connection in connections.all()
+            ]
+            start = perf_counter()
+            response = model_admin.changelist_view(request)
+            if hasattr(response, 'render'):
+                response.render()
+            elapsed = perf_counter() - start
+        changelist = getattr(response, 'context_data', {}).get('cl')
+        rows = len(changelist.result_list) if changelist else 0
+        return sum(len(context) for context in contexts), elapsed, rows
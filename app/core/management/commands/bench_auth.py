@@ -0,0 +1,91 @@
+from contextlib import ExitStack
+from time import perf_counter
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+
+BENCH_EMAIL = 'auth@bench-auth.invalid'
+# (label, SESSION_ENGINE, AUTHENTICATION_BACKENDS)
+SETUPS = [
+    ('db', 'django.contrib.sessions.backends.db',
+     ['django.contrib.auth.backends.ModelBackend']),
+    ('cached', 'core.auth', ['core.auth.CachedModelBackend']),
+    ('signed', 'django.contrib.sessions.backends.signed_cookies',
+     ['core.auth.CachedModelBackend']),
+]
+
+
+class Command(BaseCommand):
+    """ BaseCommand Wrapper """
+    help = '''
+    Measure the overhead of authenticating a request (session and user
+    lookup) with the database sessions and the plain ModelBackend, with
+    the cached sessions and users of core.auth, and with signed cookie
+    sessions. Requests go through the session and authentication
+    middlewares only. The synthetic user is deleted at the end.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        User = get_user_model()
+        User.objects.filter(email=BENCH_EMAIL).delete()
+        user = User.objects.create_user(BENCH_EMAIL, sex='M')
+        requests = max(1, options['requests'])
+        print(f"\033[94mbench_auth\033[m {requests} authenticated requests")
+        try:
+            for label, engine, backends in SETUPS:
+                with override_settings(SESSION_ENGINE=engine,
+                                       AUTHENTICATION_BACKENDS=backends):
+                    queries, latencies = self.run(user, requests)
+                latencies.sort()
+                print(
+                    f"⏱️ \033[94m{label:>7}\033[m: "
+                    f"{queries / requests:.2f} queries/request, "
+                    f"mean {sum(latencies) / requests:7.1f} µs, "
+                    f"p99 {latencies[requests * 99 // 100]:7.1f} µs"
+                )
+        finally:
+            user.delete()
+
+    @staticmethod
+    def run(user, requests: int) -> tuple:
+        client = Client()
+        client.force_login(user)
+        cookie = client.cookies[settings.SESSION_COOKIE_NAME].value
+
+        def view(request):
+            if request.user.id != user.id:
+                raise CommandError('The request is not authenticated')
+            return HttpResponse()
+
+        # Built here, the middlewares read the settings when created
+        handler = SessionMiddleware(AuthenticationMiddleware(view))
+        factory = RequestFactory()
+        latencies = []
+        with ExitStack() as stack:
+            contexts = [
+                stack.enter_context(CaptureQueriesContext(connection))
+                for connection in connections.all()
+            ]
+            for number in range(requests + 1):
+                request = factory.get('/')
+                request.COOKIES[settings.SESSION_COOKIE_NAME] = cookie
+                start = perf_counter()
+                handler(request)
+                elapsed = (perf_counter() - start) * 1e6
+                if number:
+                    latencies.append(elapsed)
+                else:
+                    # The first request fills the caches
+                    for context in contexts:
+                        del context.captured_queries[:]
+        return sum(len(context) for context in contexts), latencies
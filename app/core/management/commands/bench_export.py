@@ -0,0 +1,99 @@
+import csv
+import io
+import os
+import tempfile
+import tracemalloc
+from time import perf_counter
+from django.core.management.base import BaseCommand, CommandError
+from core.exports import (
+    DATASETS, DEFAULT_CHUNK_SIZE, csv_stream, gzip_stream, write_columnar,
+)
+
+MODES = ['naive', 'csv', 'csv.gz', 'parquet', 'arrow']
+
+
+class Command(BaseCommand):
+    """ BaseCommand Wrapper """
+    help = '''
+    Export a dataset of the current database in every format, discarding
+    the CSV streams as the export view would send them, and report
+    throughput and peak Python memory (tracemalloc, which slows the runs
+    down). "naive" loads the whole queryset and then writes the CSV, for
+    comparison. Use generate_data first to get millions of rows.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dataset', choices=list(DATASETS),
+                            default='exercises')
+        parser.add_argument('--modes', nargs='+', choices=MODES,
+                            default=MODES)
+        parser.add_argument('--chunk-size', type=int,
+                            default=DEFAULT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        dataset = options['dataset']
+        chunk_size = max(1, options['chunk_size'])
+        print(f"\033[94mbench_export\033[m of {dataset}: "
+              f"{DATASETS[dataset].model.objects.count()} rows")
+        for mode in options['modes']:
+            tracemalloc.start()
+            start = perf_counter()
+            try:
+                rows, size = getattr(self, f"run_{mode.replace('.', '_')}")(
+                    dataset, chunk_size
+                )
+            except ImportError:
+                tracemalloc.stop()
+                raise CommandError(f'{mode} exports need pyarrow')
+            elapsed = perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            rate = rows / elapsed if elapsed else 0
+            print(
+                f"⏱️ \033[94m{mode:>8}\033[m: {rows} rows in {elapsed:.2f}s "
+                f"({rate:,.0f} rows/s), {size / 2 ** 20:.1f} MiB output, "
+                f"peak memory \033[93m{peak / 2 ** 20:.1f} MiB\033[m"
+            )
+
+    @staticmethod
+    def run_naive(dataset: str, chunk_size: int):
+        spec = DATASETS[dataset]
+        rows = list(spec.model.objects.order_by('id')
+                    .values_list(*spec.columns))
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(spec.columns)
+        writer.writerows(rows)
+        return len(rows), len(buffer.getvalue().encode())
+
+    @staticmethod
+    def consume(pieces) -> int:
+        return sum(len(piece) for piece in pieces)
+
+    def run_csv(self, dataset: str, chunk_size: int):
+        stats = {'rows': 0}
+        size = self.consume(csv_stream(dataset, stats,
+                                       chunk_size=chunk_size))
+        return stats['rows'], size
+
+    def run_csv_gz(self, dataset: str, chunk_size: int):
+        stats = {'rows': 0}
+        size = self.consume(gzip_stream(
+            csv_stream(dataset, stats, chunk_size=chunk_size)
+        ))
+        return stats['rows'], size
+
+    @staticmethod
+    def run_columnar(dataset: str, chunk_size: int, file_format: str):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, f'{dataset}.{file_format}')
+            rows = write_columnar(dataset, path, file_format,
+                                  chunk_size=chunk_size)
+            return rows, os.path.getsize(path)
+
+    def run_parquet(self, dataset: str, chunk_size: int):
+        return self.run_columnar(dataset, chunk_size, 'parquet')
+
+    def run_arrow(self, dataset: str, chunk_size: int):
+        return self.run_columnar(dataset, chunk_size, 'arrow')
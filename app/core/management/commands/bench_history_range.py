@@ -0,0 +1,174 @@
+import random
+from datetime import timedelta
+from decimal import Decimal
+from statistics import median
+from time import perf_counter
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from core.archive import ARCHIVES, archive_before, history_range
+from core.models import Ingestion, IngestionArchive
+
+BENCH_DOMAIN = '@bench-history.invalid'
+RANGE_DAYS = 90
+
+
+class Command(BaseCommand):
+    """ BaseCommand Wrapper """
+    help = '''
+    Measure the "user X, last 90 days" range query over a synthetic
+    Ingestion history: with the (user, date) index, without it (FK index
+    only) and, with --archive, after moving old rows to the archive
+    table. Run it against a scratch database: the synthetic users and
+    rows are deleted at the end unless --keep is given.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000000)
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument(
+            '--days', type=int, default=730,
+            help='Days of history spread over each user'
+        )
+        parser.add_argument('--queries', type=int, default=500)
+        parser.add_argument('--batch-size', type=int, default=20000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument(
+            '--archive', action='store_true',
+            help='Also measure after archiving rows older than 90 days'
+        )
+        parser.add_argument(
+            '--keep', action='store_true',
+            help='Keep the synthetic data for further runs'
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        rng = random.Random(options['seed'])
+        user_ids = self.bench_users()
+        if not user_ids:
+            user_ids = self.create_history(rng, options)
+        print(f"📊 {len(user_ids)} synthetic users, "
+              f"{Ingestion.objects.count()} ingestion rows")
+
+        since = timezone.now() - timedelta(days=RANGE_DAYS)
+        targets = [rng.choice(user_ids) for _ in range(options['queries'])]
+        self.report('indexed', [
+            self.timed(self.last_days, user_id, since) for user_id in targets
+        ])
+
+        index = self.composite_index()
+        with connection.schema_editor() as editor:
+            editor.remove_index(Ingestion, index)
+        try:
+            self.report('fk only', [
+                self.timed(self.last_days, user_id, since)
+                for user_id in targets
+            ])
+        finally:
+            with connection.schema_editor() as editor:
+                editor.add_index(Ingestion, index)
+
+        if options['archive']:
+            start = perf_counter()
+            moved = sum(archive_before(
+                ARCHIVES['ingestion'], timezone.localdate()
+                - timedelta(days=RANGE_DAYS),
+            ))
+            print(f"🗄️ {moved} rows archived in "
+                  f"{perf_counter() - start:.2f}s")
+            self.report('archived', [
+                self.timed(self.last_days, user_id, since)
+                for user_id in targets
+            ])
+            day = timezone.localdate() - timedelta(days=2 * RANGE_DAYS)
+            self.report('hot+arch', [
+                self.timed(history_range, 'ingestion', user_id, day)
+                for user_id in targets
+            ])
+
+        if not options['keep']:
+            self.cleanup(user_ids)
+
+    @staticmethod
+    def bench_users() -> list:
+        return list(
+            get_user_model().objects
+            .filter(email__endswith=BENCH_DOMAIN)
+            .order_by('id').values_list('id', flat=True)
+        )
+
+    def create_history(self, rng, options) -> list:
+        User = get_user_model()
+        password = make_password(None)
+        User.objects.bulk_create((
+            User(email=f'user{number}{BENCH_DOMAIN}', name='Bench',
+                 password=password, sex='M', available_workout_days='')
+            for number in range(options['users'])
+        ), batch_size=options['batch_size'])
+        user_ids = self.bench_users()
+
+        start = perf_counter()
+        now = timezone.now()
+        seconds = options['days'] * 86400
+        batch_size = options['batch_size']
+        for offset in range(0, options['rows'], batch_size):
+            Ingestion.objects.bulk_create([
+                Ingestion(
+                    user_id=rng.choice(user_ids),
+                    date=now - timedelta(seconds=rng.randrange(seconds)),
+                    meal_number=rng.randint(1, 5),
+                    value=Decimal(rng.randint(1, 99999)) / 100,
+                )
+                for _ in range(min(batch_size, options['rows'] - offset))
+            ])
+            written = min(offset + batch_size, options['rows'])
+            print(f"  {written} rows written", end='\r')
+        print(f"🏗️ {options['rows']} rows written in "
+              f"{perf_counter() - start:.2f}s")
+        return user_ids
+
+    @staticmethod
+    def composite_index():
+        for index in Ingestion._meta.indexes:
+            if index.fields == ['user', 'date']:
+                return index
+
+    @staticmethod
+    def last_days(user_id: int, since) -> list:
+        return list(
+            Ingestion.objects
+            .filter(user_id=user_id, date__gte=since)
+            .order_by('date')
+            .values_list('id', 'date', 'meal_number', 'value')
+        )
+
+    @staticmethod
+    def cleanup(user_ids: list) -> None:
+        """Delete the synthetic data, a few users per transaction."""
+        for start in range(0, len(user_ids), 100):
+            chunk = user_ids[start:start + 100]
+            Ingestion.objects.filter(user_id__in=chunk).delete()
+            IngestionArchive.objects.filter(user_id__in=chunk).delete()
+            get_user_model().objects.filter(id__in=chunk).delete()
+        print("🧹 Synthetic data deleted")
+
+    @staticmethod
+    def timed(function, *args) -> float:
+        start = perf_counter()
+        function(*args)
+        return (perf_counter() - start) * 1000
+
+    @staticmethod
+    def report(label: str, timings: list) -> None:
+        timings = sorted(timings)
+        p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+        print(
+            f"⏱️ \033[94m{label:>8}\033[m: p50 {median(timings):.3f} ms, "
+            f"p99 {p99:.3f} ms, max {timings[-1]:.3f} ms "
+            f"over {len(timings)} queries"
+        )
@@ -0,0 +1,131 @@
+import random
+from time import perf_counter
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.catalog_cache import catalog_cache
+from core.models import ProgramType
+from core.programs import (
+    WEEKDAYS, ProgramIndex, assign_all, parse_days, program_index,
+)
+
+SEXES = ['M', 'F']
+
+
+def random_days(rng, low: int, high: int) -> str:
+    """A 7 character availability mask of ``low`` to ``high`` days."""
+    days = rng.sample(range(WEEKDAYS), rng.randint(low, high))
+    return ''.join('1' if day in days else '0' for day in range(WEEKDAYS))
+
+
+class Command(BaseCommand):
+    """ BaseCommand Wrapper """
+    help = '''
+    Microbenchmark of the program assignment engine over synthetic users:
+    index lookups against a scan of the catalog per user, plus an end to
+    end assign_all run over --db-users database users. The database rows
+    are rolled back at the end.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000000)
+        parser.add_argument('--programs', type=int, default=60)
+        parser.add_argument(
+            '--scan-sample', type=int, default=100000,
+            help='Users matched with the per-user scan baseline'
+        )
+        parser.add_argument('--db-users', type=int, default=20000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        rng = random.Random(options['seed'])
+        programs = [
+            ProgramType(
+                id=number, program_name=f'Program {number}',
+                sex=rng.choice(SEXES),
+                available_workout_days=random_days(rng, 2, 5),
+            )
+            for number in range(1, options['programs'] + 1)
+        ]
+        users = [
+            (number, rng.choice(SEXES), random_days(rng, 1, WEEKDAYS))
+            for number in range(options['users'])
+        ]
+
+        start = perf_counter()
+        index = ProgramIndex(programs)
+        print(f"🏗️ Index of {len(programs)} programs built in "
+              f"{(perf_counter() - start) * 1000:.1f} ms")
+
+        start = perf_counter()
+        matched = sum(
+            index.best(sex, days) is not None for _, sex, days in users
+        )
+        self.report('index', len(users), perf_counter() - start, matched)
+
+        sample = users[:options['scan_sample']]
+        start = perf_counter()
+        matched = sum(
+            self.scan(programs, sex, days) is not None
+            for _, sex, days in sample
+        )
+        self.report('scan', len(sample), perf_counter() - start, matched)
+
+        if options['db_users']:
+            self.end_to_end(rng, programs, options['db_users'])
+
+    @staticmethod
+    def scan(programs, sex: str, days: str):
+        """Baseline: check every program of the catalog for one user."""
+        available = parse_days(days)
+        best = None
+        for program in programs:
+            program_days = parse_days(program.available_workout_days)
+            if program.sex != sex or not program_days \
+                    or program_days & ~available:
+                continue
+            rank = (-bin(program_days).count('1'), program.id)
+            if best is None or rank < best[0]:
+                best = (rank, program.id)
+        return best and best[1]
+
+    def end_to_end(self, rng, programs, count: int) -> None:
+        User = get_user_model()
+        password = make_password(None)
+        with transaction.atomic():
+            ProgramType.objects.bulk_create([
+                ProgramType(
+                    program_name=program.program_name, sex=program.sex,
+                    available_workout_days=program.available_workout_days,
+                )
+                for program in programs
+            ])
+            User.objects.bulk_create((
+                User(email=f'user{number}@bench-programs.invalid',
+                     name='Bench', password=password,
+                     sex=rng.choice(SEXES),
+                     available_workout_days=random_days(rng, 1, WEEKDAYS))
+                for number in range(count)
+            ), batch_size=5000)
+            # bulk_create sends no signals, drop the cached index by hand
+            catalog_cache.invalidate(ProgramType)
+            program_index()
+            start = perf_counter()
+            stats = assign_all()
+            self.report('assign_all', stats['users'],
+                        perf_counter() - start,
+                        stats['users'] - stats['unmatched'])
+            transaction.set_rollback(True)
+        catalog_cache.invalidate(ProgramType)
+
+    @staticmethod
+    def report(label: str, users: int, elapsed: float, matched: int) -> None:
+        print(
+            f"⏱️ \033[94m{label:>10}\033[m: {users} users in "
+            f"{elapsed:.2f}s, {users / elapsed:,.0f} users/s "
+            f"({matched} matched)"
+        )
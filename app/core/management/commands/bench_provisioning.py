@@ -0,0 +1,99 @@
+import csv
+import os
+import random
+import tempfile
+from time import perf_counter
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from core.models import ProgramTypeUser
+from core.programs import WEEKDAYS, program_index
+from core.provisioning import DEFAULT_BATCH_SIZE, provision
+
+BENCH_DOMAIN = '@bench-provisioning.invalid'
+SEXES = ['M', 'F']
+
+
+class Command(BaseCommand):
+    """ BaseCommand Wrapper """
+    help = '''
+    Compare the per-user path (create_user, then the user's program) with
+    provision_users over a synthetic file of users with passwords: first
+    --serial-users one at a time, then the whole file with one hashing
+    process and with --workers processes. Every run is rolled back.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2000)
+        parser.add_argument(
+            '--serial-users', type=int, default=100,
+            help='Users created one at a time by the per-user baseline'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Processes hashing passwords in the parallel run'
+        )
+        parser.add_argument('--batch-size', type=int,
+                            default=DEFAULT_BATCH_SIZE)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        rng = random.Random(options['seed'])
+        rows = [
+            {'email': f'user{number}{BENCH_DOMAIN}',
+             'password': f'bench-{rng.getrandbits(64):x}',
+             'name': f'Bench user {number}', 'sex': rng.choice(SEXES),
+             'available_workout_days': ''.join(
+                 rng.choice('01') for _ in range(WEEKDAYS)
+             )}
+            for number in range(max(1, options['users']))
+        ]
+        print(f"\033[94mbench_provisioning\033[m of {len(rows)} users, "
+              f"{os.cpu_count()} CPUs")
+        self.report('create_user', *self.rolled_back(
+            lambda: self.serial(rows[:max(1, options['serial_users'])])
+        ))
+
+        with tempfile.TemporaryDirectory() as workdir:
+            path = os.path.join(workdir, 'users.csv')
+            with open(path, 'w', newline='') as output:
+                writer = csv.DictWriter(output, fieldnames=list(rows[0]))
+                writer.writeheader()
+                writer.writerows(rows)
+            for workers in sorted({1, max(1, options['workers'])}):
+                self.report(f'{workers} worker(s)', *self.rolled_back(
+                    lambda: provision(
+                        path, max(1, options['batch_size']), workers
+                    )[0]['created']
+                ))
+
+    @staticmethod
+    def serial(rows) -> int:
+        """The per-user path: one hash and a few queries per user."""
+        User = get_user_model()
+        index = program_index()
+        for row in rows:
+            user = User.objects.create_user(**row)
+            program_id = index.best(user.sex, user.available_workout_days)
+            if program_id is not None:
+                ProgramTypeUser.objects.create(
+                    user=user, program_type_id=program_id
+                )
+        return len(rows)
+
+    @staticmethod
+    def rolled_back(function):
+        with transaction.atomic():
+            start = perf_counter()
+            users = function()
+            elapsed = perf_counter() - start
+            transaction.set_rollback(True)
+        return users, elapsed
+
+    @staticmethod
+    def report(label: str, users: int, elapsed: float) -> None:
+        print(
+            f"⏱️ \033[94m{label:>12}\033[m: {users} users in "
+            f"{elapsed:.2f}s, {users / elapsed:,.1f} users/s"
+        )
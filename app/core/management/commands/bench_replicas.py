@@ -0,0 +1,178 @@
+import random
+import sqlite3
+import threading
+from collections import Counter
+from contextlib import ExitStack, closing, nullcontext
+from decimal import Decimal
+from statistics import median
+from time import perf_counter
+from typing import Dict, List
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections
+from django.utils import timezone
+from core import routers
+from core.benchmarks import dashboard
+from core.models import Ingestion
+from core.nutrition import daily_totals
+from core.synthetic import synthetic_users
+
+MODES = ['primary', 'routed']
+
+
+class Command(BaseCommand):
+    """ BaseCommand Wrapper """
+    help = '''
+    Run a mixed read/write load from concurrent threads: dashboards, and
+    meals logged then read back. Once with every query on default
+    ("primary") and once with reads routed to the replicas of DB_REPLICAS
+    ("routed"), reporting throughput, latencies and the queries each
+    database served. Needs the synthetic users of generate_data. SQLite
+    replicas are first refreshed with a copy of default, and the meals
+    logged are deleted at the end.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modes', nargs='+', choices=MODES,
+                            default=MODES)
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument(
+            '--operations', type=int, default=2000,
+            help='Operations per mode, split across the threads'
+        )
+        parser.add_argument(
+            '--write-ratio', type=float, default=0.2,
+            help='Share of the operations logging a meal'
+        )
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        replicas = routers.replica_aliases()
+        if 'routed' in options['modes'] and not replicas:
+            raise CommandError('No replica configured, set DB_REPLICAS')
+        user_ids = list(synthetic_users().values_list('id', flat=True))
+        if not user_ids:
+            raise CommandError('No synthetic users, run generate_data first')
+        if self.copy_sqlite(replicas):
+            print(f"📋 Copied default to {', '.join(replicas)}")
+        threads = max(1, options['threads'])
+        print(f"\033[94mbench_replicas\033[m with {threads} threads, "
+              f"{options['write_ratio']:.0%} writes")
+        created = []
+        try:
+            for mode in options['modes']:
+                stats = self.run(mode, user_ids, threads, options)
+                created.extend(stats['created'])
+                self.report(mode, stats)
+        finally:
+            with routers.primary():
+                for start in range(0, len(created), 1000):
+                    Ingestion.objects.filter(
+                        id__in=created[start:start + 1000]
+                    ).delete()
+
+    @staticmethod
+    def copy_sqlite(aliases: List[str]) -> bool:
+        """Refresh SQLite replicas with a copy of default."""
+        databases = [settings.DATABASES[alias]
+                     for alias in ['default', *aliases]]
+        if not aliases or any(not database['ENGINE'].endswith('sqlite3')
+                              for database in databases):
+            return False
+        connections.close_all()
+        with closing(sqlite3.connect(databases[0]['NAME'])) as source:
+            for database in databases[1:]:
+                with closing(sqlite3.connect(database['NAME'])) as copy:
+                    source.backup(copy)
+        return True
+
+    def run(self, mode: str, user_ids: List[int], threads: int,
+            options) -> Dict:
+        stats = {'read': [], 'write': [], 'errors': 0, 'created': [],
+                 'queries': Counter()}
+        lock = threading.Lock()
+        today = timezone.localdate()
+
+        def worker(seed: int, operations: int):
+            rng = random.Random(seed)
+            local = {'read': [], 'write': [], 'errors': 0, 'created': [],
+                     'queries': Counter()}
+
+            def count(alias, execute, sql, params, many, context):
+                local['queries'][alias] += 1
+                return execute(sql, params, many, context)
+
+            with ExitStack() as stack:
+                for alias in settings.DATABASES:
+                    stack.enter_context(connections[alias].execute_wrapper(
+                        lambda *args, alias=alias: count(alias, *args)
+                    ))
+                for _ in range(operations):
+                    user_id = rng.choice(user_ids)
+                    kind = 'write' if rng.random() < options['write_ratio'] \
+                        else 'read'
+                    started = routers.start_request()
+                    start = perf_counter()
+                    try:
+                        with routers.primary() if mode == 'primary' \
+                                else nullcontext():
+                            if kind == 'write':
+                                local['created'].append(
+                                    self.log_meal(rng, user_id, today)
+                                )
+                            else:
+                                dashboard(user_id, today)
+                    except OperationalError:
+                        local['errors'] += 1
+                        continue
+                    finally:
+                        routers.finish_request(started)
+                    local[kind].append((perf_counter() - start) * 1000)
+            connections.close_all()
+            with lock:
+                for name, value in local.items():
+                    stats[name] += value
+
+        operations = max(1, options['operations'])
+        workers = [
+            threading.Thread(target=worker, args=(
+                options['seed'] + number,
+                operations // threads + (number < operations % threads),
+            ))
+            for number in range(threads)
+        ]
+        start = perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        stats['elapsed'] = perf_counter() - start
+        return stats
+
+    @staticmethod
+    def log_meal(rng, user_id: int, today) -> int:
+        """Log a meal and read the day's totals back, as the app does."""
+        ingestion = Ingestion.objects.create(
+            user_id=user_id, meal_number=rng.randint(1, 5),
+            value=Decimal(rng.randint(100, 90000)) / 100,
+        )
+        daily_totals([user_id], {today})
+        return ingestion.id
+
+    @staticmethod
+    def report(mode: str, stats: Dict) -> None:
+        done = len(stats['read']) + len(stats['write'])
+        rate = done / stats['elapsed'] if stats['elapsed'] else 0
+        line = f"⏱️ \033[94m{mode:<8}\033[m {rate:8.1f} ops/s"
+        for kind in ('read', 'write'):
+            latencies = sorted(stats[kind])
+            if latencies:
+                p95 = latencies[min(len(latencies) - 1,
+                                    int(len(latencies) * 0.95))]
+                line += (f"  {kind}s p50 {median(latencies):7.2f} ms "
+                         f"p95 {p95:7.2f} ms")
+        print(f"{line}  {stats['errors']} errors")
+        queries = ', '.join(f'{alias} {count}' for alias, count
+                            in sorted(stats['queries'].items()))
+        print(f"   queries: {queries}")
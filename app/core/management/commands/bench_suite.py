@@ -0,0 +1,76 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from core.benchmarks import (
+    BENCHMARKS, DEFAULT_REPEAT, DEFAULT_TOLERANCE, compare, run_suite,
+)
+
+
+class Command(BaseCommand):
+    """ BaseCommand Wrapper """
+    help = '''
+    Time the main read and write paths (dashboard, catalog listing, food
+    search, history ranges, logging meals and measurements, load_data)
+    against the synthetic users of generate_data, and write a JSON
+    report. With --baseline, fails when a benchmark median got slower
+    than in a previous report.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--benchmarks', nargs='+', choices=list(BENCHMARKS),
+            help='Benchmarks to run, all by default'
+        )
+        parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument(
+            '--output', default='benchmark-report.json',
+            help='Where the JSON report is written'
+        )
+        parser.add_argument(
+            '--baseline', default=None,
+            help='Previous report to compare the medians with'
+        )
+        parser.add_argument(
+            '--tolerance', type=float, default=DEFAULT_TOLERANCE,
+            help='Allowed slowdown of a median, as a share of the baseline'
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        print("\033[94mbench_suite\033[m running")
+        try:
+            report = run_suite(
+                options['benchmarks'], max(1, options['repeat']),
+                options['seed'], progress=self.progress,
+            )
+        except LookupError as e:
+            raise CommandError(str(e))
+        with open(options['output'], 'w') as output:
+            json.dump(report, output, indent=2)
+        print(f"💾 Report written to \033[94m{options['output']}\033[m")
+
+        if not options['baseline']:
+            return
+        with open(options['baseline']) as source:
+            regressions = compare(
+                report, json.load(source), options['tolerance']
+            )
+        for regression in regressions:
+            print(
+                f"🐢 \033[91m{regression['benchmark']}\033[m: "
+                f"{regression['baseline_ms']} ms -> "
+                f"{regression['p50_ms']} ms"
+            )
+        if regressions:
+            raise CommandError(f'{len(regressions)} benchmark(s) regressed')
+        print("✔️ No regression against the baseline")
+
+    @staticmethod
+    def progress(name: str, stats: dict) -> None:
+        line = (
+            f"⏱️ \033[94m{name:>22}\033[m: p50 {stats['p50_ms']:.3f} ms, "
+            f"p95 {stats['p95_ms']:.3f} ms, {stats['queries']} queries"
+        )
+        if 'rows_per_second' in stats:
+            line += f", {stats['rows_per_second']:,} rows/s"
+        print(line)
@@ -0,0 +1,71 @@
+import gzip
+from datetime import date
+from time import perf_counter
+from django.core.management.base import BaseCommand, CommandError
+from core.exports import (
+    DATASETS, DEFAULT_CHUNK_SIZE, csv_stream, write_columnar,
+)
+
+FORMATS = ['csv', 'csv.gz', 'parquet', 'arrow']
+
+
+class Command(BaseCommand):
+    """ BaseCommand Wrapper """
+    help = '''
+    Export a history dataset of some or all users to a CSV, gzip
+    compressed CSV, Parquet or Arrow IPC file, reading a chunk of rows
+    per query so memory use doesn't grow with the export. Parquet and
+    Arrow need pyarrow.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=list(DATASETS))
+        parser.add_argument('--output', required=True)
+        parser.add_argument('--format', choices=FORMATS, default=None,
+                            help='Guessed from --output by default')
+        parser.add_argument('--users', type=int, nargs='+', default=None,
+                            help='User ids, every user by default')
+        parser.add_argument('--start', type=date.fromisoformat)
+        parser.add_argument('--end', type=date.fromisoformat)
+        parser.add_argument('--chunk-size', type=int,
+                            default=DEFAULT_CHUNK_SIZE,
+                            help='Rows read per query')
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        output = options['output']
+        file_format = options['format'] or next(
+            (name for name in reversed(FORMATS)
+             if output.endswith(f'.{name}')), 'csv'
+        )
+        filters = {
+            'user_ids': options['users'], 'start': options['start'],
+            'end': options['end'],
+            'chunk_size': max(1, options['chunk_size']),
+        }
+        print(f"\033[94mexport_history\033[m writing "
+              f"{options['dataset']} to {output} ({file_format})")
+        start = perf_counter()
+        if file_format.startswith('csv'):
+            rows = self.write_csv(options['dataset'], output,
+                                  file_format == 'csv.gz', filters)
+        else:
+            try:
+                rows = write_columnar(options['dataset'], output,
+                                      file_format, **filters)
+            except ImportError:
+                raise CommandError(f'{file_format} exports need pyarrow')
+        elapsed = perf_counter() - start
+        rate = rows / elapsed if elapsed else 0
+        print(f"📊 \033[92m{rows}\033[m rows exported in {elapsed:.2f}s "
+              f"({rate:,.0f} rows/s)\n")
+
+    @staticmethod
+    def write_csv(dataset: str, output: str, compress: bool,
+                  filters: dict) -> int:
+        opener = gzip.open if compress else open
+        stats = {'rows': 0}
+        with opener(output, 'wb') as target:
+            for piece in csv_stream(dataset, stats, **filters):
+                target.write(piece)
+        return stats['rows']
@@ -0,0 +1,71 @@
+from datetime import date
+from time import perf_counter
+from django.core.management.base import BaseCommand
+from core.synthetic import (
+    DEFAULT_DAYS, DEFAULT_INSERT_SIZE, DEFAULT_USERS,
+    DEFAULT_USERS_PER_BATCH, clear, generate,
+)
+from core.routers import primary
+
+
+class Command(BaseCommand):
+    """ BaseCommand Wrapper """
+    help = '''
+    Write synthetic users with days of meal, workout, sleep and
+    anthropometric history for scale tests, reproducible from --seed.
+    Meant for scratch databases, the rows are inserted with explicit ids.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=DEFAULT_USERS)
+        parser.add_argument(
+            '--days', type=int, default=DEFAULT_DAYS,
+            help='Days of history of each user'
+        )
+        parser.add_argument(
+            '--end', type=date.fromisoformat, default=None,
+            help='Last day of history (YYYY-MM-DD), today by default'
+        )
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument(
+            '--users-per-batch', type=int, default=DEFAULT_USERS_PER_BATCH,
+            help='Users written per transaction'
+        )
+        parser.add_argument(
+            '--insert-size', type=int, default=DEFAULT_INSERT_SIZE,
+            help='Rows per INSERT statement'
+        )
+        parser.add_argument(
+            '--clear', action='store_true',
+            help='Delete the synthetic users of previous runs first'
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        print("\033[94mgenerate_data\033[m running")
+        if options['clear']:
+            start = perf_counter()
+            removed = clear(max(1, options['users_per_batch']))
+            print(f"🧹 {removed} synthetic users deleted in "
+                  f"{perf_counter() - start:.2f}s")
+        start = perf_counter()
+        # Explicit ids follow the rows on default, not on a replica
+        with primary():
+            counts = generate(
+                users=options['users'], days=options['days'],
+                seed=options['seed'], end=options['end'],
+                users_per_batch=max(1, options['users_per_batch']),
+                insert_size=max(1, options['insert_size']),
+                progress=self.progress,
+            )
+        elapsed = perf_counter() - start
+        rows = sum(counts.values())
+        rate = rows / elapsed if elapsed else 0
+        print(f"✔️ {rows} rows written in {elapsed:.2f}s "
+              f"({rate:,.0f} rows/s)")
+        for model, count in counts.items():
+            print(f"📊 \033[94m{model:>24}\033[m: {count}")
+
+    @staticmethod
+    def progress(counts: dict) -> None:
+        print(f"  {counts['User']} users written", end='\r')
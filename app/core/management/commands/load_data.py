@@ -1,7 +1,21 @@
-from typing import Union
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from itertools import islice
+from time import perf_counter
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
+from django.core.exceptions import ValidationError
 from django.core.management.base import BaseCommand
+from django.db import DataError, IntegrityError, connections, transaction
+from django.utils import timezone
+from core.catalog_cache import catalog_cache
 from core.models import Excercises, Food
+from core.sessions import sync_muscles
 import csv
+import glob
+import gzip
+import io
+import json
+import multiprocessing
 import os
 
 MODEL_MAPPER = {
@@ -9,12 +23,295 @@ MODEL_MAPPER = {
     'food': Food,
 }
 
+# Columns identifying a catalog row, used to skip or update rows
+# that were already stored by a previous run. Each has a unique
+# constraint, so concurrent workers can't both insert a key.
+NATURAL_KEYS = {
+    Excercises: ('exercise_name',),
+    Food: ('name', 'brand'),
+}
+
+DEFAULT_BATCH_SIZE = 1000
+
+CHECKPOINT_SUFFIX = '.checkpoint'
+REJECT_SUFFIX = '.rejects.csv'
+
+STAT_NAMES = ('rows', 'created', 'updated', 'skipped', 'rejected')
+
+
+def batched(iterable: Iterable, size: int) -> Iterator[List]:
+    """Yield lists of at most ``size`` items from ``iterable``."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def open_source(file_path: str):
+    """Open a plain or gzip compressed csv file in binary mode."""
+    if file_path.endswith('.gz'):
+        return gzip.open(file_path, 'rb')
+    return open(file_path, 'rb')
+
+
+def parse_line(line: bytes) -> List[str]:
+    """Parse one csv record into its values."""
+    return next(csv.reader(io.StringIO(line.decode('utf-8-sig'))), [])
+
+
+def read_records(source, end: Optional[int]) -> Iterator[Tuple[bytes, int]]:
+    """
+    Yield ``(record, offset)`` pairs from the current position of
+    ``source`` until a record starts at or after ``end``.
+
+    ``offset`` is the position right after the record, which is where a
+    resumed load continues. Quoted values spanning several lines are
+    joined back into a single record.
+    """
+    while end is None or source.tell() < end:
+        record = source.readline()
+        if not record:
+            return
+        while record.count(b'"') % 2:
+            continuation = source.readline()
+            if not continuation:
+                break
+            record += continuation
+        if record.strip():
+            yield record, source.tell()
+
+
+def split_ranges(file_path: str, start: int, workers: int) -> List[list]:
+    """
+    Split the data section of a csv file into at most ``workers`` byte
+    ranges aligned on line boundaries. Compressed files can't be seeked
+    cheaply, so they are always read as a single range.
+    """
+    if file_path.endswith('.gz') or workers <= 1:
+        return [[start, None]]
+    size = os.path.getsize(file_path)
+    step = max(1, (size - start) // workers)
+    bounds = [start]
+    with open(file_path, 'rb') as source:
+        for position in range(start + step, size, step):
+            if len(bounds) == workers:
+                break
+            source.seek(position)
+            source.readline()
+            if bounds[-1] < source.tell() < size:
+                bounds.append(source.tell())
+    bounds.append(None)
+    return [[bounds[i], bounds[i + 1]] for i in range(len(bounds) - 1)]
+
+
+def store_batch(
+    rows: List[dict],
+    model: Union[Excercises, Food],
+    on_conflict: str = 'skip',
+) -> tuple:
+    """Store one batch of rows, returns (created, updated, skipped)."""
+    key_fields = NATURAL_KEYS[model]
+
+    def key_of(values):
+        return tuple(str(values[field]) for field in key_fields)
+
+    # Last occurrence wins when the same key shows up twice in a batch
+    incoming = {key_of(row): row for row in rows}
+    duplicated = len(rows) - len(incoming)
+
+    lookup = {
+        f'{key_fields[0]}__in': {key[0] for key in incoming}
+    }
+    existing = {
+        key_of(instance.__dict__): instance
+        for instance in model.objects.filter(**lookup)
+        if key_of(instance.__dict__) in incoming
+    }
+
+    new_instances = [
+        model(**row) for key, row in incoming.items()
+        if key not in existing
+    ]
+    model.objects.bulk_create(new_instances)
+
+    if on_conflict != 'update':
+        skipped = duplicated + len(existing)
+        return len(new_instances), 0, skipped
+
+    update_fields = set()
+    for key, instance in existing.items():
+        for field, value in incoming[key].items():
+            setattr(instance, field, value)
+            update_fields.add(field)
+    update_fields -= set(key_fields)
+    # bulk_update leaves auto_now columns (Food.updated_at) untouched
+    now = timezone.now()
+    for field in model._meta.concrete_fields:
+        if getattr(field, 'auto_now', False) and update_fields:
+            for instance in existing.values():
+                setattr(instance, field.attname, now)
+            update_fields.add(field.attname)
+    if existing and update_fields:
+        model.objects.bulk_update(
+            list(existing.values()), sorted(update_fields)
+        )
+    return len(new_instances), len(existing), duplicated
+
+
+def validate_row(row: dict, model: Union[Excercises, Food]) -> None:
+    """Raise ``ValidationError`` if ``row`` can't be stored in ``model``."""
+    try:
+        instance = model(**row)
+    except TypeError as e:
+        raise ValidationError(str(e))
+    instance.full_clean(validate_unique=False)
+
+
+def format_error(error: Exception) -> str:
+    """Flatten a validation or database error into one line."""
+    if isinstance(error, ValidationError) and hasattr(error, 'error_dict'):
+        return '; '.join(
+            f"{field}: {' '.join(messages)}"
+            for field, messages in error.message_dict.items()
+        )
+    if isinstance(error, ValidationError):
+        return ' '.join(error.messages)
+    return str(error)
+
+
+def file_signature(file_path: str) -> list:
+    """Size and modification time, used to discard stale checkpoints."""
+    stat = os.stat(file_path)
+    return [stat.st_size, int(stat.st_mtime)]
+
+
+@dataclass
+class LoadTask:
+    """A byte range of a csv file loaded by one worker."""
+    index: int
+    file_path: str
+    model_name: str
+    fieldnames: List[str]
+    start: int
+    end: Optional[int]
+    batch_size: int = DEFAULT_BATCH_SIZE
+    on_conflict: str = 'skip'
+
+    @property
+    def checkpoint_path(self) -> str:
+        return f'{self.file_path}{CHECKPOINT_SUFFIX}.{self.index}'
+
+    @property
+    def reject_path(self) -> str:
+        return f'{self.file_path}{REJECT_SUFFIX}.{self.index}'
+
+    def load_checkpoint(self) -> Tuple[int, dict]:
+        """Return the offset and counters to start (or resume) from."""
+        if not os.path.exists(self.checkpoint_path):
+            return self.start, dict.fromkeys(STAT_NAMES, 0)
+        with open(self.checkpoint_path) as checkpoint:
+            state = json.load(checkpoint)
+        return state['offset'], state['stats']
+
+    def save_checkpoint(self, offset: int, stats: dict) -> None:
+        """Atomically record the offset of the last committed batch."""
+        state = {
+            'start': self.start, 'end': self.end,
+            'offset': offset, 'stats': stats,
+            'signature': file_signature(self.file_path),
+        }
+        tmp_path = f'{self.checkpoint_path}.tmp'
+        with open(tmp_path, 'w') as checkpoint:
+            json.dump(state, checkpoint)
+        os.replace(tmp_path, self.checkpoint_path)
+
+
+def init_worker() -> None:
+    """Drop database connections inherited from the parent process."""
+    connections.close_all()
+
+
+def load_range(task: LoadTask) -> dict:
+    """
+    Load one byte range of a csv file, committing every ``batch_size``
+    rows. Invalid rows are appended to the range's reject file and the
+    offset of each committed batch is checkpointed, so an interrupted
+    load continues from the last committed batch.
+    """
+    model = MODEL_MAPPER[task.model_name]
+    offset, stats = task.load_checkpoint()
+
+    with open_source(task.file_path) as source, \
+            open(task.reject_path, 'a', newline='') as reject_file:
+        rejects = csv.writer(reject_file)
+        source.seek(offset)
+        records = read_records(source, task.end)
+        for batch in batched(records, task.batch_size):
+            rows = []
+            for record, offset in batch:
+                values = parse_line(record)
+                row = dict(zip(task.fieldnames, values))
+                try:
+                    if len(values) != len(task.fieldnames):
+                        raise ValidationError(
+                            f'Expected {len(task.fieldnames)} columns, '
+                            f'got {len(values)}'
+                        )
+                    validate_row(row, model)
+                except ValidationError as e:
+                    rejects.writerow(values + [format_error(e)])
+                    stats['rejected'] += 1
+                    continue
+                rows.append(row)
+            stats['rows'] += len(batch)
+            counters = store_rows(rows, model, task.on_conflict, rejects)
+            for name, value in counters.items():
+                stats[name] += value
+            reject_file.flush()
+            task.save_checkpoint(offset, stats)
+    return stats
+
+
+def store_rows(rows, model, on_conflict, rejects) -> dict:
+    """
+    Store validated rows in one transaction. If the batch is refused by
+    the database because of its data, the rows are retried one by one so
+    a single bad row ends up in the reject file instead of aborting the
+    load.
+    """
+    # The unique constraint of the natural key refuses the batch when
+    # another worker committed one of its keys after the lookup; the
+    # second attempt finds them stored
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                result = store_batch(rows, model, on_conflict)
+            return dict(zip(('created', 'updated', 'skipped'), result))
+        except (DataError, IntegrityError):
+            pass
+    counters = {'created': 0, 'updated': 0, 'skipped': 0, 'rejected': 0}
+    for row in rows:
+        try:
+            with transaction.atomic():
+                result = store_batch([row], model, on_conflict)
+        except (DataError, IntegrityError) as e:
+            rejects.writerow(list(row.values()) + [format_error(e)])
+            counters['rejected'] += 1
+            continue
+        for name, value in zip(('created', 'updated', 'skipped'), result):
+            counters[name] += value
+    return counters
+
 
 class Command(BaseCommand):
     """ BaseCommand Wrapper """
     help = '''
     Command For Storing csv data into the Django connected
-    database using the provided model.
+    database using the provided model. Plain and gzip compressed
+    (.csv.gz) files are streamed in bounded batches, optionally split
+    in byte ranges loaded by several worker processes.
     '''
 
     def add_arguments(self, parser):
@@ -22,6 +319,29 @@ class Command(BaseCommand):
             '--file', nargs=1, type=str, required=True,
             help='Define a specific .csv file to load data to the database'
         )
+        parser.add_argument(
+            '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+            help='Number of rows inserted per transaction'
+        )
+        parser.add_argument(
+            '--on-conflict', choices=['skip', 'update'], default='skip',
+            help=(
+                'What to do with rows whose natural key is already stored: '
+                'skip them (default) or update their columns'
+            )
+        )
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help=(
+                'Number of processes loading byte ranges of the file '
+                'concurrently, each with its own database connection. '
+                'Compressed files are always loaded by one worker.'
+            )
+        )
+        parser.add_argument(
+            '--restart', action='store_true',
+            help='Ignore checkpoints left by an interrupted load'
+        )
 
     def handle(self, *args, **options):
         """Entrypoint for command."""
@@ -29,31 +349,162 @@ class Command(BaseCommand):
         file_path = os.path.join(os.getcwd(), 'load_data', file)
         print("\033[94mload_data\033[m command reading files:")
         print(f"🔍 Using \033[94m{file_path}\033[m as file's location.")
-        model = self.get_model(file)
+        model_name = self.get_model_name(file)
         try:
-            with open(file_path) as csv_file:
-                data = csv.DictReader(csv_file)
-                self.insert_data(data, model)
-            print(f"✔️ Succesfully stored \033[92m{file}\033[m data into DB\n")
+            start = perf_counter()
+            stats = self.load_file(file_path, model_name, options)
+            elapsed = perf_counter() - start
+            print(f"✔️ Succesfully stored \033[92m{file}\033[m data into DB")
+            self.print_summary(stats, elapsed)
         except FileNotFoundError as e:
             print(f"💔 \033[91m{e}\033[m 💔\n")
             raise e
 
-    def get_model(self, file: str) -> Union[Excercises, Food]:
-        file_name = file.split('.csv')[0]
-        try:
-            model = MODEL_MAPPER[file_name]
-            return model
-        except KeyError as e:
+    def get_model_name(self, file: str) -> str:
+        file_name = os.path.basename(file).split('.csv')[0]
+        if file_name not in MODEL_MAPPER:
             msg = (
                 f"💔 \033[91mInvalid file name 💔\033[m"
                 f"You can use {list(MODEL_MAPPER.keys())}"
             )
             print(msg)
-            raise e
+            raise KeyError(file_name)
+        return file_name
+
+    def get_model(self, file: str) -> Union[Excercises, Food]:
+        return MODEL_MAPPER[self.get_model_name(file)]
+
+    def load_file(self, file_path: str, model_name: str, options) -> dict:
+        """Split the file in tasks and run them, resuming if possible."""
+        with open_source(file_path) as source:
+            header = source.readline()
+            data_start = source.tell()
+        fieldnames = parse_line(header)
+
+        tasks = [] if options['restart'] else self.resume_tasks(
+            file_path, model_name, fieldnames
+        )
+        if tasks:
+            print(f"⏯️ Resuming interrupted load of {len(tasks)} range(s)")
+        else:
+            self.clear_state(file_path, rejects=True)
+            ranges = split_ranges(
+                file_path, data_start, max(1, options['workers'])
+            )
+            tasks = [
+                LoadTask(index, file_path, model_name, fieldnames, *bounds)
+                for index, bounds in enumerate(ranges)
+            ]
+            for task in tasks:
+                task.save_checkpoint(task.start, dict.fromkeys(STAT_NAMES, 0))
+        for task in tasks:
+            task.batch_size = max(1, options['batch_size'])
+            task.on_conflict = options['on_conflict']
+
+        if len(tasks) == 1:
+            results = [load_range(tasks[0])]
+        else:
+            # Forked workers must not reuse the parent's open connections
+            connections.close_all()
+            with ProcessPoolExecutor(
+                len(tasks),
+                mp_context=multiprocessing.get_context('fork'),
+                initializer=init_worker,
+            ) as pool:
+                results = list(pool.map(load_range, tasks))
+
+        self.merge_rejects(file_path, fieldnames, len(tasks))
+        self.clear_state(file_path)
+        # bulk_create sends no signals, drop the cached catalog explicitly
+        catalog_cache.invalidate(MODEL_MAPPER[model_name])
+        if MODEL_MAPPER[model_name] is Excercises:
+            sync_muscles()
+        return {name: sum(result[name] for result in results)
+                for name in STAT_NAMES}
+
+    def resume_tasks(
+        self, file_path: str, model_name: str, fieldnames: List[str]
+    ) -> List[LoadTask]:
+        """Rebuild the tasks of an interrupted load from its checkpoints."""
+        tasks = []
+        pattern = f'{glob.escape(file_path)}{CHECKPOINT_SUFFIX}.*[0-9]'
+        for checkpoint_path in sorted(glob.glob(pattern)):
+            with open(checkpoint_path) as checkpoint:
+                state = json.load(checkpoint)
+            if state['signature'] != file_signature(file_path):
+                print("⚠️ Input file changed, ignoring old checkpoints")
+                return []
+            index = int(checkpoint_path.rsplit('.', 1)[1])
+            tasks.append(LoadTask(
+                index, file_path, model_name, fieldnames,
+                state['start'], state['end'],
+            ))
+        return tasks
+
+    def merge_rejects(self, file_path, fieldnames, parts: int) -> None:
+        """Join the reject files written by each worker into one file."""
+        reject_path = f'{file_path}{REJECT_SUFFIX}'
+        rejected = False
+        with open(reject_path, 'w', newline='') as output:
+            csv.writer(output).writerow(fieldnames + ['error'])
+            for index in range(parts):
+                part_path = f'{reject_path}.{index}'
+                if not os.path.exists(part_path):
+                    continue
+                with open(part_path, newline='') as part:
+                    content = part.read()
+                rejected = rejected or bool(content)
+                output.write(content)
+        if rejected:
+            print(f"⚠️ Rejected rows written to \033[93m{reject_path}\033[m")
+        else:
+            os.remove(reject_path)
 
-    def insert_data(self, data: dict, model: Union[Excercises, Food]) -> None:
-        """Insert data from csv file to exercise table"""
-        for row in data:
-            instance = model(**row)
-            instance.save()
+    def clear_state(self, file_path: str, rejects: bool = False) -> None:
+        """Remove checkpoints (and reject files) of a previous load."""
+        patterns = [f'{glob.escape(file_path)}{CHECKPOINT_SUFFIX}.*',
+                    f'{glob.escape(file_path)}{REJECT_SUFFIX}.*']
+        if rejects:
+            patterns.append(f'{glob.escape(file_path)}{REJECT_SUFFIX}')
+        for pattern in patterns:
+            for path in glob.glob(pattern):
+                os.remove(path)
+
+    def insert_data(
+        self,
+        data: Iterable[dict],
+        model: Union[Excercises, Food],
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        on_conflict: str = 'skip',
+    ) -> dict:
+        """
+        Insert already parsed rows into the model table.
+
+        Rows are written with ``bulk_create`` in batches, one transaction
+        per batch. Rows whose natural key already exists are skipped or
+        updated depending on ``on_conflict``, so the command can be
+        re-run safely on every container start.
+        """
+        stats = {'rows': 0, 'created': 0, 'updated': 0, 'skipped': 0}
+        for rows in batched(data, batch_size):
+            stats['rows'] += len(rows)
+            with transaction.atomic():
+                created, updated, skipped = store_batch(
+                    rows, model, on_conflict
+                )
+            stats['created'] += created
+            stats['updated'] += updated
+            stats['skipped'] += skipped
+        return stats
+
+    def print_summary(self, stats: dict, elapsed: float) -> None:
+        """Print the row counters and the load throughput."""
+        rate = stats['rows'] / elapsed if elapsed else 0
+        print(
+            f"📊 {stats['rows']} rows read: "
+            f"\033[92m{stats['created']}\033[m created, "
+            f"\033[94m{stats['updated']}\033[m updated, "
+            f"\033[93m{stats['skipped']}\033[m skipped, "
+            f"\033[91m{stats['rejected']}\033[m rejected "
+            f"in {elapsed:.2f}s ({rate:,.0f} rows/sec)\n"
+        )
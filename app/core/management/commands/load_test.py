@@ -0,0 +1,168 @@
+import asyncio
+from statistics import median
+from time import perf_counter
+from typing import Dict, List, Tuple
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+DEFAULT_PATHS = ['/', '/user', '/admin/']
+
+
+class HttpClient:
+    """Minimal keep-alive HTTP/1.1 client over an asyncio stream."""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def get(self, path: str) -> int:
+        """Send a GET request, read the whole response, return its status."""
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(
+                self.host, self.port
+            )
+        self.writer.write((
+            f'GET {path} HTTP/1.1\r\n'
+            f'Host: {self.host}\r\n'
+            'Connection: keep-alive\r\n\r\n'
+        ).encode())
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            await self.close()
+            raise ConnectionError('Connection closed by the server')
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding') == 'chunked':
+            while True:
+                size = int((await self.reader.readline()).strip(), 16)
+                await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+        else:
+            await self.reader.readexactly(
+                int(headers.get('content-length', 0))
+            )
+        if headers.get('connection', '').lower() == 'close':
+            await self.close()
+        return status
+
+    async def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except ConnectionError:
+                pass
+        self.reader = self.writer = None
+
+
+class Command(BaseCommand):
+    """ BaseCommand Wrapper """
+    help = '''
+    Load test a running server with concurrent keep-alive clients and
+    report p50/p99 latency and requests per second for each path.
+    Redirects (e.g. /admin/ to the login page) are not followed.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url', default='http://127.0.0.1:8000',
+            help='Base url of the server under test'
+        )
+        parser.add_argument(
+            '--paths', nargs='+', default=DEFAULT_PATHS,
+            help='Paths requested, one run per path'
+        )
+        parser.add_argument(
+            '--concurrency', type=int, default=20,
+            help='Number of simultaneous connections'
+        )
+        parser.add_argument(
+            '--requests', type=int, default=1000,
+            help='Number of requests per path'
+        )
+        parser.add_argument(
+            '--warmup', type=int, default=20,
+            help='Requests per path sent before measuring'
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        url = urlsplit(options['url'])
+        if url.scheme != 'http' or not url.hostname:
+            raise CommandError('Only plain http:// urls are supported')
+        port = url.port or 80
+        print(f"\033[94mload_test\033[m against {options['url']} with "
+              f"{options['concurrency']} connections")
+        for path in options['paths']:
+            latencies, errors, statuses, elapsed = asyncio.run(self.run(
+                url.hostname, port, path,
+                options['concurrency'], options['requests'],
+                options['warmup'],
+            ))
+            self.report(path, latencies, errors, statuses, elapsed)
+
+    async def run(
+        self, host: str, port: int, path: str,
+        concurrency: int, requests: int, warmup: int,
+    ) -> Tuple[List[float], int, Dict[int, int], float]:
+        latencies, statuses = [], {}
+        errors = 0
+        remaining = requests
+
+        async def worker(measure: bool):
+            nonlocal remaining, errors
+            client = HttpClient(host, port)
+            try:
+                while remaining > 0:
+                    remaining -= 1
+                    start = perf_counter()
+                    try:
+                        status = await client.get(path)
+                    except (OSError, ValueError, asyncio.IncompleteReadError):
+                        if measure:
+                            errors += 1
+                        await client.close()
+                        continue
+                    if measure:
+                        latencies.append((perf_counter() - start) * 1000)
+                        statuses[status] = statuses.get(status, 0) + 1
+            finally:
+                await client.close()
+
+        workers = max(1, concurrency)
+        remaining = warmup
+        await asyncio.gather(*(worker(False) for _ in range(workers)))
+        remaining = requests
+        start = perf_counter()
+        await asyncio.gather(*(worker(True) for _ in range(workers)))
+        return latencies, errors, statuses, perf_counter() - start
+
+    @staticmethod
+    def report(path, latencies, errors, statuses, elapsed) -> None:
+        if not latencies:
+            print(f"💔 \033[91m{path}\033[m: every request failed\n")
+            return
+        latencies.sort()
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        rate = len(latencies) / elapsed if elapsed else 0
+        codes = ', '.join(
+            f'{code}x{count}' for code, count in sorted(statuses.items())
+        )
+        print(
+            f"⏱️ \033[94m{path:<10}\033[m p50 {median(latencies):7.2f} ms  "
+            f"p99 {p99:7.2f} ms  {rate:8.1f} req/s  "
+            f"[{codes}] {errors} errors"
+        )
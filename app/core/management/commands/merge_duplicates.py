@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from core.duplicates import merge
+from core.management.commands.load_data import NATURAL_KEYS
+from core.routers import primary
+
+
+class Command(BaseCommand):
+    """ BaseCommand Wrapper """
+    help = '''
+    Merge the Food and Excercises rows stored several times under the same
+    natural key (name and brand, exercise_name): the oldest row is kept
+    and the rows pointing to the others point to it. Run it before the
+    migrate adding the unique constraints of the natural keys, which
+    fails while duplicates exist. Safe to run on any database, tables
+    not created yet are skipped.
+    '''
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        print("\033[94mmerge_duplicates\033[m running")
+        for model in NATURAL_KEYS:
+            # Looked up on default, where they are merged
+            with primary():
+                deleted = merge(model)
+            print(f"🧹 \033[94m{model._meta.label:>16}\033[m: "
+                  f"{deleted} duplicates merged")
@@ -0,0 +1,65 @@
+from datetime import date
+from time import perf_counter
+from django.core.management.base import BaseCommand, CommandError
+from core.meal_plans import (
+    DEFAULT_BATCH_SIZE, DEFAULT_MEAL_SHARES, DEFAULT_TOLERANCE, plan_all,
+)
+from core.routers import analytics
+
+
+class Command(BaseCommand):
+    """ BaseCommand Wrapper """
+    help = '''
+    Generate the meal plans of a day for every user with nutrition goals
+    (or only --users), replacing the plans already stored for that day.
+    Users are solved together, --batch-size at a time.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', type=date.fromisoformat,
+                            help='Day to plan, today by default')
+        parser.add_argument('--users', type=int, nargs='+', default=None)
+        parser.add_argument(
+            '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+            help='Number of users solved and stored together'
+        )
+        parser.add_argument(
+            '--meal-shares', type=float, nargs='+',
+            default=list(DEFAULT_MEAL_SHARES),
+            help='Share of the daily goals of each meal, in meal order'
+        )
+        parser.add_argument('--tolerance', type=float,
+                            default=DEFAULT_TOLERANCE)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        shares = options['meal_shares']
+        if any(share <= 0 for share in shares):
+            raise CommandError('--meal-shares must be positive')
+        print(f"\033[94mplan_meals\033[m planning {len(shares)} meals "
+              f"for {options['date'] or 'today'}")
+        start = perf_counter()
+        with analytics():
+            stats = plan_all(
+                options['date'], max(1, options['batch_size']),
+                options['users'],
+                progress=lambda stats: print(
+                    f"\r  {stats['users']} users processed", end='',
+                    flush=True,
+                ),
+                seed=options['seed'], meal_shares=shares,
+                tolerance=options['tolerance'],
+            )
+        elapsed = perf_counter() - start
+        planned = stats['planned']
+        adherence = stats['adherence_sum'] / planned if planned else 0
+        rate = planned / elapsed if elapsed else 0
+        print(
+            f"\n📊 \033[92m{planned}\033[m of {stats['users']} users planned "
+            f"({stats['items']} items) in {elapsed:.2f}s "
+            f"({rate:,.0f} users/s)\n"
+            f"🎯 {stats['on_target']} plans within "
+            f"{options['tolerance']:.0%} of every goal, mean adherence "
+            f"{adherence:.1f}\n"
+        )
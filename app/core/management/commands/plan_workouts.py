@@ -0,0 +1,45 @@
+from datetime import date
+from time import perf_counter
+from django.core.management.base import BaseCommand
+from core.sessions import (
+    DEFAULT_BATCH_SIZE, plan_week, sync_muscles, week_start,
+)
+from core.routers import analytics
+
+
+class Command(BaseCommand):
+    """ BaseCommand Wrapper """
+    help = '''
+    Plan the workout sessions of a week (the current one by default) for
+    every user assigned to a program, replacing the sessions already
+    planned that week. --sync-muscles first parses the target muscles of
+    every exercise, e.g. for exercises stored before the session builder.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--week', type=date.fromisoformat,
+                            help='Any day of the week to plan')
+        parser.add_argument(
+            '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+            help='Number of users written per transaction'
+        )
+        parser.add_argument('--sync-muscles', action='store_true')
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        if options['sync_muscles']:
+            changed = sync_muscles()
+            print(f"💪 Muscles of {changed} exercises updated")
+        monday = week_start(options['week'])
+        print(f"\033[94mplan_workouts\033[m planning the week of {monday}")
+        start = perf_counter()
+        with analytics():
+            stats = plan_week(monday, max(1, options['batch_size']))
+        elapsed = perf_counter() - start
+        rate = stats['sessions'] / elapsed if elapsed else 0
+        print(
+            f"📊 \033[92m{stats['users']}\033[m users of "
+            f"{stats['programs']} programs: {stats['sessions']} sessions, "
+            f"{stats['items']} exercises in {elapsed:.2f}s "
+            f"({rate:,.0f} sessions/s)\n"
+        )
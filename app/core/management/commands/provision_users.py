@@ -0,0 +1,63 @@
+import csv
+from time import perf_counter
+from django.core.management.base import BaseCommand, CommandError
+from core.provisioning import DEFAULT_BATCH_SIZE, provision
+
+REJECT_SUFFIX = '.rejects.csv'
+
+
+class Command(BaseCommand):
+    """ BaseCommand Wrapper """
+    help = '''
+    Create the users of a CSV or JSON lines (.jsonl) file, plain or gzip
+    compressed, with email and optionally password, name, sex and
+    available_workout_days columns. Passwords are hashed by a pool of
+    processes, users are inserted in batches and given their best
+    fitting program. Emails already stored are skipped, invalid rows are
+    written to a reject file next to the input.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help='CSV or JSON lines file of users')
+        parser.add_argument(
+            '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+            help='Number of users inserted per transaction'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help='Processes hashing passwords, one per CPU by default'
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        print(f"\033[94mprovision_users\033[m reading {options['file']}")
+        start = perf_counter()
+        try:
+            stats, rejects = provision(
+                options['file'], max(1, options['batch_size']),
+                options['workers'], progress=self.progress,
+            )
+        except FileNotFoundError as e:
+            raise CommandError(str(e))
+        elapsed = perf_counter() - start
+        rate = stats['created'] / elapsed if elapsed else 0
+        print(
+            f"\n📊 {stats['rows']} rows read: "
+            f"\033[92m{stats['created']}\033[m created "
+            f"({stats['assigned']} with a program), "
+            f"\033[93m{stats['skipped']}\033[m skipped, "
+            f"\033[91m{stats['rejected']}\033[m rejected "
+            f"in {elapsed:.2f}s ({rate:,.0f} users/s)"
+        )
+        if rejects:
+            reject_path = f"{options['file']}{REJECT_SUFFIX}"
+            with open(reject_path, 'w', newline='') as output:
+                writer = csv.writer(output)
+                writer.writerow(['line', 'email', 'error'])
+                writer.writerows(rejects)
+            print(f"⚠️ Rejected rows written to \033[93m{reject_path}\033[m")
+        print()
+
+    @staticmethod
+    def progress(stats: dict) -> None:
+        print(f"\r  {stats['rows']} rows processed", end='', flush=True)
@@ -0,0 +1,78 @@
+from collections import Counter
+from time import perf_counter
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from core.retention import DEFAULT_CHUNK_SIZE, pending_purges, purge_user
+from core.routers import primary
+
+
+class Command(BaseCommand):
+    """ BaseCommand Wrapper """
+    help = '''
+    Delete users and every row pointing to them, table by table, in
+    chunks that each run in a short transaction, instead of one
+    User.delete() cascade loading all their history into memory. A user
+    is deactivated when its purge starts; --resume completes the purges
+    that were interrupted.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('emails', nargs='*', help='Emails of the users')
+        parser.add_argument(
+            '--resume', action='store_true',
+            help='Complete the purges that were interrupted'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+            help='Rows deleted per transaction'
+        )
+        parser.add_argument(
+            '--pause', type=float, default=0,
+            help='Seconds to sleep between chunks'
+        )
+        parser.add_argument(
+            '--noinput', '--no-input', action='store_false',
+            dest='interactive', help='Do not ask for confirmation'
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        # Users and rows are picked on default, not on a lagging replica
+        with primary():
+            users = dict(
+                get_user_model().objects
+                .filter(email__in=options['emails'])
+                .values_list('email', 'id')
+            )
+            missing = set(options['emails']) - set(users)
+            if missing:
+                raise CommandError(f"Unknown users: {', '.join(missing)}")
+            user_ids = sorted(set(users.values()) | set(
+                pending_purges() if options['resume'] else []
+            ))
+            if not user_ids:
+                print("✔️ No user to purge")
+                return
+            if options['interactive'] and input(
+                f"⚠️ {len(user_ids)} users and all their data will be "
+                f"deleted. Type 'yes' to continue: "
+            ) != 'yes':
+                raise CommandError('Purge cancelled.')
+
+            print(f"\033[94mpurge_users\033[m purging {len(user_ids)} users")
+            total = Counter()
+            for user_id in user_ids:
+                start = perf_counter()
+                deleted = Counter()
+                for chunk in purge_user(user_id, max(1, options['chunk_size']),
+                                        options['pause']):
+                    deleted += chunk
+                    print(f"  user {user_id}: "
+                          f"{sum(deleted.values())} rows deleted", end='\r')
+                elapsed = perf_counter() - start
+                print(f"🗑️ user {user_id}: \033[92m{sum(deleted.values())}"
+                      f"\033[m rows deleted in {elapsed:.2f}s")
+                total += deleted
+        for label, count in sorted(total.items()):
+            print(f"📊 {label}: {count}")
+        print()
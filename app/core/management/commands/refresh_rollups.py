@@ -0,0 +1,43 @@
+from time import perf_counter
+from django.core.management.base import BaseCommand
+from core.rollups import (
+    DEFAULT_BATCH_SIZE, refresh_all, refresh_incremental,
+)
+from core.routers import analytics
+
+
+class Command(BaseCommand):
+    """ BaseCommand Wrapper """
+    help = '''
+    Refresh the daily, weekly and monthly training rollups from
+    WorkoutHistory and ExerciseHistory. By default only the buckets of
+    rows created since the previous run are recomputed.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+            help='Number of users refreshed per transaction'
+        )
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Rebuild the rollups of every user from scratch'
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        batch_size = max(1, options['batch_size'])
+        mode = 'full' if options['full'] else 'incremental'
+        print(f"\033[94mrefresh_rollups\033[m running in {mode} mode")
+        start = perf_counter()
+        with analytics():
+            if options['full']:
+                stats = refresh_all(batch_size)
+            else:
+                stats = refresh_incremental(batch_size)
+        elapsed = perf_counter() - start
+        print(
+            f"📊 {stats['users']} users: "
+            f"\033[92m{stats['rollups']}\033[m rollups written "
+            f"in {elapsed:.2f}s\n"
+        )
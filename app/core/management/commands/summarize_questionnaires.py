@@ -0,0 +1,32 @@
+from time import perf_counter
+from django.core.management.base import BaseCommand
+from core.questionnaires import DEFAULT_BATCH_SIZE, rebuild_all
+from core.routers import analytics
+
+
+class Command(BaseCommand):
+    """ BaseCommand Wrapper """
+    help = '''
+    Recompute the daily sleep and recovery scores of QuestionnaireSummary
+    from the raw SleepHistory and EvaluationQuestion answers, e.g. after
+    loading answers with SQL or correcting scores by hand.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+            help='Number of users summarized per transaction'
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        print("\033[94msummarize_questionnaires\033[m running")
+        start = perf_counter()
+        with analytics():
+            stats = rebuild_all(max(1, options['batch_size']))
+        elapsed = perf_counter() - start
+        print(
+            f"📊 {stats['users']} users: "
+            f"\033[92m{stats['days']}\033[m days summarized "
+            f"in {elapsed:.2f}s\n"
+        )
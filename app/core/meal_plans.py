@@ -0,0 +1,328 @@
+"""
+Meal plan generation.
+
+The Food catalog is held as a matrix of macros per gram, a row per food
+and a column per MACROS entry, cached through catalog_cache so it is
+rebuilt once foods change. A user's daily goals, from their latest
+NutritionHistory row, are split across the meals by ``meal_shares`` and
+every meal is filled greedily, for a whole batch of users at once:
+
+* each step adds to each user's meal the food and portion that most
+  reduce the squared relative error against the goals, scored over the
+  user's candidates for the meal (CANDIDATES_PER_MEAL foods)
+* a food is used once per day and a food type once per meal, and each
+  meal draws from its own random sample of the catalog so plans vary
+* portions are then refined one food at a time (coordinate descent),
+  bounded by PORTION_RANGE and rounded to PORTION_STEP grams
+
+A meal aims at its share of what the previous meals left, so it makes
+up for their excesses and shortfalls. Errors are relative to each goal
+and macros without a goal are ignored, as in nutrition.adherence, as
+are macros no food of the catalog provides.
+"""
+from datetime import date
+from decimal import Decimal
+from typing import (
+    Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence,
+)
+
+import numpy as np
+from django.db import transaction
+from django.utils import timezone
+
+from core.catalog_cache import catalog_cache
+from core.models import Food, MealPlanItem, NutritionHistory
+from core.nutrition import FOOD_REFERENCE_GRAMS, MACROS, latest_goals
+
+DEFAULT_MEAL_SHARES = (0.3, 0.4, 0.3)
+FOODS_PER_MEAL = 3
+# Grams of a food in a meal
+PORTION_RANGE = (20.0, 400.0)
+PORTION_STEP = 5
+# Foods sampled from the catalog as candidates for each meal
+CANDIDATES_PER_MEAL = 200
+REFINE_PASSES = 3
+# Relative error allowed on each macro for a plan to count as on target
+DEFAULT_TOLERANCE = 0.1
+DEFAULT_BATCH_SIZE = 200
+
+# kcal per gram of carbohydrates, proteins and fats (Atwater factors)
+ATWATER = {'carbohydrates': 4.0, 'proteins': 4.0, 'fats': 9.0}
+
+CENTS = Decimal('0.01')
+
+
+class FoodMatrix(NamedTuple):
+    # Food ids, one per row
+    ids: np.ndarray
+    # Macros per gram, a column per MACROS entry
+    per_gram: np.ndarray
+    # Index of each food's type
+    types: np.ndarray
+
+
+class Plan(NamedTuple):
+    # Row in the FoodMatrix of each (user, meal, slot), -1 when empty
+    foods: np.ndarray
+    grams: np.ndarray
+    # Daily macros of each user's plan
+    totals: np.ndarray
+
+
+def _load_matrix() -> FoodMatrix:
+    rows = list(
+        Food.objects.order_by('id').values_list('id', 'type', *MACROS)
+    )
+    per_gram = np.array(
+        [row[2:] for row in rows], dtype=np.float64
+    ).reshape(-1, len(MACROS)) / float(FOOD_REFERENCE_GRAMS)
+    # Foods loaded without their calories get them from their macros
+    calories = per_gram[:, MACROS.index('calories')]
+    estimated = sum(per_gram[:, MACROS.index(macro)] * factor
+                    for macro, factor in ATWATER.items())
+    calories[calories == 0] = estimated[calories == 0]
+    # Foods without any macro can't bring a plan closer to its goals
+    keep = per_gram.any(axis=1)
+    _, types = np.unique(
+        np.array([row[1] for row in rows], dtype=object).astype(str),
+        return_inverse=True,
+    )
+    return FoodMatrix(
+        ids=np.array([row[0] for row in rows], dtype=np.int64)[keep],
+        per_gram=per_gram[keep],
+        types=types.reshape(-1)[keep],
+    )
+
+
+def food_matrix() -> FoodMatrix:
+    """The catalog matrix, cached until the Food catalog changes."""
+    return catalog_cache.get_or_load(Food, 'meal_plans:matrix', _load_matrix)
+
+
+def solve(
+    goals: np.ndarray,
+    matrix: FoodMatrix,
+    rngs: Sequence[np.random.Generator],
+    meal_shares: Sequence[float] = DEFAULT_MEAL_SHARES,
+    foods_per_meal: int = FOODS_PER_MEAL,
+) -> Plan:
+    """
+    Plan the day of every user of ``goals`` (a row of MACROS goals per
+    user), drawing each user's candidate foods with their own ``rngs``.
+    Scores are computed on the candidates of each user only, a users ×
+    CANDIDATES_PER_MEAL slice of the catalog whatever its size.
+    """
+    users, foods = len(goals), len(matrix.ids)
+    per_gram = matrix.per_gram
+    squared = per_gram ** 2
+    types = matrix.types
+    rows = np.arange(users)
+    low, high = PORTION_RANGE
+    plan_foods = np.full((users, len(meal_shares), foods_per_meal), -1)
+    plan_grams = np.zeros((users, len(meal_shares), foods_per_meal))
+    totals = np.zeros((users, len(MACROS)))
+    if not users or not foods:
+        return Plan(plan_foods, plan_grams, totals)
+    sample_size = min(CANDIDATES_PER_MEAL, foods)
+    remaining = float(sum(meal_shares))
+
+    for meal, meal_share in enumerate(meal_shares):
+        meal_goals = goals * meal_share
+        weight = np.divide(
+            1.0, meal_goals, out=np.zeros_like(meal_goals),
+            where=meal_goals > 0,
+        )
+        # Relative error against the meal's share of what is left
+        error = (goals - totals) * (meal_share / remaining) * weight
+        remaining -= meal_share
+        # Rows of the FoodMatrix each user draws from, users × candidates
+        candidates = np.stack([
+            rng.choice(foods, sample_size, replace=False) for rng in rngs
+        ])
+        candidate_types = types[candidates]
+        candidate_macros = per_gram[candidates]
+        # Squared weighted norm of each candidate
+        denominator = np.einsum('um,ucm->uc', weight ** 2,
+                                squared[candidates])
+        # Foods of the previous meals, used once per day
+        excluded = (candidates[:, :, None]
+                    == plan_foods[:, :meal].reshape(users, 1, -1)).any(axis=2)
+        excluded |= ~(denominator > 0)
+        for slot in range(foods_per_meal):
+            numerator = np.einsum('um,ucm->uc', weight * error,
+                                  candidate_macros)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                portion = np.clip(numerator / denominator, low, high)
+                gain = portion * (2 * numerator - portion * denominator)
+            gain[excluded] = -np.inf
+            best = gain.argmax(axis=1)
+            chosen = gain[rows, best] > 0
+            grams = np.where(chosen, portion[rows, best], 0.0)
+            error -= grams[:, None] * candidate_macros[rows, best] * weight
+            food = candidates[rows, best]
+            plan_foods[:, meal, slot] = np.where(chosen, food, -1)
+            plan_grams[:, meal, slot] = grams
+            # A food once per day, a food type once per meal
+            excluded[rows[chosen], best[chosen]] = True
+            excluded |= (chosen[:, None] & (
+                candidate_types == candidate_types[rows, best][:, None]
+            ))
+
+        _refine(plan_foods[:, meal], plan_grams[:, meal], per_gram, weight,
+                error)
+        for slot in range(foods_per_meal):
+            picked = plan_foods[:, meal, slot]
+            totals += (plan_grams[:, meal, slot, None]
+                       * per_gram[picked] * (picked >= 0)[:, None])
+    return Plan(plan_foods, plan_grams, totals)
+
+
+def _refine(foods: np.ndarray, grams: np.ndarray, per_gram: np.ndarray,
+            weight: np.ndarray, error: np.ndarray) -> None:
+    """
+    Re-fit the portions of a meal one slot at a time, all users at once,
+    then round them. ``grams`` and ``error`` are updated in place.
+    """
+    low, high = PORTION_RANGE
+    for _ in range(REFINE_PASSES):
+        for slot in range(foods.shape[1]):
+            picked = foods[:, slot] >= 0
+            column = per_gram[foods[:, slot]] * weight * picked[:, None]
+            error += grams[:, slot, None] * column
+            norm = (column ** 2).sum(axis=1)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                best = np.clip((column * error).sum(axis=1) / norm,
+                               low, high)
+            grams[:, slot] = np.where(picked & (norm > 0), best, 0.0)
+            error -= grams[:, slot, None] * column
+    grams[:] = np.where(
+        grams > 0,
+        np.clip(np.round(grams / PORTION_STEP) * PORTION_STEP, low, high),
+        0.0,
+    )
+
+
+def scores(totals: np.ndarray, goals: np.ndarray,
+           tolerance: float = DEFAULT_TOLERANCE):
+    """
+    Adherence (0-100, as nutrition.adherence) of each plan to its goals,
+    and whether every macro with a goal is within ``tolerance``.
+    """
+    has_goal = goals > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        relative = np.where(has_goal, np.abs(totals - goals) / goals, 0.0)
+    closeness = np.where(has_goal, np.maximum(0.0, 1 - relative), 0.0)
+    counted = has_goal.sum(axis=1)
+    adherence = np.divide(
+        100 * closeness.sum(axis=1), counted,
+        out=np.zeros(len(goals)), where=counted > 0,
+    )
+    return adherence, (relative <= tolerance).all(axis=1) & (counted > 0)
+
+
+def _goals(histories: Dict[int, NutritionHistory], user_ids: List[int]):
+    return np.array([
+        [float(getattr(histories[user_id], f'{macro}_goal') or 0)
+         for macro in MACROS]
+        for user_id in user_ids
+    ], dtype=np.float64).reshape(-1, len(MACROS))
+
+
+def plan_users(
+    user_ids: Iterable[int],
+    day: Optional[date] = None,
+    seed: int = 0,
+    meal_shares: Sequence[float] = DEFAULT_MEAL_SHARES,
+    tolerance: float = DEFAULT_TOLERANCE,
+) -> Dict[str, float]:
+    """
+    Plan and store the meals of ``day`` (today by default) for users
+    with goals, replacing their previous plan of that day. A user's plan
+    only depends on their goals, the catalog, ``seed`` and ``day``.
+    """
+    day = day or timezone.localdate()
+    user_ids = list(user_ids)
+    histories = latest_goals(user_ids)
+    planned = [user_id for user_id in user_ids if user_id in histories]
+    goals = _goals(histories, planned)
+    has_goals = (goals > 0).any(axis=1)
+    planned = [user_id for user_id, keep in zip(planned, has_goals) if keep]
+    goals = goals[has_goals]
+
+    matrix = food_matrix()
+    # Goals of macros no food provides (e.g. a catalog loaded without
+    # sodium values) can't be planned for and are left out
+    goals[:, ~matrix.per_gram.any(axis=0)] = 0
+    plan = solve(
+        goals, matrix,
+        [np.random.default_rng([seed, day.toordinal(), user_id])
+         for user_id in planned],
+        meal_shares,
+    )
+    items = [
+        MealPlanItem(
+            user_id=user_id, date=day, meal_number=meal + 1,
+            food_id=int(matrix.ids[food]),
+            grams=Decimal(float(grams)).quantize(CENTS),
+        )
+        for user_id, user_foods, user_grams
+        in zip(planned, plan.foods, plan.grams)
+        for meal in range(len(meal_shares))
+        for food, grams in zip(user_foods[meal], user_grams[meal])
+        if food >= 0
+    ]
+    with transaction.atomic():
+        MealPlanItem.objects.filter(user_id__in=planned, date=day).delete()
+        MealPlanItem.objects.bulk_create(items, batch_size=1000)
+
+    adherence, on_target = scores(plan.totals, goals, tolerance)
+    return {
+        'users': len(user_ids),
+        'planned': len(planned),
+        'items': len(items),
+        'on_target': int(on_target.sum()),
+        'adherence_sum': float(adherence.sum()),
+    }
+
+
+def user_plan(user_id: int, day: Optional[date] = None) -> List[MealPlanItem]:
+    """A user's plan of ``day``, generated if there is none yet."""
+    day = day or timezone.localdate()
+    queryset = (
+        MealPlanItem.objects.filter(user_id=user_id, date=day)
+        .select_related('food').order_by('meal_number', 'id')
+    )
+    items = list(queryset)
+    if not items:
+        plan_users([user_id], day)
+        items = list(queryset.all())
+    return items
+
+
+def _batches(items: List, size: int) -> Iterator[List]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def plan_all(
+    day: Optional[date] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    user_ids: Optional[Iterable[int]] = None,
+    progress: Optional[Callable[[Dict[str, float]], None]] = None,
+    **options,
+) -> Dict[str, float]:
+    """Plan ``day`` for every user with goals, ``batch_size`` at a time."""
+    if user_ids is None:
+        user_ids = (
+            NutritionHistory.objects.values_list('user_id', flat=True)
+            .distinct().order_by('user_id')
+        )
+    user_ids = list(user_ids)
+    stats = {'users': 0, 'planned': 0, 'items': 0, 'on_target': 0,
+             'adherence_sum': 0.0}
+    for batch in _batches(user_ids, batch_size):
+        for name, value in plan_users(batch, day, **options).items():
+            stats[name] += value
+        if progress:
+            progress(stats)
+    return stats
@@ -0,0 +1,32 @@
+"""
+Middleware recording per-view latency and SQL statistics, see
+core/instrumentation.py.
+"""
+import asyncio
+
+from django.utils.decorators import sync_and_async_middleware
+
+from core import instrumentation
+
+
+@sync_and_async_middleware
+def instrumentation_middleware(get_response):
+    """Time every request and the SQL it runs, without thread hops."""
+    if not instrumentation.enabled():
+        return get_response
+
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            state = instrumentation.start_request()
+            try:
+                return await get_response(request)
+            finally:
+                instrumentation.finish_request(request, state)
+    else:
+        def middleware(request):
+            state = instrumentation.start_request()
+            try:
+                return get_response(request)
+            finally:
+                instrumentation.finish_request(request, state)
+    return middleware
@@ -10,6 +10,7 @@ from decimal import Decimal
 from django.conf import settings
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.db import models
+from django.utils import timezone
 
 from django.contrib.auth.models import (
     AbstractBaseUser,
@@ -45,12 +46,9 @@ class UserManager(BaseUserManager):
 
     def create_superuser(self, email, password):
         """Creates and returns a new superuser."""
-        user = self.create_user(email, password)
-        user.is_staff = True
-        user.is_superuser = True
-        user.save(using=self._db)
-
-        return user
+        return self.create_user(
+            email, password, is_staff=True, is_superuser=True
+        )
 
 
 class User(AbstractBaseUser, PermissionsMixin):
@@ -61,8 +59,9 @@ class User(AbstractBaseUser, PermissionsMixin):
 
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
-    signup_time = models.DateTimeField(auto_now=True)
-    last_login = models.DateTimeField(auto_now=True)
+    signup_time = models.DateTimeField(auto_now_add=True)
+    # Throttled by core.auth.update_last_login
+    last_login = models.DateTimeField(blank=True, null=True)
     # birth_date = models.DateField(default=None, blank=True, null=True)
 
     # city = models.CharField(max_length=255)
@@ -77,6 +76,14 @@ class User(AbstractBaseUser, PermissionsMixin):
 
     USERNAME_FIELD = "email"
 
+    class Meta:
+        indexes = [
+            # Admin search and filters, paginated by id
+            models.Index(fields=['name']),
+            models.Index(fields=['is_staff', 'id']),
+            models.Index(fields=['sex', 'id']),
+        ]
+
 
 class ProgramType(models.Model):
     """
@@ -112,12 +119,22 @@ class AntrhopometricHistory(models.Model):
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
     )
-    date = models.DateField(auto_now=True)
+    date = models.DateField(default=timezone.localdate)
     height = models.FloatField()
     weight = models.FloatField()
     neck = models.FloatField()
     waist = models.FloatField()
     hip = models.FloatField()
+    # Derived by core.anthropometrics, NULL when the inputs don't allow it
+    bmi = models.FloatField(blank=True, null=True)
+    body_fat = models.FloatField(blank=True, null=True)
+    waist_hip_ratio = models.FloatField(blank=True, null=True)
+    waist_height_ratio = models.FloatField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'date']),
+        ]
 
 
 # User's food and nutrition ---------
@@ -129,7 +146,7 @@ class NutritionalHistory(models.Model):
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
     )
-    date = models.DateField(auto_now=True)
+    date = models.DateField(default=timezone.localdate)
     carbohydrates_real = models.IntegerField(blank=True, null=True)
     proteins_real = models.IntegerField(blank=True, null=True)
     fats_real = models.IntegerField(blank=True, null=True)
@@ -144,6 +161,11 @@ class NutritionalHistory(models.Model):
     calories_goal = models.IntegerField(blank=True, null=True)
     carbohydrates_goal = models.IntegerField(blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'date']),
+        ]
+
 
 # Validators for adherence field
 PERCENTAGE_VALIDATOR = [MinValueValidator(0), MaxValueValidator(100)]
@@ -151,6 +173,12 @@ PERCENTAGE_VALIDATOR = [MinValueValidator(0), MaxValueValidator(100)]
 # Variable for Macronutrients settings
 MACRO_FIELDS = {'max_digits': 4, 'decimal_places': 1, 'default': Decimal(0.0)}
 
+# Variable for daily nutrition totals (a day's calories or sodium can
+# exceed 999.99)
+DAILY_NUTRITION_FIELDS = {
+    'max_digits': 7, 'decimal_places': 2, 'default': Decimal(0),
+}
+
 
 class Food(models.Model):
     """Defines nutritional values of food."""
@@ -165,6 +193,22 @@ class Food(models.Model):
     fibers = models.DecimalField(**MACRO_FIELDS)
     sodium = models.DecimalField(**MACRO_FIELDS)
     calories = models.DecimalField(**MACRO_FIELDS)
+    # Part of the signature food.search checks to see changes made by
+    # other processes
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            # load_data's natural key, its index also serves lookups by
+            # name alone
+            models.UniqueConstraint(fields=['name', 'brand'],
+                                    name='food_natural_key'),
+        ]
+        indexes = [
+            models.Index(fields=['brand']),
+            models.Index(fields=['type']),
+            models.Index(fields=['updated_at']),
+        ]
 
 
 class Ingestion(models.Model):
@@ -176,9 +220,22 @@ class Ingestion(models.Model):
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
     )
-    date = models.DateTimeField(auto_now=True)
+    date = models.DateTimeField(default=timezone.now)
     meal_number = models.PositiveSmallIntegerField()
     value = models.DecimalField(max_digits=5, decimal_places=2)
+    # Id generated by the client app, makes sync retries idempotent
+    client_id = models.UUIDField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'date']),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'client_id'],
+                name='unique_ingestion_client_id',
+            ),
+        ]
 
 
 class FoodIngestion(models.Model):
@@ -198,26 +255,58 @@ class NutritionHistory(models.Model):
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
     )
-    date = models.DateTimeField(auto_now=True)
-    carbohydrates_real = models.DecimalField(max_digits=5, decimal_places=2)
-    proteins_real = models.DecimalField(max_digits=5, decimal_places=2)
-    fats_real = models.DecimalField(max_digits=5, decimal_places=2)
-    fibers_real = models.DecimalField(max_digits=5, decimal_places=2)
-    sodium_real = models.DecimalField(max_digits=5, decimal_places=2)
-    calories_real = models.DecimalField(max_digits=5, decimal_places=2)
-    carbohydrates_goal = models.DecimalField(max_digits=5, decimal_places=2)
-    proteins_goal = models.DecimalField(max_digits=5, decimal_places=2)
-    fats_goal = models.DecimalField(max_digits=5, decimal_places=2)
-    fibers_goal = models.DecimalField(max_digits=5, decimal_places=2)
-    sodium_goal = models.DecimalField(max_digits=5, decimal_places=2)
-    calories_goal = models.DecimalField(max_digits=5, decimal_places=2)
+    # Day the totals belong to, filled by the nutrition aggregation job
+    date = models.DateTimeField(default=timezone.now)
+    carbohydrates_real = models.DecimalField(**DAILY_NUTRITION_FIELDS)
+    proteins_real = models.DecimalField(**DAILY_NUTRITION_FIELDS)
+    fats_real = models.DecimalField(**DAILY_NUTRITION_FIELDS)
+    fibers_real = models.DecimalField(**DAILY_NUTRITION_FIELDS)
+    sodium_real = models.DecimalField(**DAILY_NUTRITION_FIELDS)
+    calories_real = models.DecimalField(**DAILY_NUTRITION_FIELDS)
+    carbohydrates_goal = models.DecimalField(**DAILY_NUTRITION_FIELDS)
+    proteins_goal = models.DecimalField(**DAILY_NUTRITION_FIELDS)
+    fats_goal = models.DecimalField(**DAILY_NUTRITION_FIELDS)
+    fibers_goal = models.DecimalField(**DAILY_NUTRITION_FIELDS)
+    sodium_goal = models.DecimalField(**DAILY_NUTRITION_FIELDS)
+    calories_goal = models.DecimalField(**DAILY_NUTRITION_FIELDS)
     adherence = models.DecimalField(
-        max_digits=3,
+        max_digits=4,
         decimal_places=1,
         default=Decimal(0),
         validators=PERCENTAGE_VALIDATOR,
     )
 
+    class Meta:
+        constraints = [
+            # One row per day of a user: the aggregation job stores each
+            # day at local midnight
+            models.UniqueConstraint(
+                fields=['user', 'date'],
+                name='unique_nutrition_history_day',
+            ),
+        ]
+
+
+class MealPlanItem(models.Model):
+    """
+    Food and portion suggested for a meal of a user's day by the meal
+    plan generator, see core/meal_plans.py
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+    )
+    date = models.DateField()
+    meal_number = models.PositiveSmallIntegerField()
+    food = models.ForeignKey(Food, on_delete=models.CASCADE)
+    # Grams, like Ingestion.value
+    grams = models.DecimalField(max_digits=5, decimal_places=2)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'date']),
+        ]
+
 
 # Workout data ---------
 
@@ -227,7 +316,14 @@ class Workouts(models.Model):
     """
     id = models.AutoField(primary_key=True)
     workout_type = models.CharField(max_length=255)
-    program_type_id = models.IntegerField(blank=True, null=True)
+    # Same program_type_id column as the former plain integer
+    program_type = models.ForeignKey(
+        ProgramType,
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        related_name='workouts',
+    )
 
 
 class Excercises(models.Model):
@@ -238,9 +334,80 @@ class Excercises(models.Model):
     exercise_name = models.CharField(max_length=255)
     target_muscle = models.CharField(max_length=255)
     workout_type = models.CharField(max_length=255)
-    video_link = models.CharField(max_length=255, default='')
+    video_link = models.CharField(max_length=255, default='', blank=True)
     # FileField class FileField(upload_to='',
     # storage=None, max_length=100, **options)
+    # Parsed from target_muscle by core/sessions.py
+    muscles = models.ManyToManyField(
+        'Muscle',
+        through='ExerciseMuscle',
+        related_name='exercises',
+        blank=True,
+    )
+
+    class Meta:
+        indexes = [
+            # Filtered listings paginated by id in user_view
+            models.Index(fields=['target_muscle', 'id']),
+            models.Index(fields=['workout_type', 'id']),
+        ]
+        constraints = [
+            # load_data's natural key
+            models.UniqueConstraint(fields=['exercise_name'],
+                                    name='excercises_natural_key'),
+        ]
+
+
+class Muscle(models.Model):
+    """
+    Muscle group targeted by exercises, with a normalized name
+    (lowercase, without accents)
+    """
+    name = models.CharField(max_length=100, unique=True)
+
+
+class ExerciseMuscle(models.Model):
+    """
+    Bridge between an exercise and the muscles of its target_muscle
+    """
+    exercise = models.ForeignKey(Excercises, on_delete=models.CASCADE)
+    muscle = models.ForeignKey(Muscle, on_delete=models.CASCADE)
+    # Order in target_muscle, 0 is the primary muscle
+    position = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['exercise', 'muscle'],
+                name='unique_exercise_muscle',
+            ),
+        ]
+
+
+class WorkoutPlanItem(models.Model):
+    """
+    Exercise planned for a user's day by the session builder, see
+    core/sessions.py
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+    )
+    date = models.DateField()
+    workout = models.ForeignKey(
+        Workouts,
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+    )
+    exercise = models.ForeignKey(Excercises, on_delete=models.CASCADE)
+    # Order of the exercise in the session
+    position = models.PositiveSmallIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'date']),
+        ]
 
 
 class WorkoutHistory(models.Model):
@@ -252,12 +419,26 @@ class WorkoutHistory(models.Model):
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
     )
+    date = models.DateTimeField(default=timezone.now)
     adherence = models.DecimalField(
         max_digits=3,
         decimal_places=1,
         default=Decimal(0),
         validators=PERCENTAGE_VALIDATOR,
     )
+    # Id generated by the client app, makes sync retries idempotent
+    client_id = models.UUIDField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'date']),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'client_id'],
+                name='unique_workouthistory_client_id',
+            ),
+        ]
 
 
 class ExerciseHistory(models.Model):
@@ -270,6 +451,7 @@ class ExerciseHistory(models.Model):
         on_delete=models.CASCADE,
     )
     exercise_name = models.CharField(max_length=255)
+    date = models.DateTimeField(default=timezone.now)
     reps_real = models.IntegerField(blank=True, null=True)
     weight_real = models.IntegerField(blank=True, null=True)
     rest_real = models.IntegerField(blank=True, null=True)
@@ -284,6 +466,19 @@ class ExerciseHistory(models.Model):
         default=Decimal(0),
         validators=PERCENTAGE_VALIDATOR,
     )
+    # Id generated by the client app, makes sync retries idempotent
+    client_id = models.UUIDField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'date']),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'client_id'],
+                name='unique_exercisehistory_client_id',
+            ),
+        ]
 
 
 class ExerciseWorkoutHistory(models.Model):
@@ -300,6 +495,52 @@ class ExerciseWorkoutHistory(models.Model):
                                     )
 
 
+ROLLUP_PERIODS = [
+    ("day", "Day"),
+    ("week", "Week"),
+    ("month", "Month"),
+]
+
+
+class TrainingRollup(models.Model):
+    """
+    Materialized training totals of a user for a day, week or month,
+    kept current from WorkoutHistory and ExerciseHistory
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+    )
+    period = models.CharField(max_length=5, choices=ROLLUP_PERIODS)
+    period_start = models.DateField()
+    workouts = models.PositiveIntegerField(default=0)
+    workout_adherence = models.DecimalField(
+        max_digits=4, decimal_places=1, default=Decimal(0),
+    )
+    exercises = models.PositiveIntegerField(default=0)
+    exercise_adherence = models.DecimalField(
+        max_digits=4, decimal_places=1, default=Decimal(0),
+    )
+    # Sum of reps_real * weight_real
+    volume = models.BigIntegerField(default=0)
+    reps_real = models.BigIntegerField(default=0)
+    reps_goal = models.BigIntegerField(default=0)
+    weight_real = models.BigIntegerField(default=0)
+    weight_goal = models.BigIntegerField(default=0)
+    rest_real = models.BigIntegerField(default=0)
+    rest_goal = models.BigIntegerField(default=0)
+    duration_real = models.BigIntegerField(default=0)
+    duration_goal = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'period', 'period_start'],
+                name='unique_training_rollup_bucket',
+            ),
+        ]
+
+
 # Evaluation section ---------
 class Question(models.Model):
     """
@@ -324,10 +565,22 @@ class EvaluationQuestion(models.Model):
     """
     # where does evaluation id come from?
     id = models.AutoField(primary_key=True)
+    # Who answered, NULL on rows stored before answers were per user
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        blank=True,
+        null=True,
+    )
     question_id = models.ForeignKey(Question, on_delete=models.CASCADE)
-    date = models.DateField(auto_now=True)
+    date = models.DateField(default=timezone.localdate)
     score = models.IntegerField(blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'date']),
+        ]
+
 
 class SleepQuestion(models.Model):
     """
@@ -336,7 +589,7 @@ class SleepQuestion(models.Model):
     # is this the right id...
     id = models.AutoField(primary_key=True)
     question_id = models.ForeignKey(Question, on_delete=models.CASCADE)
-    date = models.DateField(auto_now=True)
+    date = models.DateField(default=timezone.localdate)
     score = models.IntegerField(blank=True, null=True)
 
 
@@ -353,5 +606,117 @@ class SleepHistory(models.Model):
                             SleepQuestion,
                             on_delete=models.CASCADE,
                         )
-    date = models.DateField(auto_now=True)
+    date = models.DateField(default=timezone.localdate)
+    score = models.IntegerField(blank=True, null=True)
+    # Id generated by the client app, makes sync retries idempotent
+    client_id = models.UUIDField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'date']),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'client_id'],
+                name='unique_sleephistory_client_id',
+            ),
+        ]
+
+
+class QuestionnaireSummary(models.Model):
+    """
+    Composite questionnaire scores of a user's day, see core.questionnaires
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+    )
+    date = models.DateField()
+    # 0 to 100, NULL when no question of the kind was answered that day
+    sleep_score = models.DecimalField(
+        max_digits=4, decimal_places=1, blank=True, null=True,
+    )
+    sleep_answers = models.PositiveSmallIntegerField(default=0)
+    recovery_score = models.DecimalField(
+        max_digits=4, decimal_places=1, blank=True, null=True,
+    )
+    recovery_answers = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'date'],
+                name='unique_questionnaire_summary_day',
+            ),
+        ]
+
+
+# Archived history ---------
+# Rows older than the retention window are moved here by archive_history,
+# keeping their ids, so the hot tables and their indexes stay small. The
+# ids are 64-bit so they fit any id of the tables they archive.
+
+class IngestionArchive(models.Model):
+    """
+    Archived ingestion history records, same columns as Ingestion
+    """
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+    )
+    date = models.DateTimeField()
+    meal_number = models.PositiveSmallIntegerField()
+    value = models.DecimalField(max_digits=5, decimal_places=2)
+    client_id = models.UUIDField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'date']),
+        ]
+
+
+class FoodIngestionArchive(models.Model):
+    """
+    Archived bridge rows between Food and IngestionArchive
+    """
+    id = models.BigIntegerField(primary_key=True)
+    food_id = models.ForeignKey(Food, on_delete=models.CASCADE)
+    ingestion_id = models.ForeignKey(
+        IngestionArchive,
+        on_delete=models.CASCADE,
+    )
+
+
+class SleepHistoryArchive(models.Model):
+    """
+    Archived sleep history, same columns as SleepHistory
+    """
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+    )
+    sleep_question_id = models.ForeignKey(
+                            SleepQuestion,
+                            on_delete=models.CASCADE,
+                        )
+    date = models.DateField()
     score = models.IntegerField(blank=True, null=True)
+    client_id = models.UUIDField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'date']),
+        ]
+
+
+# Batch jobs ---------
+
+class JobWatermark(models.Model):
+    """
+    Last row id processed by an incremental batch job
+    """
+    name = models.CharField(max_length=100, unique=True)
+    last_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
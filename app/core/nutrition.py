@@ -0,0 +1,248 @@
+"""
+Daily nutrition aggregation.
+
+Totals what each user ate per day by joining FoodIngestion rows to the
+Food macros in one GROUP BY query per batch of users, and stores the
+totals with the adherence against the day's goals in NutritionHistory.
+"""
+from collections import defaultdict
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from django.db import transaction
+from django.db.models import (
+    DecimalField, ExpressionWrapper, F, Max, OuterRef, Subquery, Sum, Value,
+)
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from core.models import FoodIngestion, JobWatermark, NutritionHistory
+
+MACROS = ('carbohydrates', 'proteins', 'fats', 'fibers', 'sodium', 'calories')
+
+# Food macros are given per 100 g and Ingestion.value holds the grams eaten
+FOOD_REFERENCE_GRAMS = Decimal(100)
+
+WATERMARK_NAME = 'nutrition:food_ingestion'
+# FoodIngestion ids below the watermark scanned again by each incremental
+# run: a row whose transaction commits after the run read Max(id) can
+# have a lower id than that maximum
+WATERMARK_LAG = 10000
+
+DEFAULT_BATCH_SIZE = 500
+
+CENTS = Decimal('0.01')
+TENTHS = Decimal('0.1')
+
+DayKey = Tuple[int, date]
+
+
+def _macro_total(macro: str) -> Sum:
+    eaten = ExpressionWrapper(
+        F(f'food_id__{macro}') * F('ingestion_id__value')
+        / Value(FOOD_REFERENCE_GRAMS),
+        output_field=DecimalField(max_digits=14, decimal_places=4),
+    )
+    return Sum(eaten)
+
+
+def daily_totals(
+    user_ids: Iterable[int],
+    days: Optional[Set] = None,
+) -> Dict[DayKey, Dict[str, Decimal]]:
+    """
+    Return ``{(user_id, day): {macro: total}}`` for the given users,
+    optionally restricted to ``days``, computed in a single query.
+    """
+    queryset = FoodIngestion.objects.filter(
+        ingestion_id__user_id__in=list(user_ids)
+    )
+    if days is not None:
+        queryset = queryset.filter(ingestion_id__date__date__in=days)
+    rows = (
+        queryset
+        .annotate(day=TruncDate('ingestion_id__date'))
+        .values('ingestion_id__user_id', 'day')
+        .annotate(**{macro: _macro_total(macro) for macro in MACROS})
+        .order_by()
+    )
+    return {
+        (row['ingestion_id__user_id'], row['day']): {
+            macro: Decimal(row[macro] or 0).quantize(CENTS)
+            for macro in MACROS
+        }
+        for row in rows
+    }
+
+
+def adherence(history: NutritionHistory) -> Decimal:
+    """
+    Mean closeness (0-100) of the real values to their goals, over the
+    macros that have a goal. 100 means every goal was hit exactly.
+    """
+    scores = []
+    for macro in MACROS:
+        goal = getattr(history, f'{macro}_goal')
+        if goal and goal > 0:
+            real = getattr(history, f'{macro}_real')
+            scores.append(max(Decimal(0), 1 - abs(real - goal) / goal))
+    if not scores:
+        return Decimal(0)
+    return (100 * sum(scores) / len(scores)).quantize(TENTHS)
+
+
+def latest_goals(user_ids: List[int]) -> Dict[int, NutritionHistory]:
+    """Most recent history row of each user, used to carry goals over."""
+    latest = NutritionHistory.objects.filter(
+        user_id=OuterRef('user_id')
+    ).order_by('-date', '-id').values('id')[:1]
+    ids = (
+        NutritionHistory.objects
+        .filter(user_id__in=user_ids)
+        .annotate(latest_id=Subquery(latest))
+        .filter(id=F('latest_id'))
+        .values_list('id', flat=True)
+    )
+    return {
+        history.user_id: history
+        for history in NutritionHistory.objects.filter(id__in=list(ids))
+    }
+
+
+def aggregate_users(
+    user_ids: List[int],
+    pairs: Optional[Set[DayKey]] = None,
+) -> Dict[str, int]:
+    """
+    Recompute and store the daily totals of a batch of users, or only
+    the given ``(user_id, day)`` pairs.
+
+    Existing NutritionHistory rows for a day are updated in place. Days
+    without a row get a new one, with the goals of the user's latest row.
+    """
+    days = None if pairs is None else {day for _, day in pairs}
+    totals = daily_totals(user_ids, days)
+    if pairs is not None:
+        totals = {key: value for key, value in totals.items()
+                  if key in pairs}
+    if not totals:
+        return {'days': 0, 'created': 0, 'updated': 0}
+
+    # The days already stored and the goals carried over are read from
+    # default within the transaction writing them: on the lagging
+    # analytics copy, days stored by the previous batch or run would be
+    # missing and created twice
+    with transaction.atomic():
+        return _store_totals(user_ids, totals)
+
+
+def _store_totals(user_ids: List[int], totals: dict) -> Dict[str, int]:
+    existing = {}
+    for history in NutritionHistory.objects.filter(
+        user_id__in=user_ids,
+        date__date__in={day for _, day in totals},
+    ).order_by('date', 'id'):
+        # The latest row of a day wins if several were stored
+        day = timezone.localtime(history.date).date()
+        existing[(history.user_id, day)] = history
+
+    goals = latest_goals(
+        [user_id for user_id, day in totals if (user_id, day) not in existing]
+    )
+    created, updated = [], []
+    for (user_id, day), values in totals.items():
+        history = existing.get((user_id, day))
+        if history is None:
+            history = NutritionHistory(
+                user_id=user_id,
+                date=timezone.make_aware(datetime.combine(day, time.min)),
+            )
+            previous = goals.get(user_id)
+            for macro in MACROS:
+                goal = getattr(previous, f'{macro}_goal', Decimal(0))
+                setattr(history, f'{macro}_goal', goal)
+            created.append(history)
+        else:
+            updated.append(history)
+        for macro, value in values.items():
+            setattr(history, f'{macro}_real', value)
+        history.adherence = adherence(history)
+
+    NutritionHistory.objects.bulk_create(created)
+    NutritionHistory.objects.bulk_update(
+        updated, [f'{macro}_real' for macro in MACROS] + ['adherence']
+    )
+    return {
+        'days': len(totals), 'created': len(created), 'updated': len(updated),
+    }
+
+
+def _batches(items: List, size: int) -> Iterator[List]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def aggregate_all(batch_size: int = DEFAULT_BATCH_SIZE) -> Dict[str, int]:
+    """Recompute every day of every user that logged an ingestion."""
+    upper = FoodIngestion.objects.aggregate(Max('id'))['id__max'] or 0
+    user_ids = list(
+        FoodIngestion.objects
+        .values_list('ingestion_id__user_id', flat=True)
+        .distinct().order_by('ingestion_id__user_id')
+    )
+    stats = {'users': len(user_ids), 'days': 0, 'created': 0, 'updated': 0}
+    for batch in _batches(user_ids, batch_size):
+        for name, value in aggregate_users(batch).items():
+            stats[name] += value
+    JobWatermark.objects.update_or_create(
+        name=WATERMARK_NAME, defaults={'last_id': upper}
+    )
+    return stats
+
+
+def aggregate_incremental(
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> Dict[str, int]:
+    """
+    Recompute only the (user, day) pairs that received FoodIngestion rows
+    since the previous run, tracked by a FoodIngestion id watermark. The
+    last WATERMARK_LAG ids below the watermark are scanned again, so rows
+    committed late are picked up by the next run.
+    """
+    watermark, _ = JobWatermark.objects.get_or_create(name=WATERMARK_NAME)
+    upper = FoodIngestion.objects.aggregate(Max('id'))['id__max'] or 0
+    dirty = defaultdict(set)
+    rows = (
+        FoodIngestion.objects
+        .filter(id__gt=max(0, watermark.last_id - WATERMARK_LAG),
+                id__lte=upper)
+        .annotate(day=TruncDate('ingestion_id__date'))
+        .values_list('ingestion_id__user_id', 'day')
+        .distinct()
+    )
+    for user_id, day in rows:
+        dirty[user_id].add((user_id, day))
+
+    user_ids = sorted(dirty)
+    stats = {'users': len(user_ids), 'days': 0, 'created': 0, 'updated': 0}
+    for batch in _batches(user_ids, batch_size):
+        pairs = set().union(*(dirty[user_id] for user_id in batch))
+        for name, value in aggregate_users(batch, pairs).items():
+            stats[name] += value
+
+    watermark.last_id = upper
+    watermark.save()
+    return stats
+
+
+def aggregated_id() -> int:
+    """
+    FoodIngestion id up to which every row is summed in NutritionHistory,
+    the watermark minus the ids a later run may still pick up.
+    """
+    last_id = (
+        JobWatermark.objects.filter(name=WATERMARK_NAME)
+        .values_list('last_id', flat=True).first()
+    ) or 0
+    return max(0, last_id - WATERMARK_LAG)
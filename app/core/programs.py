@@ -0,0 +1,181 @@
+"""
+Program assignment engine.
+
+Users and ProgramType rows both carry ``sex`` and
+``available_workout_days``. A program fits a user of the same sex when
+every day it trains on is one of the user's available days, and the best
+fit is the program training on the most days (lowest id on ties).
+
+With 7 weekdays there are only 128 sets of available days, so the
+candidates of every (sex, days) pair are precomputed once per catalog
+version and each user is matched with a dict lookup. Assignment jobs
+read users in id order, a batch at a time, and write ProgramTypeUser rows
+with ``bulk_create``, so a run over the whole user base is linear in the
+number of users with a constant number of queries per batch.
+"""
+from collections import defaultdict
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Max
+
+from core.catalog_cache import catalog_cache
+from core.models import JobWatermark, ProgramType, ProgramTypeUser
+
+WEEKDAYS = 7
+FULL_WEEK = (1 << WEEKDAYS) - 1
+
+WATERMARK_NAME = 'programs:users'
+DEFAULT_BATCH_SIZE = 5000
+
+UserRow = Tuple[int, str, str]
+
+
+@lru_cache(maxsize=1024)
+def parse_days(value: str) -> int:
+    """
+    Bitmask (bit 0 is Monday) of an ``available_workout_days`` string,
+    either a 7 character mask such as ``'1010100'`` or day numbers such
+    as ``'1,3,5'`` (1 is Monday). Anything else yields no days.
+    """
+    value = (value or '').strip()
+    if len(value) == WEEKDAYS and set(value) <= {'0', '1'}:
+        return sum(1 << day for day, flag in enumerate(value) if flag == '1')
+    mask = 0
+    for part in value.replace(',', ' ').split():
+        if part.isdigit() and 1 <= int(part) <= WEEKDAYS:
+            mask |= 1 << (int(part) - 1)
+    return mask
+
+
+class ProgramIndex:
+    """Candidate programs of every (sex, available days) pair, best first."""
+
+    def __init__(self, programs: Iterable[ProgramType]):
+        by_sex = defaultdict(list)
+        for program in programs:
+            days = parse_days(program.available_workout_days)
+            if days:
+                by_sex[program.sex].append((program.id, days))
+
+        self._candidates: Dict[Tuple[str, int], Tuple[int, ...]] = {}
+        self._sets: Dict[Tuple[str, int], FrozenSet[int]] = {}
+        for sex, programs in by_sex.items():
+            programs.sort(key=lambda program: (
+                -bin(program[1]).count('1'), program[0]
+            ))
+            for days in range(FULL_WEEK + 1):
+                fitting = tuple(
+                    program_id for program_id, program_days in programs
+                    if program_days & ~days == 0
+                )
+                if fitting:
+                    self._candidates[(sex, days)] = fitting
+                    self._sets[(sex, days)] = frozenset(fitting)
+
+    def candidates(self, sex: str, available_days: str) -> Tuple[int, ...]:
+        return self._candidates.get((sex, parse_days(available_days)), ())
+
+    def candidate_set(self, sex: str, available_days: str) -> FrozenSet[int]:
+        return self._sets.get(
+            (sex, parse_days(available_days)), frozenset()
+        )
+
+    def best(self, sex: str, available_days: str) -> Optional[int]:
+        candidates = self.candidates(sex, available_days)
+        return candidates[0] if candidates else None
+
+
+def program_index() -> ProgramIndex:
+    """Index of the current catalog, rebuilt when ProgramType changes."""
+    return catalog_cache.get_or_load(
+        ProgramType, 'program_index',
+        lambda: ProgramIndex(catalog_cache.all(ProgramType)),
+    )
+
+
+def assign_users(
+    users: List[UserRow], index: ProgramIndex
+) -> Dict[str, int]:
+    """
+    Give each ``(id, sex, available_workout_days)`` user its best program.
+
+    A user keeping a program that still fits (e.g. picked by hand) is
+    left alone; programs that no longer fit are replaced. Users without
+    any fitting program keep what they have.
+    """
+    current = defaultdict(set)
+    for user_id, program_id in ProgramTypeUser.objects.filter(
+        user_id__in=[user_id for user_id, _, _ in users]
+    ).values_list('user_id', 'program_type_id'):
+        current[user_id].add(program_id)
+
+    created, replaced = [], []
+    unmatched = 0
+    for user_id, sex, available_days in users:
+        fitting = index.candidate_set(sex, available_days)
+        if not fitting:
+            unmatched += 1
+            continue
+        assigned = current.get(user_id)
+        if assigned and not assigned.isdisjoint(fitting):
+            continue
+        if assigned:
+            replaced.append(user_id)
+        created.append(ProgramTypeUser(
+            user_id=user_id,
+            program_type_id=index.best(sex, available_days),
+        ))
+
+    with transaction.atomic():
+        if replaced:
+            ProgramTypeUser.objects.filter(user_id__in=replaced).delete()
+        ProgramTypeUser.objects.bulk_create(created)
+    return {
+        'users': len(users),
+        'assigned': len(created) - len(replaced),
+        'replaced': len(replaced),
+        'unmatched': unmatched,
+    }
+
+
+def _user_batches(
+    after: int, upper: int, batch_size: int
+) -> Iterable[List[UserRow]]:
+    """Users with ``after < id <= upper`` in id order, a batch at a time."""
+    users = get_user_model().objects.order_by('id')
+    while True:
+        batch = list(
+            users.filter(id__gt=after, id__lte=upper)
+            .values_list('id', 'sex', 'available_workout_days')[:batch_size]
+        )
+        if not batch:
+            return
+        yield batch
+        after = batch[-1][0]
+
+
+def _assign_range(after: int, batch_size: int) -> Dict[str, int]:
+    upper = get_user_model().objects.aggregate(Max('id'))['id__max'] or 0
+    index = program_index()
+    stats = {'users': 0, 'assigned': 0, 'replaced': 0, 'unmatched': 0}
+    for batch in _user_batches(after, upper, batch_size):
+        for name, value in assign_users(batch, index).items():
+            stats[name] += value
+    JobWatermark.objects.update_or_create(
+        name=WATERMARK_NAME, defaults={'last_id': upper}
+    )
+    return stats
+
+
+def assign_all(batch_size: int = DEFAULT_BATCH_SIZE) -> Dict[str, int]:
+    """Re-check every user, e.g. after the program catalog changed."""
+    return _assign_range(0, batch_size)
+
+
+def assign_new(batch_size: int = DEFAULT_BATCH_SIZE) -> Dict[str, int]:
+    """Assign programs to the users signed up since the previous run."""
+    watermark = JobWatermark.objects.filter(name=WATERMARK_NAME).first()
+    return _assign_range(watermark.last_id if watermark else 0, batch_size)
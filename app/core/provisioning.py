@@ -0,0 +1,220 @@
+"""
+Bulk user provisioning.
+
+``UserManager.create_user`` hashes a password with the default hasher
+(PBKDF2 with hundreds of thousands of iterations, slow by design) and
+saves one user at a time. ``provision`` onboards a whole file of users
+instead, CSV with a header or JSON lines (``.jsonl``), plain or gzip
+compressed, with an ``email`` and optionally a ``password``, ``name``,
+``sex`` and ``available_workout_days``. The file is read a batch at a
+time and for each batch:
+
+* rows are validated, and emails already stored or seen earlier in the
+  file (case insensitively) are skipped
+* passwords are hashed by a pool of worker processes, the CPU bound part
+  of the work, as ``set_password`` would; users without a password get
+  an unusable one
+* users are inserted with ``bulk_create`` and given their best fitting
+  program (core.programs) in the same transaction
+"""
+import csv
+import gzip
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from itertools import islice
+from typing import (
+    Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple,
+)
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import IntegrityError, transaction
+
+from core.models import SEX_CHOICES
+from core.programs import ProgramIndex, assign_users, program_index
+
+DEFAULT_BATCH_SIZE = 1000
+FIELDS = ('email', 'password', 'name', 'sex', 'available_workout_days')
+SEXES = {value for value, _ in SEX_CHOICES}
+
+
+class Rejected(NamedTuple):
+    # Line of the row in the file, the header being line 1 of a CSV
+    line: int
+    email: str
+    error: str
+
+
+def _open(path: str):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8-sig', newline='')
+    return open(path, encoding='utf-8-sig', newline='')
+
+
+def read_rows(path: str) -> Iterator[Tuple[int, object]]:
+    """(line, row) pairs of a CSV or JSON lines file, rows as read."""
+    with _open(path) as source:
+        if path.removesuffix('.gz').endswith('.jsonl'):
+            for line, text in enumerate(source, 1):
+                if not text.strip():
+                    continue
+                try:
+                    yield line, json.loads(text)
+                except ValueError:
+                    yield line, None
+        else:
+            reader = csv.DictReader(source)
+            for row in reader:
+                yield reader.line_num, row
+
+
+def clean(row) -> dict:
+    """User fields of a row, raises ValidationError for invalid rows."""
+    if not isinstance(row, dict):
+        raise ValidationError('Not a JSON object.')
+    values = {field: str(row.get(field) or '').strip() for field in FIELDS}
+    values['email'] = get_user_model().objects.normalize_email(
+        values['email']
+    )
+    errors = []
+    if not values['email']:
+        errors.append('An email is required.')
+    else:
+        try:
+            validate_email(values['email'])
+        except ValidationError as e:
+            errors.extend(e.messages)
+    if len(values['name']) > 255:
+        errors.append('Names have at most 255 characters.')
+    if values['sex'] and values['sex'] not in SEXES:
+        errors.append(f'Sex must be one of {sorted(SEXES)}.')
+    if len(values['available_workout_days']) > 10:
+        errors.append('Available workout days have at most 10 characters.')
+    if errors:
+        raise ValidationError(errors)
+    values['password'] = values['password'] or None
+    return values
+
+
+def hash_passwords(
+    passwords: List[Optional[str]],
+    pool: Optional[ProcessPoolExecutor] = None,
+    workers: int = 1,
+) -> List[str]:
+    """Hash of each password (None for an unusable one), in ``pool``."""
+    hashes = [make_password(None) if password is None else None
+              for password in passwords]
+    todo = [index for index, password in enumerate(passwords)
+            if password is not None]
+    plain = [passwords[index] for index in todo]
+    if pool is None:
+        hashed = map(make_password, plain)
+    else:
+        hashed = pool.map(make_password, plain,
+                          chunksize=max(1, len(plain) // (workers * 4)))
+    for index, value in zip(todo, hashed):
+        hashes[index] = value
+    return hashes
+
+
+def _existing(emails: List[str]) -> set:
+    return {email.lower() for email in get_user_model().objects.filter(
+        email__in=emails
+    ).values_list('email', flat=True)}
+
+
+def insert_users(users: List[dict], index: ProgramIndex) -> Dict[str, int]:
+    """Insert users whose passwords are hashed and assign their programs."""
+    User = get_user_model()
+    with transaction.atomic():
+        User.objects.bulk_create(
+            [User(**values) for values in users], batch_size=1000
+        )
+        # MySQL doesn't return the ids of rows inserted in bulk
+        rows = User.objects.filter(
+            email__in=[values['email'] for values in users]
+        ).values_list('id', 'sex', 'available_workout_days')
+        assigned = assign_users(list(rows), index)
+    return {'created': len(users), 'assigned': assigned['assigned']}
+
+
+def _store(batch: List[Tuple[int, object]], seen: set, stats: dict,
+           rejects: List[Rejected], pool, workers: int,
+           index: ProgramIndex) -> None:
+    users = []
+    for line, row in batch:
+        try:
+            values = clean(row)
+        except ValidationError as e:
+            email = row.get('email') if isinstance(row, dict) else None
+            rejects.append(Rejected(line, str(email or ''),
+                                    ' '.join(e.messages)))
+            continue
+        key = values['email'].lower()
+        if key in seen:
+            stats['skipped'] += 1
+            continue
+        seen.add(key)
+        users.append(values)
+
+    existing = _existing([values['email'] for values in users])
+    stats['skipped'] += len(existing)
+    users = [values for values in users
+             if values['email'].lower() not in existing]
+    hashes = hash_passwords(
+        [values['password'] for values in users], pool, workers
+    )
+    for values, password in zip(users, hashes):
+        values['password'] = password
+    try:
+        counts = insert_users(users, index)
+    except IntegrityError:
+        # Some of the emails signed up while the passwords were hashed
+        existing = _existing([values['email'] for values in users])
+        stats['skipped'] += len(existing)
+        counts = insert_users([
+            values for values in users
+            if values['email'].lower() not in existing
+        ], index)
+    for name, value in counts.items():
+        stats[name] += value
+
+
+def provision(
+    path: str,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    workers: Optional[int] = None,
+    progress: Optional[Callable[[dict], None]] = None,
+) -> Tuple[Dict[str, int], List[Rejected]]:
+    """
+    Create the users of a file, ``batch_size`` per transaction, hashing
+    passwords with ``workers`` processes (one per CPU by default).
+    Returns the counters and the rejected rows.
+    """
+    workers = max(1, workers or os.cpu_count() or 1)
+    stats = {'rows': 0, 'created': 0, 'skipped': 0, 'rejected': 0,
+             'assigned': 0}
+    rejects: List[Rejected] = []
+    seen = set()
+    index = program_index()
+    # Forked workers only hash, they never use the inherited connections
+    pool = ProcessPoolExecutor(
+        workers, mp_context=multiprocessing.get_context('fork')
+    ) if workers > 1 else None
+    rows = read_rows(path)
+    with pool or nullcontext():
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            stats['rows'] += len(batch)
+            _store(batch, seen, stats, rejects, pool, workers, index)
+            stats['rejected'] = len(rejects)
+            if progress:
+                progress(stats)
+    return stats, rejects
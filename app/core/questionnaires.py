@@ -0,0 +1,270 @@
+"""
+Questionnaire scoring.
+
+Answers are stored one scored row per question: SleepHistory rows for
+the nightly sleep survey (questions are SleepQuestion rows) and
+EvaluationQuestion rows for the post workout evaluation (questions are
+Question rows). A whole questionnaire is submitted at once, its answers
+are written with one ``bulk_create`` and the composite scores of the day
+are computed in the same transaction into QuestionnaireSummary:
+
+* sleep score, the mean of the day's sleep answers
+* recovery score, the mean of the day's evaluation answers
+
+both scaled from SCORE_RANGE to 0-100. Trends read the summaries, one
+row per user and day, instead of re-aggregating raw answers.
+
+Rows written outside ``submit`` are picked up by signals (single saves)
+or by the sync API (bulk inserts), and ``rebuild_all`` recomputes every
+summary from the raw answers. Deleting answers doesn't touch the
+summaries, so archived sleep rows keep their day's scores.
+"""
+from datetime import date
+from decimal import Decimal
+from typing import (
+    Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple,
+)
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import Avg, Count, DateField
+from django.db.models.functions import Trunc
+from django.utils import timezone
+
+from core.catalog_cache import catalog_cache
+from core.models import (
+    EvaluationQuestion, Question, QuestionnaireSummary, SleepHistory,
+    SleepQuestion,
+)
+
+# Lowest and highest score of an answer
+SCORE_RANGE = (1, 10)
+MAX_ANSWERS = 100
+PERIODS = ('day', 'week', 'month')
+DEFAULT_BATCH_SIZE = 500
+
+TENTHS = Decimal('0.1')
+
+DayKey = Tuple[int, date]
+Answers = List[Tuple[int, int]]
+
+
+class Kind(NamedTuple):
+    """Where the answers of one questionnaire are stored."""
+    # Prefix of the QuestionnaireSummary columns holding its score
+    summary: str
+    model: type
+    question_model: type
+    # FK of ``model`` pointing to ``question_model``
+    question_field: str
+
+
+SLEEP = Kind('sleep', SleepHistory, SleepQuestion, 'sleep_question_id')
+RECOVERY = Kind('recovery', EvaluationQuestion, Question, 'question_id')
+KINDS = {'sleep': SLEEP, 'evaluation': RECOVERY}
+
+
+def composite(average) -> Optional[Decimal]:
+    """A mean answer scaled from SCORE_RANGE to 0-100."""
+    if average is None:
+        return None
+    low, high = SCORE_RANGE
+    scaled = (Decimal(average) - low) / (high - low) * 100
+    return scaled.quantize(TENTHS)
+
+
+def day_scores(
+    user_ids: Iterable[int], pairs: Optional[Set[DayKey]] = None
+) -> Dict[DayKey, dict]:
+    """
+    Summary values of every (user, day) with answers, or only of
+    ``pairs``, from one grouped query per kind. Kinds without answers
+    that day are left out.
+    """
+    user_ids = list(user_ids)
+    scores = {}
+    for kind in KINDS.values():
+        queryset = kind.model.objects.filter(
+            user_id__in=user_ids, score__isnull=False
+        )
+        if pairs is not None:
+            queryset = queryset.filter(date__in={day for _, day in pairs})
+        rows = (
+            queryset.values('user_id', 'date')
+            .annotate(average=Avg('score'), answers=Count('id'))
+            .order_by()
+        )
+        for row in rows:
+            key = (row['user_id'], row['date'])
+            if pairs is not None and key not in pairs:
+                continue
+            values = scores.setdefault(key, {})
+            values[f'{kind.summary}_score'] = composite(row['average'])
+            values[f'{kind.summary}_answers'] = row['answers']
+    return scores
+
+
+def _store(scores: Dict[DayKey, dict]) -> int:
+    """
+    Insert or update the summaries of ``scores``. Kinds missing from a
+    day's values keep their stored scores, e.g. once the day's sleep
+    answers were archived.
+    """
+    if not scores:
+        return 0
+    existing = {
+        (summary.user_id, summary.date): summary
+        for summary in QuestionnaireSummary.objects.filter(
+            user_id__in={user_id for user_id, _ in scores},
+            date__in={day for _, day in scores},
+        )
+    }
+    created, updated = [], []
+    for (user_id, day), values in scores.items():
+        summary = existing.get((user_id, day))
+        if summary is None:
+            created.append(QuestionnaireSummary(
+                user_id=user_id, date=day, **values
+            ))
+            continue
+        for name, value in values.items():
+            setattr(summary, name, value)
+        updated.append(summary)
+    QuestionnaireSummary.objects.bulk_create(created)
+    QuestionnaireSummary.objects.bulk_update(
+        updated, [f'{kind.summary}_{suffix}' for kind in KINDS.values()
+                  for suffix in ('score', 'answers')]
+    )
+    return len(created) + len(updated)
+
+
+def summarize_pairs(pairs: Iterable[DayKey]) -> int:
+    """Recompute the summaries of the given (user, day) pairs."""
+    pairs = {(user_id, day) for user_id, day in pairs if user_id}
+    if not pairs:
+        return 0
+    # Aggregated before the transaction, whose reads all go to default
+    scores = day_scores({user_id for user_id, _ in pairs}, pairs)
+    with transaction.atomic():
+        return _store(scores)
+
+
+def _validate(kind: Kind, answers: Answers) -> None:
+    errors = []
+    if not answers:
+        errors.append('At least one answer is required.')
+    if len(answers) > MAX_ANSWERS:
+        errors.append(f'At most {MAX_ANSWERS} answers per questionnaire.')
+    questions = [question for question, _ in answers]
+    if len(set(questions)) != len(questions):
+        errors.append('Each question can be answered once.')
+    known = {question.id for question in catalog_cache.all(
+        kind.question_model
+    )}
+    missing = sorted(set(questions) - known)
+    if missing:
+        errors.append(f'Unknown questions: {missing}')
+    low, high = SCORE_RANGE
+    if any(not low <= score <= high for _, score in answers):
+        errors.append(f'Scores must be between {low} and {high}.')
+    if errors:
+        raise ValidationError({'answers': errors})
+
+
+def submit(questionnaire: str, user_id: int, answers: Answers,
+           day=None) -> QuestionnaireSummary:
+    """
+    Store the ``(question id, score)`` answers of a ``questionnaire``
+    (a KINDS key) of ``user_id`` for ``day`` (today by default) and
+    return the day's updated summary. Answering a question again the
+    same day replaces the previous answer.
+    """
+    kind = KINDS[questionnaire]
+    _validate(kind, answers)
+    day = day or timezone.localdate()
+    try:
+        return _submit(kind, user_id, answers, day)
+    except IntegrityError:
+        # A concurrent submission created the day's summary first
+        return _submit(kind, user_id, answers, day)
+
+
+def _submit(kind, user_id, answers, day) -> QuestionnaireSummary:
+    question_column = f'{kind.question_field}_id'
+    with transaction.atomic():
+        kind.model.objects.filter(**{
+            'user_id': user_id, 'date': day,
+            f'{question_column}__in': [question for question, _ in answers],
+        }).delete()
+        kind.model.objects.bulk_create([
+            kind.model(user_id=user_id, date=day, score=score,
+                       **{question_column: question})
+            for question, score in answers
+        ])
+        _store(day_scores([user_id], {(user_id, day)}))
+    return QuestionnaireSummary.objects.get(user_id=user_id, date=day)
+
+
+def trend(
+    user_id: int, start, end=None, period: str = 'day'
+) -> List[dict]:
+    """
+    Sleep and recovery scores of a user from ``start`` to ``end``
+    (today by default), per day or averaged per week or month.
+    """
+    end = end or timezone.localdate()
+    summaries = QuestionnaireSummary.objects.filter(
+        user_id=user_id, date__gte=start, date__lte=end
+    )
+    if period == 'day':
+        return list(
+            summaries.order_by('date').values(
+                'date', 'sleep_score', 'recovery_score',
+                'sleep_answers', 'recovery_answers',
+            )
+        )
+    rows = (
+        summaries
+        .annotate(period_start=Trunc('date', period,
+                                     output_field=DateField()))
+        .values('period_start')
+        .annotate(
+            sleep_score=Avg('sleep_score'),
+            recovery_score=Avg('recovery_score'),
+            days=Count('id'),
+        )
+        .order_by('period_start')
+    )
+    return [
+        {**row,
+         'sleep_score': _tenths(row['sleep_score']),
+         'recovery_score': _tenths(row['recovery_score'])}
+        for row in rows
+    ]
+
+
+def _tenths(value) -> Optional[Decimal]:
+    return None if value is None else Decimal(value).quantize(TENTHS)
+
+
+def _batches(items: List, size: int) -> Iterator[List]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def rebuild_all(batch_size: int = DEFAULT_BATCH_SIZE) -> Dict[str, int]:
+    """Recompute the summary of every day with answers, by user batch."""
+    user_ids = sorted(
+        set(SleepHistory.objects.values_list('user_id', flat=True)
+            .distinct().order_by())
+        | set(
+            EvaluationQuestion.objects.filter(user__isnull=False)
+            .values_list('user_id', flat=True).distinct().order_by()
+        )
+    )
+    stats = {'users': len(user_ids), 'days': 0}
+    for batch in _batches(user_ids, batch_size):
+        scores = day_scores(batch)
+        with transaction.atomic():
+            stats['days'] += _store(scores)
+    return stats
@@ -0,0 +1,240 @@
+"""
+Chunked deletion of accounts and of expired history.
+
+``User.delete()`` runs Django's deletion collector: every related row of
+the user (ingestions, histories, rollups...) is loaded into memory, a
+``post_delete`` signal is sent for each of them and the whole cascade
+runs in one transaction, locking the history tables for as long as it
+takes. Here rows are deleted by id, in chunks that each run in a short
+transaction, children before parents, following the foreign keys
+declared on the models:
+
+* ``purge_user`` empties, table by table, every table pointing to a
+  user, then deletes the user. The user is deactivated first and a
+  marker is left in JobWatermark until the purge completes, so an
+  interrupted purge is found and resumed by ``pending_purges``.
+* ``expire`` deletes the rows of a retention policy dated before a day.
+  Raw meals are only dropped once the nutrition job has aggregated them
+  into NutritionHistory.
+
+Deletes are raw ``DELETE`` queries: no model signal is sent, so daily
+totals and training rollups of the deleted rows are left untouched.
+ExerciseHistory and WorkoutHistory have no policy: ``refresh_rollups
+--full`` rebuilds the rollups from them and drops the buckets left
+without rows.
+"""
+import time
+from collections import Counter
+from datetime import date, datetime
+from functools import lru_cache
+from typing import (
+    Callable, Iterator, List, NamedTuple, Optional, Tuple, Union,
+)
+
+from django.contrib.auth import get_user_model
+from django.db import models, transaction
+from django.utils import timezone
+
+from core import nutrition
+from core.anthropometrics import invalidate_user
+from core.auth import forget_users
+from core.models import (
+    Ingestion, IngestionArchive, JobWatermark, SleepHistory,
+    SleepHistoryArchive,
+)
+
+DEFAULT_CHUNK_SIZE = 5000
+PURGE_PREFIX = 'purge:user:'
+
+
+class Relation(NamedTuple):
+    """A foreign key pointing to a model, from the ``model`` table."""
+    model: type
+    field: str
+    set_null: bool = False
+
+
+@lru_cache(maxsize=None)
+def relations(model) -> Tuple[Relation, ...]:
+    """
+    Foreign keys pointing to ``model`` whose rows must go (CASCADE) or be
+    detached (SET_NULL) when a row of ``model`` is deleted, m2m through
+    tables included.
+    """
+    found = []
+    for field in model._meta.get_fields(include_hidden=True):
+        if not (field.auto_created and not field.concrete
+                and (field.one_to_many or field.one_to_one)):
+            continue
+        on_delete = field.on_delete
+        if on_delete is models.DO_NOTHING:
+            continue
+        if on_delete not in (models.CASCADE, models.SET_NULL):
+            raise ValueError(
+                f'{field.related_model._meta.label}.{field.field.name} '
+                f'is {on_delete.__name__}, rows of {model._meta.label} '
+                f'cannot be deleted in chunks'
+            )
+        found.append(Relation(
+            field.related_model, field.field.attname,
+            set_null=on_delete is models.SET_NULL,
+        ))
+    return tuple(found)
+
+
+def _raw_delete(queryset) -> int:
+    # No collector and no signals: the caller already removed the rows
+    # pointing to these ones
+    return queryset._raw_delete(queryset.db)
+
+
+def delete_rows(model, ids: List[int]) -> Counter:
+    """
+    Delete the rows ``ids`` of ``model`` and, first, the rows pointing to
+    them. Returns the rows deleted per model label. Run it inside a
+    transaction: the children are looked up before they are deleted.
+    """
+    deleted = Counter()
+    if not ids:
+        return deleted
+    for relation in relations(model):
+        children = relation.model._base_manager.filter(
+            **{f'{relation.field}__in': ids}
+        )
+        if relation.set_null:
+            children.update(**{relation.field: None})
+        elif relations(relation.model):
+            deleted += delete_rows(
+                relation.model, list(children.values_list('pk', flat=True))
+            )
+        else:
+            deleted[relation.model._meta.label] += _raw_delete(children)
+    deleted[model._meta.label] += _raw_delete(
+        model._base_manager.filter(pk__in=ids)
+    )
+    return deleted
+
+
+def _chunks(relation: Relation, value: int, chunk_size: int,
+            pause: float) -> Iterator[Counter]:
+    """Empty the rows of ``relation`` pointing to ``value``, by chunks."""
+    rows = relation.model._base_manager.filter(**{relation.field: value})
+    while True:
+        with transaction.atomic():
+            ids = list(rows.values_list('pk', flat=True)[:chunk_size])
+            if not ids:
+                return
+            if relation.set_null:
+                relation.model._base_manager.filter(pk__in=ids).update(
+                    **{relation.field: None}
+                )
+                deleted = Counter()
+            else:
+                deleted = delete_rows(relation.model, ids)
+        yield deleted
+        if pause:
+            time.sleep(pause)
+
+
+def purge_user(
+    user_id: int,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    pause: float = 0,
+) -> Iterator[Counter]:
+    """
+    Delete a user and every row pointing to it. Yields the rows deleted
+    per model label by each chunk; ``pause`` seconds are slept between
+    chunks to leave room for the regular traffic.
+    """
+    User = get_user_model()
+    marker = f'{PURGE_PREFIX}{user_id}'
+    with transaction.atomic():
+        if not User.objects.filter(id=user_id).update(is_active=False):
+            JobWatermark.objects.filter(name=marker).delete()
+            return
+        JobWatermark.objects.get_or_create(name=marker)
+    forget_users([user_id])
+    for relation in relations(User):
+        yield from _chunks(relation, user_id, chunk_size, pause)
+    with transaction.atomic():
+        deleted = delete_rows(User, [user_id])
+        JobWatermark.objects.filter(name=marker).delete()
+    invalidate_user(user_id)
+    yield deleted
+
+
+def pending_purges() -> List[int]:
+    """Users whose purge was started and did not complete."""
+    return sorted(
+        int(name[len(PURGE_PREFIX):])
+        for name in JobWatermark.objects
+        .filter(name__startswith=PURGE_PREFIX)
+        .values_list('name', flat=True)
+    )
+
+
+class RetentionPolicy(NamedTuple):
+    """Rows of ``model`` kept ``days`` days after their date."""
+    model: type
+    days: Optional[int] = None
+    # (function returning the id up to which a job processed the rows,
+    # lookup of those ids): only the rows the job processed expire
+    rolled_up: Optional[Tuple[Callable[[], int], str]] = None
+
+
+POLICIES = {
+    # Raw meals are summed into NutritionHistory by aggregate_nutrition
+    'meals': RetentionPolicy(
+        Ingestion,
+        rolled_up=(nutrition.aggregated_id, 'foodingestion__id'),
+    ),
+    'sleep': RetentionPolicy(SleepHistory),
+    # Filled by archive_history
+    'meals_archive': RetentionPolicy(IngestionArchive, days=3 * 365),
+    'sleep_archive': RetentionPolicy(SleepHistoryArchive, days=3 * 365),
+}
+
+
+def _cutoff(model, before: date) -> Union[date, datetime]:
+    if model._meta.get_field('date').get_internal_type() == 'DateField':
+        return before
+    return timezone.make_aware(datetime.combine(before, datetime.min.time()))
+
+
+def expired(policy: RetentionPolicy, before: date):
+    """Queryset of the rows of ``policy`` that may be deleted."""
+    queryset = policy.model._base_manager.filter(
+        date__lt=_cutoff(policy.model, before)
+    )
+    if policy.rolled_up:
+        rolled_up_id, lookup = policy.rolled_up
+        queryset = queryset.exclude(**{f'{lookup}__gt': rolled_up_id()})
+    return queryset
+
+
+def expire(
+    policy: RetentionPolicy,
+    before: date,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    pause: float = 0,
+) -> Iterator[Counter]:
+    """
+    Delete the rows of ``policy`` dated before ``before``, oldest ids
+    first. Yields the rows deleted per model label by each chunk.
+    """
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            ids = list(
+                expired(policy, before)
+                .filter(id__gt=last_id)
+                .order_by('id')
+                .values_list('id', flat=True)[:chunk_size]
+            )
+            if not ids:
+                return
+            deleted = delete_rows(policy.model, ids)
+        yield deleted
+        last_id = ids[-1]
+        if pause:
+            time.sleep(pause)
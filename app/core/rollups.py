@@ -0,0 +1,318 @@
+"""
+Materialized training rollups.
+
+TrainingRollup keeps per-user daily, weekly and monthly totals of
+WorkoutHistory and ExerciseHistory, so progress charts read one row per
+bucket instead of scanning the whole history. A bucket is always
+recomputed from its raw rows, which keeps it exact after updates and
+deletes. Single saves refresh their buckets through signals, and
+``refresh_incremental`` picks up rows written in bulk through id
+watermarks.
+"""
+import calendar
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from django.db import transaction
+from django.db.models import (
+    Avg, Count, DateField, F, Max, Q, QuerySet, Sum,
+)
+from django.db.models.functions import Trunc, TruncDate
+from django.utils import timezone
+
+from core.models import (
+    ExerciseHistory, JobWatermark, ROLLUP_PERIODS, TrainingRollup,
+    WorkoutHistory,
+)
+
+PERIODS = [period for period, _ in ROLLUP_PERIODS]
+
+# Goal and real columns of ExerciseHistory summed in each bucket
+EXERCISE_COLUMNS = [
+    f'{measure}_{kind}'
+    for measure in ('reps', 'weight', 'rest', 'duration')
+    for kind in ('real', 'goal')
+]
+
+ROLLUP_FIELDS = [
+    'workouts', 'workout_adherence', 'exercises', 'exercise_adherence',
+    'volume', *EXERCISE_COLUMNS,
+]
+
+WATERMARKS = {
+    WorkoutHistory: 'rollups:workout_history',
+    ExerciseHistory: 'rollups:exercise_history',
+}
+# Ids below a watermark scanned again by each incremental run, for rows
+# committed after a run read Max(id) with a lower id than that maximum
+WATERMARK_LAG = 10000
+
+# Buckets recomputed per query, bounds the size of the OR'ed filter
+BUCKETS_PER_QUERY = 200
+DEFAULT_BATCH_SIZE = 500
+
+TENTHS = Decimal('0.1')
+
+DayKey = Tuple[int, date]
+Bucket = Tuple[int, date]
+
+
+def bucket_start(day: date, period: str) -> date:
+    """First day of the bucket containing ``day`` (weeks start Monday)."""
+    if period == 'week':
+        return day - timedelta(days=day.weekday())
+    if period == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def bucket_end(start: date, period: str) -> date:
+    """First day after the bucket starting at ``start``."""
+    if period == 'week':
+        return start + timedelta(days=7)
+    if period == 'month':
+        days = calendar.monthrange(start.year, start.month)[1]
+        return start + timedelta(days=days)
+    return start + timedelta(days=1)
+
+
+def local_day(moment) -> date:
+    return timezone.localtime(moment).date()
+
+
+def _chunks(items: List, size: int) -> Iterator[List]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _bucket_filter(buckets: Iterable[Bucket], period: str) -> Q:
+    """Match the raw rows falling in any of ``buckets``."""
+    return reduce(or_, (
+        Q(user_id=user_id,
+          date__gte=_aware(start),
+          date__lt=_aware(bucket_end(start, period)))
+        for user_id, start in buckets
+    ))
+
+
+def _aware(day: date):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _grouped(queryset: QuerySet, period: str, **aggregates) -> dict:
+    """Aggregate ``queryset`` per (user, bucket) in one GROUP BY query."""
+    rows = (
+        queryset
+        .annotate(bucket=Trunc('date', period, output_field=DateField()))
+        .values('user_id', 'bucket')
+        .annotate(**aggregates)
+        .order_by()
+    )
+    return {(row['user_id'], row['bucket']): row for row in rows}
+
+
+def _compute(period: str, workouts: QuerySet, exercises: QuerySet) -> dict:
+    """Return ``{(user_id, bucket_start): {field: value}}``."""
+    workout_rows = _grouped(
+        workouts, period,
+        workouts=Count('id'),
+        workout_adherence=Avg('adherence'),
+    )
+    exercise_rows = _grouped(
+        exercises, period,
+        exercises=Count('id'),
+        exercise_adherence=Avg('adherence'),
+        volume=Sum(F('reps_real') * F('weight_real')),
+        **{column: Sum(column) for column in EXERCISE_COLUMNS},
+    )
+    values = {}
+    for bucket in workout_rows.keys() | exercise_rows.keys():
+        row = {**workout_rows.get(bucket, {}),
+               **exercise_rows.get(bucket, {})}
+        values[bucket] = {
+            field: _clean(field, row.get(field)) for field in ROLLUP_FIELDS
+        }
+    return values
+
+
+def _clean(field: str, value):
+    if field.endswith('adherence'):
+        return Decimal(value or 0).quantize(TENTHS)
+    return int(value or 0)
+
+
+def _store(period: str, values: dict, stale: Iterable[TrainingRollup]) -> int:
+    """
+    Write the recomputed ``values`` over the ``stale`` rollups of the same
+    buckets. Buckets left without raw rows are deleted.
+    """
+    stale = {(rollup.user_id, rollup.period_start): rollup
+             for rollup in stale}
+    created, updated = [], []
+    for (user_id, start), fields in values.items():
+        rollup = stale.pop((user_id, start), None)
+        if rollup is None:
+            rollup = TrainingRollup(
+                user_id=user_id, period=period, period_start=start
+            )
+            created.append(rollup)
+        else:
+            updated.append(rollup)
+        for field, value in fields.items():
+            setattr(rollup, field, value)
+    TrainingRollup.objects.bulk_create(created)
+    TrainingRollup.objects.bulk_update(updated, ROLLUP_FIELDS)
+    if stale:
+        TrainingRollup.objects.filter(
+            id__in=[rollup.id for rollup in stale.values()]
+        ).delete()
+    return len(created) + len(updated)
+
+
+def refresh_buckets(pairs: Iterable[DayKey]) -> int:
+    """
+    Recompute every rollup (day, week and month) touching the given
+    ``(user_id, day)`` pairs. Returns the number of rollups written.
+    """
+    pairs = set(pairs)
+    # Aggregated before the transaction, whose reads all go to default
+    computed = []
+    for period in PERIODS:
+        buckets = sorted({
+            (user_id, bucket_start(day, period)) for user_id, day in pairs
+        })
+        for chunk in _chunks(buckets, BUCKETS_PER_QUERY):
+            raw_filter = _bucket_filter(chunk, period)
+            computed.append((period, chunk, _compute(
+                period,
+                WorkoutHistory.objects.filter(raw_filter),
+                ExerciseHistory.objects.filter(raw_filter),
+            )))
+    written = 0
+    with transaction.atomic():
+        for period, chunk, values in computed:
+            stale = TrainingRollup.objects.filter(
+                period=period,
+                user_id__in={user_id for user_id, _ in chunk},
+                period_start__in={start for _, start in chunk},
+            )
+            chunk_set = set(chunk)
+            written += _store(period, values, [
+                rollup for rollup in stale
+                if (rollup.user_id, rollup.period_start) in chunk_set
+            ])
+    return written
+
+
+def refresh_users(user_ids: List[int]) -> int:
+    """Rebuild every rollup of a batch of users from their history."""
+    computed = {
+        period: _compute(
+            period,
+            WorkoutHistory.objects.filter(user_id__in=user_ids),
+            ExerciseHistory.objects.filter(user_id__in=user_ids),
+        )
+        for period in PERIODS
+    }
+    written = 0
+    with transaction.atomic():
+        for period, values in computed.items():
+            stale = TrainingRollup.objects.filter(
+                period=period, user_id__in=user_ids
+            )
+            written += _store(period, values, stale)
+    return written
+
+
+def refresh_all(batch_size: int = DEFAULT_BATCH_SIZE) -> Dict[str, int]:
+    """Rebuild the rollups of every user with training history."""
+    uppers = _upper_ids()
+    user_ids = sorted(
+        set(WorkoutHistory.objects.values_list('user_id', flat=True))
+        | set(ExerciseHistory.objects.values_list('user_id', flat=True))
+        | set(TrainingRollup.objects.values_list('user_id', flat=True))
+    )
+    written = sum(
+        refresh_users(batch) for batch in _chunks(user_ids, batch_size)
+    )
+    _save_watermarks(uppers)
+    return {'users': len(user_ids), 'rollups': written}
+
+
+def refresh_incremental(
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> Dict[str, int]:
+    """
+    Recompute only the buckets of history rows created since the previous
+    run, e.g. rows written with ``bulk_create`` which send no signals.
+    """
+    uppers = _upper_ids()
+    watermarks = _watermarks()
+    dirty = defaultdict(set)
+    for model, upper in uppers.items():
+        rows = (
+            model.objects
+            .filter(id__gt=max(0, watermarks[model] - WATERMARK_LAG),
+                    id__lte=upper)
+            .annotate(day=TruncDate('date'))
+            .values_list('user_id', 'day')
+            .distinct()
+        )
+        for user_id, day in rows:
+            dirty[user_id].add((user_id, day))
+
+    user_ids = sorted(dirty)
+    written = 0
+    for batch in _chunks(user_ids, batch_size):
+        written += refresh_buckets(
+            set().union(*(dirty[user_id] for user_id in batch))
+        )
+    _save_watermarks(uppers)
+    return {'users': len(user_ids), 'rollups': written}
+
+
+def _upper_ids() -> dict:
+    return {
+        model: model.objects.aggregate(Max('id'))['id__max'] or 0
+        for model in WATERMARKS
+    }
+
+
+def _watermarks() -> dict:
+    stored = dict(
+        JobWatermark.objects
+        .filter(name__in=WATERMARKS.values())
+        .values_list('name', 'last_id')
+    )
+    return {model: stored.get(name, 0) for model, name in WATERMARKS.items()}
+
+
+def _save_watermarks(uppers: dict) -> None:
+    for model, upper in uppers.items():
+        JobWatermark.objects.update_or_create(
+            name=WATERMARKS[model], defaults={'last_id': upper}
+        )
+
+
+def progress(
+    user_id: int,
+    period: str = 'week',
+    since: Optional[date] = None,
+) -> QuerySet:
+    """Rollups of a user for a chart, oldest bucket first."""
+    rollups = TrainingRollup.objects.filter(user_id=user_id, period=period)
+    if since is not None:
+        rollups = rollups.filter(
+            period_start__gte=bucket_start(since, period)
+        )
+    return rollups.order_by('period_start')
+
+
+def pairs_of(instances: Iterable) -> Set[DayKey]:
+    """``(user_id, day)`` pairs of history rows, e.g. after a bulk write."""
+    return {(instance.user_id, local_day(instance.date))
+            for instance in instances}
@@ -0,0 +1,210 @@
+"""
+Database routing to read replicas and to an analytics database.
+
+Settings add a ``replica_<n>`` alias per DB_REPLICAS entry and an
+``analytics`` alias for DB_ANALYTICS, copies of the default database kept
+up to date by replication (or SQLite files standing in for them in local
+tests). ReplicaRouter sends:
+
+* every write, and every query within a transaction, to default
+* reads of the catalogs and histories (ROUTED_MODELS) to a replica,
+  picked once per request
+* those reads within ``analytics()`` blocks (batch jobs, exports) to
+  the analytics database, or to a replica when there is none
+* reads of the other models (users, sessions, plans, job watermarks...)
+  and every read within ``primary()`` blocks to default
+
+Replicas lag behind default. Once a request or a job wrote, its routed
+reads go to default too so it reads its own writes, and
+replica_pinning_middleware sets a cookie keeping the client's next
+requests on default for DB_ROUTING['STICKY_SECONDS'] while the replicas
+catch up. Analytics reads aren't pinned: batch jobs aggregate what was
+replicated and write their results to default. The analytics database
+may not hold a job's own writes yet, so jobs read the rows they update
+or insert (existing totals, rollups, summaries) within the transaction
+writing them, which reads from default.
+"""
+import asyncio
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.decorators import sync_and_async_middleware
+
+ANALYTICS = 'analytics'
+PRIMARY = 'primary'
+REPLICA_PREFIX = 'replica_'
+PIN_COOKIE = 'db_pin'
+
+DEFAULTS = {
+    'STICKY_SECONDS': 5,
+}
+
+ROUTED_MODELS = frozenset({
+    # Catalogs
+    'core.Excercises', 'core.ExerciseMuscle', 'core.Food', 'core.Muscle',
+    'core.ProgramType', 'core.Question', 'core.SleepQuestion',
+    'core.Workouts',
+    # Histories, their rollups and archives
+    'core.AntrhopometricHistory', 'core.EvaluationQuestion',
+    'core.ExerciseHistory', 'core.ExerciseWorkoutHistory',
+    'core.FoodIngestion', 'core.FoodIngestionArchive', 'core.Ingestion',
+    'core.IngestionArchive', 'core.NutritionHistory',
+    'core.NutritionalHistory', 'core.QuestionnaireSummary',
+    'core.SleepHistory', 'core.SleepHistoryArchive', 'core.TrainingRollup',
+    'core.WorkoutEvalHistory', 'core.WorkoutHistory',
+})
+
+
+def options() -> dict:
+    return {**DEFAULTS, **getattr(settings, 'DB_ROUTING', {})}
+
+
+def replica_aliases() -> List[str]:
+    return [alias for alias in settings.DATABASES
+            if alias.startswith(REPLICA_PREFIX)]
+
+
+class RoutingState:
+    """Routing of the reads of one request, or of a job."""
+
+    __slots__ = ('replica', 'pinned', 'wrote')
+
+    def __init__(self, pinned: bool = False):
+        self.replica: Optional[str] = None
+        # Routed reads go to default
+        self.pinned = pinned
+        self.wrote = False
+
+
+_state: ContextVar[Optional[RoutingState]] = ContextVar(
+    'db_routing', default=None
+)
+# ANALYTICS or PRIMARY within analytics() and primary() blocks
+_reading_from: ContextVar[Optional[str]] = ContextVar(
+    'db_reading_from', default=None
+)
+
+
+@contextmanager
+def _reading(target: str):
+    token = _reading_from.set(target)
+    try:
+        yield
+    finally:
+        _reading_from.reset(token)
+
+
+def analytics():
+    """Block reading the routed models from the analytics database."""
+    return _reading(ANALYTICS)
+
+
+def primary():
+    """Block reading everything from default, e.g. before deleting rows."""
+    return _reading(PRIMARY)
+
+
+class ReplicaRouter:
+    """Database router of DATABASE_ROUTERS, see the module docstring."""
+
+    def __init__(self):
+        self.replicas = replica_aliases()
+        self.analytics = ANALYTICS if ANALYTICS in settings.DATABASES \
+            else None
+        self.aliases = {DEFAULT_DB_ALIAS, *self.replicas}
+        if self.analytics:
+            self.aliases.add(self.analytics)
+
+    def db_for_read(self, model, **hints) -> Optional[str]:
+        if model._meta.label not in ROUTED_MODELS:
+            return None
+        reading_from = _reading_from.get()
+        if reading_from == PRIMARY \
+                or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        if reading_from == ANALYTICS and self.analytics:
+            return self.analytics
+        if not self.replicas:
+            return None
+        state = _state.get()
+        if state is None:
+            return random.choice(self.replicas)
+        if state.pinned and reading_from != ANALYTICS:
+            return DEFAULT_DB_ALIAS
+        if state.replica is None:
+            state.replica = random.choice(self.replicas)
+        return state.replica
+
+    def db_for_write(self, model, **hints) -> str:
+        state = _state.get()
+        if state is None:
+            # A job outside of a request reads its writes from now on
+            state = RoutingState()
+            _state.set(state)
+        state.pinned = state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints) -> Optional[bool]:
+        # Every alias holds the same data
+        if {obj1._state.db, obj2._state.db} <= self.aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints) -> Optional[bool]:
+        # Replicas get the schema from default through replication
+        if db != DEFAULT_DB_ALIAS and db in self.aliases:
+            return False
+        return None
+
+
+def start_request(pinned: bool = False):
+    """Route the reads of a new request, returns the state for ``finish``."""
+    state = RoutingState(pinned)
+    return state, _state.set(state)
+
+
+def finish_request(started) -> bool:
+    """Stop routing a request's reads, returns whether it wrote."""
+    state, token = started
+    _state.reset(token)
+    return state.wrote
+
+
+def _pin(response, wrote: bool) -> None:
+    if wrote:
+        response.set_cookie(
+            PIN_COOKIE, '1', max_age=options()['STICKY_SECONDS'],
+            httponly=True, samesite='Lax',
+        )
+
+
+@sync_and_async_middleware
+def replica_pinning_middleware(get_response):
+    """Read your writes across requests, see the module docstring."""
+    if not replica_aliases():
+        raise MiddlewareNotUsed
+
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            started = start_request(PIN_COOKIE in request.COOKIES)
+            try:
+                response = await get_response(request)
+            finally:
+                wrote = finish_request(started)
+            _pin(response, wrote)
+            return response
+    else:
+        def middleware(request):
+            started = start_request(PIN_COOKIE in request.COOKIES)
+            try:
+                response = get_response(request)
+            finally:
+                wrote = finish_request(started)
+            _pin(response, wrote)
+            return response
+    return middleware
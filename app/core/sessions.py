@@ -0,0 +1,311 @@
+"""
+Workout session builder.
+
+``Excercises.target_muscle`` holds hyphen joined muscle names, written
+with or without accents ("gluteos-femorales-lumbares"). They are parsed
+once into Muscle and ExerciseMuscle rows by ``sync_muscles``, run when
+exercises are saved or bulk loaded, and an ExerciseIndex built from
+them maps every (workout type, primary muscle) pair to its exercises.
+The index is cached through catalog_cache until exercises change.
+
+A program trains on the days of its ``available_workout_days``, using
+its Workouts in turn (every exercise when it has none). Its muscles are
+split round-robin across its training days, biggest muscle groups first,
+and a session takes up to SESSION_SIZE exercises from the muscles of its
+day, rotating through each muscle's exercises from week to week. A
+session only costs SESSION_SIZE index lookups, and sessions depend on
+the program and the week only, so ``plan_week`` builds them once per
+program and writes them for every user of the program.
+"""
+import unicodedata
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import (
+    Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple,
+)
+
+from django.db import transaction
+from django.utils import timezone
+
+from core.catalog_cache import catalog_cache
+from core.models import (
+    ExerciseMuscle, Excercises, Muscle, ProgramType, ProgramTypeUser,
+    WorkoutPlanItem, Workouts,
+)
+from core.programs import WEEKDAYS, parse_days
+
+SESSION_SIZE = 6
+DEFAULT_BATCH_SIZE = 1000
+
+
+def normalize(name: str) -> str:
+    """Lowercase name without accents or extra spaces."""
+    decomposed = unicodedata.normalize('NFKD', name)
+    stripped = ''.join(char for char in decomposed
+                       if not unicodedata.combining(char))
+    return ' '.join(stripped.lower().split())
+
+
+def parse_muscles(target_muscle: str) -> Tuple[str, ...]:
+    """Normalized muscles of a ``target_muscle`` value, primary first."""
+    muscles = []
+    for part in (target_muscle or '').split('-'):
+        name = normalize(part)
+        if name and name not in muscles:
+            muscles.append(name)
+    return tuple(muscles)
+
+
+def sync_muscles(exercise_ids: Optional[Iterable[int]] = None) -> int:
+    """
+    Store the parsed muscles of every exercise, or of ``exercise_ids``,
+    and return the number of exercises whose muscles changed.
+    """
+    exercises = Excercises.objects.all()
+    if exercise_ids is not None:
+        exercises = exercises.filter(id__in=list(exercise_ids))
+    parsed = {
+        exercise_id: parse_muscles(target_muscle)
+        for exercise_id, target_muscle
+        in exercises.values_list('id', 'target_muscle')
+    }
+    if not parsed:
+        return 0
+    with transaction.atomic():
+        Muscle.objects.bulk_create(
+            [Muscle(name=name) for name in sorted({
+                name for names in parsed.values() for name in names
+            })],
+            ignore_conflicts=True,
+        )
+        muscle_ids = dict(Muscle.objects.values_list('name', 'id'))
+        current = defaultdict(list)
+        for exercise_id, muscle_id in (
+            ExerciseMuscle.objects.filter(exercise_id__in=list(parsed))
+            .order_by('position').values_list('exercise_id', 'muscle_id')
+        ):
+            current[exercise_id].append(muscle_id)
+        changed = [
+            exercise_id for exercise_id, names in parsed.items()
+            if current[exercise_id] != [muscle_ids[name] for name in names]
+        ]
+        ExerciseMuscle.objects.filter(exercise_id__in=changed).delete()
+        ExerciseMuscle.objects.bulk_create([
+            ExerciseMuscle(exercise_id=exercise_id,
+                           muscle_id=muscle_ids[name], position=position)
+            for exercise_id in changed
+            for position, name in enumerate(parsed[exercise_id])
+        ], batch_size=1000)
+    if changed:
+        transaction.on_commit(lambda: catalog_cache.invalidate(Excercises))
+    return len(changed)
+
+
+class ExerciseIndex:
+    """Exercises by workout type and primary muscle, and program splits."""
+
+    def __init__(self, rows: Iterable[Tuple[int, str, int]]):
+        """``rows`` are (exercise id, workout type, primary muscle id)."""
+        by_muscle = defaultdict(list)
+        for exercise_id, workout_type, muscle_id in sorted(rows):
+            for key in (normalize(workout_type), None):
+                by_muscle[(key, muscle_id)].append(exercise_id)
+        self._exercises: Dict[Tuple[Optional[str], int], Tuple[int, ...]] = {
+            key: tuple(ids) for key, ids in by_muscle.items()
+        }
+        muscles = defaultdict(list)
+        for (workout_type, muscle_id), ids in self._exercises.items():
+            muscles[workout_type].append((-len(ids), muscle_id))
+        # Muscles of each type (None for all types), biggest groups first
+        self._muscles: Dict[Optional[str], Tuple[int, ...]] = {
+            workout_type: tuple(muscle_id for _, muscle_id in sorted(pairs))
+            for workout_type, pairs in muscles.items()
+        }
+        self._splits: Dict[Tuple[Optional[str], int], tuple] = {}
+
+    def __len__(self) -> int:
+        return len(self._exercises)
+
+    def workout_type(self, name: Optional[str]) -> Optional[str]:
+        """Indexed key of a workout type, None (every type) if unknown."""
+        key = normalize(name or '')
+        return key if key in self._muscles else None
+
+    def split(self, workout_type: Optional[str], days: int) -> tuple:
+        """Muscles of each of ``days`` training days."""
+        key = (workout_type, days)
+        if key not in self._splits:
+            muscles = self._muscles.get(workout_type, ())
+            if len(muscles) >= days:
+                groups = [muscles[day::days] for day in range(days)]
+            else:
+                groups = [muscles[day % len(muscles):][:1] if muscles
+                          else () for day in range(days)]
+            self._splits[key] = tuple(groups)
+        return self._splits[key]
+
+    def session(
+        self, workout_type: Optional[str], days: int, day: int,
+        rotation: int, size: int = SESSION_SIZE,
+    ) -> Tuple[int, ...]:
+        """
+        Exercises of training day ``day`` of ``days``, the ``rotation``
+        th time it is trained.
+        """
+        group = self.split(workout_type, days)[day % days] if days else ()
+        picked = []
+        for turn in range(size if group else 0):
+            muscle = group[turn % len(group)]
+            options = self._exercises[(workout_type, muscle)]
+            exercise = options[(rotation + turn // len(group)) % len(options)]
+            if exercise not in picked:
+                picked.append(exercise)
+        return tuple(picked)
+
+
+def _load_index() -> ExerciseIndex:
+    return ExerciseIndex(
+        ExerciseMuscle.objects.filter(position=0)
+        .values_list('exercise_id', 'exercise__workout_type', 'muscle_id')
+    )
+
+
+def exercise_index() -> ExerciseIndex:
+    """Index of the current exercises, rebuilt once they change."""
+    return catalog_cache.get_or_load(Excercises, 'sessions:index',
+                                     _load_index)
+
+
+class Session(NamedTuple):
+    day: date
+    workout_id: Optional[int]
+    exercise_ids: Tuple[int, ...]
+
+
+def week_start(day: Optional[date] = None) -> date:
+    """Monday of the week of ``day``, today by default."""
+    day = day or timezone.localdate()
+    return day - timedelta(days=day.weekday())
+
+
+def program_week(
+    program: ProgramType, monday: date,
+    index: Optional[ExerciseIndex] = None,
+) -> List[Session]:
+    """Sessions of a program in the week starting on ``monday``."""
+    index = index or exercise_index()
+    mask = parse_days(program.available_workout_days)
+    training = [day for day in range(WEEKDAYS) if mask >> day & 1]
+    workouts = catalog_cache.filter(Workouts, program_type_id=program.id)
+    rotation = monday.toordinal() // WEEKDAYS
+    sessions = []
+    for number, weekday in enumerate(training):
+        workout = workouts[number % len(workouts)] if workouts else None
+        workout_type = index.workout_type(
+            workout.workout_type if workout else None
+        )
+        exercise_ids = index.session(
+            workout_type, len(training), number, rotation
+        )
+        if exercise_ids:
+            sessions.append(Session(
+                monday + timedelta(days=weekday),
+                workout.id if workout else None, exercise_ids,
+            ))
+    return sessions
+
+
+def _user_batches(batch_size: int) -> Iterator[List[int]]:
+    """Users with a program, in id order, a batch at a time."""
+    after = 0
+    while True:
+        batch = list(
+            ProgramTypeUser.objects.filter(user_id__gt=after)
+            .order_by('user_id').values_list('user_id', flat=True)
+            .distinct()[:batch_size]
+        )
+        if not batch:
+            return
+        yield batch
+        after = batch[-1]
+
+
+def plan_users(
+    user_ids: Sequence[int], monday: date,
+    weeks: Optional[Dict[int, List[Session]]] = None,
+) -> Dict[str, int]:
+    """
+    Store the week starting on ``monday`` of each user's program (their
+    first one if several), replacing what was planned for that week.
+    ``weeks`` caches the sessions of each program across batches.
+    """
+    weeks = {} if weeks is None else weeks
+    index = exercise_index()
+    programs = {program.id: program
+                for program in catalog_cache.all(ProgramType)}
+    user_programs = {}
+    for user_id, program_id in (
+        ProgramTypeUser.objects.filter(user_id__in=list(user_ids))
+        .order_by('-id').values_list('user_id', 'program_type_id')
+    ):
+        user_programs[user_id] = program_id
+    items = []
+    sessions = 0
+    for user_id, program_id in user_programs.items():
+        if program_id not in weeks:
+            weeks[program_id] = program_week(
+                programs[program_id], monday, index
+            ) if program_id in programs else []
+        for session in weeks[program_id]:
+            sessions += 1
+            items.extend(
+                WorkoutPlanItem(
+                    user_id=user_id, date=session.day,
+                    workout_id=session.workout_id, exercise_id=exercise_id,
+                    position=position,
+                )
+                for position, exercise_id in enumerate(session.exercise_ids)
+            )
+    with transaction.atomic():
+        WorkoutPlanItem.objects.filter(
+            user_id__in=list(user_ids), date__gte=monday,
+            date__lt=monday + timedelta(days=WEEKDAYS),
+        ).delete()
+        WorkoutPlanItem.objects.bulk_create(items, batch_size=1000)
+    return {'users': len(user_programs), 'sessions': sessions,
+            'items': len(items)}
+
+
+def plan_week(
+    day: Optional[date] = None, batch_size: int = DEFAULT_BATCH_SIZE,
+) -> Dict[str, int]:
+    """Plan the week of ``day`` for every user with a program."""
+    monday = week_start(day)
+    weeks = {}
+    stats = {'users': 0, 'sessions': 0, 'items': 0}
+    for batch in _user_batches(batch_size):
+        for name, value in plan_users(batch, monday, weeks).items():
+            stats[name] += value
+    stats['programs'] = len(weeks)
+    return stats
+
+
+def user_sessions(
+    user_id: int, day: Optional[date] = None
+) -> List[WorkoutPlanItem]:
+    """
+    A user's planned exercises of ``day`` (today by default), planning
+    the user's week if it wasn't yet.
+    """
+    day = day or timezone.localdate()
+    monday = week_start(day)
+    week = WorkoutPlanItem.objects.filter(
+        user_id=user_id, date__gte=monday,
+        date__lt=monday + timedelta(days=WEEKDAYS),
+    )
+    if not week.exists():
+        plan_users([user_id], monday)
+    return list(
+        week.filter(date=day).select_related('exercise', 'workout')
+        .order_by('position')
+    )
@@ -0,0 +1,104 @@
+"""
+Signal handlers keeping materialized data in sync with the history tables.
+"""
+from django.contrib.auth.signals import user_logged_in
+from django.core.signals import request_started
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from core.anthropometrics import derive, invalidate_user
+from core.auth import forget_users, update_last_login
+from core.catalog_cache import CATALOG_MODELS, catalog_cache
+from core.db import check_persistent_connections
+from core.instrumentation import install_query_recorder
+from core.models import (
+    AntrhopometricHistory, EvaluationQuestion, ExerciseHistory, Excercises,
+    SleepHistory, User, WorkoutHistory,
+)
+from core.questionnaires import summarize_pairs
+from core.rollups import local_day, refresh_buckets
+from core.sessions import sync_muscles
+
+
+@receiver(pre_save, sender=WorkoutHistory)
+@receiver(pre_save, sender=ExerciseHistory)
+def remember_training_day(sender, instance, raw=False, using=None,
+                          **kwargs):
+    # An update moving a row to another user or day also changes the
+    # buckets it leaves
+    instance._previous_rollup_pair = None
+    if raw or instance._state.adding:
+        return
+    previous = (
+        sender._base_manager.using(using)
+        .filter(pk=instance.pk).values_list('user_id', 'date').first()
+    )
+    if previous is not None:
+        instance._previous_rollup_pair = (previous[0],
+                                          local_day(previous[1]))
+
+
+@receiver(post_save, sender=WorkoutHistory)
+@receiver(post_save, sender=ExerciseHistory)
+@receiver(post_delete, sender=WorkoutHistory)
+@receiver(post_delete, sender=ExerciseHistory)
+def refresh_training_rollups(sender, instance, **kwargs):
+    pairs = {(instance.user_id, local_day(instance.date))}
+    previous = getattr(instance, '_previous_rollup_pair', None)
+    if previous is not None:
+        pairs.add(previous)
+    transaction.on_commit(lambda: refresh_buckets(list(pairs)))
+
+
+@receiver(pre_save, sender=AntrhopometricHistory)
+def fill_body_composition(sender, instance, raw=False, **kwargs):
+    if not raw:
+        derive(instance)
+
+
+@receiver(post_save, sender=AntrhopometricHistory)
+@receiver(post_delete, sender=AntrhopometricHistory)
+def invalidate_anthropometrics(sender, instance, **kwargs):
+    user_id = instance.user_id
+    transaction.on_commit(lambda: invalidate_user(user_id))
+
+
+@receiver(post_save, sender=SleepHistory)
+@receiver(post_save, sender=EvaluationQuestion)
+def refresh_questionnaire_summary(sender, instance, raw=False, **kwargs):
+    if raw or not instance.user_id:
+        return
+    pair = (instance.user_id, instance.date)
+    transaction.on_commit(lambda: summarize_pairs([pair]))
+
+
+@receiver(post_save, sender=Excercises)
+def parse_exercise_muscles(sender, instance, raw=False, **kwargs):
+    if not raw:
+        exercise_id = instance.id
+        transaction.on_commit(lambda: sync_muscles([exercise_id]))
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def invalidate_catalog_cache(sender, **kwargs):
+    if sender in CATALOG_MODELS:
+        transaction.on_commit(lambda: catalog_cache.invalidate(sender))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_cached_user(sender, instance, **kwargs):
+    user_id = instance.id
+    transaction.on_commit(lambda: forget_users([user_id]))
+
+
+# Replaces the receiver of django.contrib.auth, which saves the user on
+# every login
+user_logged_in.disconnect(dispatch_uid='update_last_login')
+user_logged_in.connect(update_last_login, dispatch_uid='update_last_login')
+
+request_started.connect(check_persistent_connections)
+connection_created.connect(install_query_recorder)
@@ -0,0 +1,211 @@
+"""
+Static files in production.
+
+``collectstatic`` with CompressedManifestStorage copies the assets to
+STATIC_ROOT under content hashed names (``css/common.5e1c0a3e2d4f.css``)
+and writes a gzip and, when the brotli module is installed, a brotli
+variant next to each compressible file. ``static_files_middleware``
+serves STATIC_ROOT from an index built once per worker: hashed names are
+cached by browsers for a year, and each client gets the smallest variant
+it accepts.
+
+With DEBUG on, runserver serves the source files and neither is used.
+"""
+import asyncio
+import gzip
+import mimetypes
+import os
+from typing import Dict, NamedTuple, Tuple
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import (
+    ManifestStaticFilesStorage, staticfiles_storage,
+)
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.files.base import ContentFile
+from django.http import (
+    FileResponse, HttpResponseNotAllowed, HttpResponseNotFound,
+    HttpResponseNotModified,
+)
+from django.utils.decorators import sync_and_async_middleware
+from django.utils.http import http_date, parse_http_date_safe
+
+COMPRESSIBLE = (
+    '.css', '.js', '.mjs', '.json', '.map', '.svg', '.txt', '.xml',
+    '.html', '.ico',
+)
+# Encodings in order of preference, with the suffix of their files
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+# Variants saving less than this share of the original are not kept
+MIN_SAVING = 0.05
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def compress(content: bytes) -> Dict[str, bytes]:
+    """Compressed variants of ``content`` worth serving, by encoding."""
+    variants = {'gzip': gzip.compress(content, 9, mtime=0)}
+    try:
+        import brotli
+    except ImportError:
+        pass
+    else:
+        variants['br'] = brotli.compress(content)
+    return {
+        encoding: data for encoding, data in variants.items()
+        if len(data) < len(content) * (1 - MIN_SAVING)
+    }
+
+
+class CompressedManifestStorage(ManifestStaticFilesStorage):
+    """Manifest storage also writing compressed variants of the files."""
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        names = set(self.hashed_files) | set(self.hashed_files.values())
+        for name in sorted(names):
+            if not name.endswith(COMPRESSIBLE) or not self.exists(name):
+                continue
+            with self.open(name) as original:
+                variants = compress(original.read())
+            for encoding, suffix in ENCODINGS:
+                if encoding not in variants:
+                    continue
+                if self.exists(name + suffix):
+                    self.delete(name + suffix)
+                self._save(name + suffix, ContentFile(variants[encoding]))
+                yield name, name + suffix, True
+
+
+class Variant(NamedTuple):
+    path: str
+    size: int
+    etag: str
+
+
+class StaticFile(NamedTuple):
+    content_type: str
+    cache_control: str
+    last_modified: float
+    # Identity first, then the compressed variants in ENCODINGS order
+    variants: Tuple[Tuple[str, Variant], ...]
+
+
+def _variant(path: str) -> Variant:
+    stat = os.stat(path)
+    return Variant(
+        path, stat.st_size, f'"{int(stat.st_mtime):x}-{stat.st_size:x}"'
+    )
+
+
+def build_index(root: str) -> Dict[str, StaticFile]:
+    """Files under ``root`` by URL path relative to STATIC_URL."""
+    hashed = set(getattr(staticfiles_storage, 'hashed_files', {}).values())
+    max_age = f"public, max-age={settings.STATIC_MAX_AGE}"
+    index = {}
+    for directory, _, files in os.walk(root):
+        present = set(files)
+        for filename in files:
+            if any(filename.endswith(suffix)
+                   and filename[:-len(suffix)] in present
+                   for _, suffix in ENCODINGS):
+                # A compressed variant, served through its original
+                continue
+            path = os.path.join(directory, filename)
+            name = os.path.relpath(path, root).replace(os.sep, '/')
+            variants = [('identity', _variant(path))]
+            for encoding, suffix in ENCODINGS:
+                if filename + suffix in present:
+                    variants.append((encoding, _variant(path + suffix)))
+            content_type, _ = mimetypes.guess_type(name)
+            index[name] = StaticFile(
+                content_type=content_type or 'application/octet-stream',
+                cache_control=IMMUTABLE if name in hashed else max_age,
+                last_modified=os.path.getmtime(path),
+                variants=tuple(variants),
+            )
+    return index
+
+
+def accepted_encodings(header: str) -> set:
+    """Content codings of an Accept-Encoding header, q=0 ones excluded."""
+    accepted = set()
+    for item in header.split(','):
+        coding, _, params = item.strip().partition(';')
+        params = params.replace(' ', '')
+        if coding and params not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            accepted.add(coding.lower())
+    return accepted
+
+
+def serve(request, index: Dict[str, StaticFile], prefix: str):
+    """Response for a request under STATIC_URL, None for other requests."""
+    if not request.path_info.startswith(prefix):
+        return None
+    static = index.get(request.path_info[len(prefix):])
+    if static is None:
+        return HttpResponseNotFound()
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+    accepted = accepted_encodings(request.headers.get('Accept-Encoding', ''))
+    encoding, variant = static.variants[0]
+    for candidate, compressed in static.variants[1:]:
+        if candidate in accepted or '*' in accepted:
+            encoding, variant = candidate, compressed
+            break
+    headers = {
+        'Cache-Control': static.cache_control,
+        'ETag': variant.etag,
+        'Last-Modified': http_date(static.last_modified),
+    }
+    if len(static.variants) > 1:
+        headers['Vary'] = 'Accept-Encoding'
+    if _not_modified(request, variant, static.last_modified):
+        response = HttpResponseNotModified()
+    else:
+        response = FileResponse(open(variant.path, 'rb'))
+        # FileResponse guesses a type and disposition from the file name
+        response['Content-Type'] = static.content_type
+        del response['Content-Disposition']
+        if encoding != 'identity':
+            response['Content-Encoding'] = encoding
+    for name, value in headers.items():
+        response[name] = value
+    return response
+
+
+def _not_modified(request, variant: Variant, last_modified: float) -> bool:
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        return variant.etag in {tag.strip().removeprefix('W/')
+                                for tag in if_none_match.split(',')}
+    since = parse_http_date_safe(
+        request.headers.get('If-Modified-Since', '')
+    )
+    return since is not None and int(last_modified) <= since
+
+
+@sync_and_async_middleware
+def static_files_middleware(get_response):
+    """Serve STATIC_ROOT when DEBUG is off, see the module docstring."""
+    if settings.DEBUG or not settings.STATIC_ROOT:
+        raise MiddlewareNotUsed
+    root = str(settings.STATIC_ROOT)
+    index = build_index(root) if os.path.isdir(root) else {}
+    prefix = settings.STATIC_URL
+
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            response = serve(request, index, prefix)
+            if response is None:
+                response = await get_response(request)
+            return response
+    else:
+        def middleware(request):
+            response = serve(request, index, prefix)
+            if response is None:
+                response = get_response(request)
+            return response
+    return middleware
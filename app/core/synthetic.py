@@ -0,0 +1,347 @@
+"""
+Synthetic data for scale tests.
+
+``generate`` writes users with up to years of meal, workout, sleep and
+anthropometric history shaped like real usage: 3 to 5 meals a day,
+workouts on the user's available days with progressing loads, a sleep
+score most nights and a weekly body measurement drifting over time.
+
+Every user's history derives from the seed and the user's number only,
+so the same arguments always produce the same rows whatever the batch
+size. Rows are written one transaction per batch of users, with ids
+assigned up front so bridge rows can point to their parents without
+reading them back (MySQL returns no ids from bulk inserts). The large
+history tables skip the ORM: their rows are plain tuples inserted with
+``executemany``, as building a model instance and compiling its values
+costs more than the insert itself. Run it against a scratch database:
+the explicit ids assume nothing else writes to the history tables
+meanwhile.
+
+Synthetic users have emails ending with SYNTHETIC_DOMAIN, ``clear``
+deletes them with all their history.
+"""
+import random
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from core import nutrition, rollups
+from core.anthropometrics import derive
+from core.catalog_cache import catalog_cache
+from core.models import (
+    AntrhopometricHistory, Excercises, ExerciseHistory,
+    ExerciseWorkoutHistory, Food, FoodIngestion, Ingestion,
+    NutritionHistory, Question, SleepHistory, SleepQuestion,
+    TrainingRollup, WorkoutHistory,
+)
+
+SYNTHETIC_DOMAIN = '@synthetic.invalid'
+# Foods created when the catalog is empty
+SYNTHETIC_FOODS = 500
+SYNTHETIC_ENTER_BY = 'synth'
+
+DEFAULT_USERS = 1000
+DEFAULT_DAYS = 365
+DEFAULT_USERS_PER_BATCH = 50
+# Rows per INSERT statement
+DEFAULT_INSERT_SIZE = 5000
+
+WEEKDAYS = 7
+# Columns (attnames) of the tables written as tuples, parents first
+RAW_COLUMNS = {
+    Ingestion: ('id', 'user_id', 'date', 'meal_number', 'value'),
+    FoodIngestion: ('food_id_id', 'ingestion_id_id'),
+    WorkoutHistory: ('id', 'user_id', 'date', 'adherence'),
+    ExerciseHistory: (
+        'id', 'user_id', 'exercise_name', 'date', 'reps_real',
+        'weight_real', 'rest_real', 'reps_goal', 'weight_goal',
+        'rest_goal', 'adherence',
+    ),
+    ExerciseWorkoutHistory: ('exercise_history_id_id',
+                             'workout_history_id_id'),
+    SleepHistory: ('id', 'user_id', 'sleep_question_id_id', 'date', 'score'),
+}
+# Models written per batch
+HISTORY_MODELS = (*RAW_COLUMNS, AntrhopometricHistory, NutritionHistory)
+
+TENTHS = Decimal('0.1')
+# Adherence columns hold 3 digits, one of them a decimal
+MAX_ADHERENCE = Decimal('99.9')
+
+
+class Catalog(NamedTuple):
+    """Catalog rows the synthetic history refers to."""
+    food_ids: List[int]
+    exercise_names: List[str]
+    sleep_question_id: int
+
+
+def synthetic_users():
+    return get_user_model().objects.filter(email__endswith=SYNTHETIC_DOMAIN)
+
+
+def load_catalog(seed: int) -> Catalog:
+    """The current catalog, with synthetic rows where it is empty."""
+    food_ids = list(Food.objects.order_by('id').values_list('id', flat=True))
+    if not food_ids:
+        rng = random.Random(seed)
+        Food.objects.bulk_create([
+            Food(
+                name=f'Synthetic food {number}', enter_by=SYNTHETIC_ENTER_BY,
+                brand='Synthetic', type=rng.choice(['solid', 'liquid']),
+                carbohydrates=_tenths(rng.uniform(0, 80)),
+                proteins=_tenths(rng.uniform(0, 30)),
+                fats=_tenths(rng.uniform(0, 40)),
+                fibers=_tenths(rng.uniform(0, 10)),
+                sodium=_tenths(rng.uniform(0, 500)),
+                calories=_tenths(rng.uniform(20, 900)),
+            )
+            for number in range(SYNTHETIC_FOODS)
+        ])
+        catalog_cache.invalidate(Food)
+        food_ids = list(
+            Food.objects.order_by('id').values_list('id', flat=True)
+        )
+    exercise_names = sorted(set(
+        Excercises.objects.values_list('exercise_name', flat=True)
+    )) or [f'Exercise {number}' for number in range(1, 101)]
+    question = SleepQuestion.objects.order_by('id').first()
+    if question is None:
+        question = SleepQuestion.objects.create(
+            question_id=Question.objects.create(
+                question_name='Sleep quality', question_type='sleep',
+            ),
+        )
+    return Catalog(food_ids, exercise_names, question.id)
+
+
+def _tenths(value: float) -> Decimal:
+    return Decimal(value).quantize(TENTHS)
+
+
+def _at(day: date, hour: int, minute: int = 0) -> datetime:
+    return timezone.make_aware(datetime.combine(day, time(hour, minute)))
+
+
+def _db_at(day: date, hour: int, minute: int = 0):
+    """``_at`` as the database driver takes it in raw inserts."""
+    return connection.ops.adapt_datetimefield_value(_at(day, hour, minute))
+
+
+class _Ids:
+    """Next free primary key of each model written with explicit ids."""
+
+    def __init__(self, models):
+        self._next = {
+            model: (model.objects.aggregate(Max('id'))['id__max'] or 0) + 1
+            for model in models
+        }
+
+    def take(self, model) -> int:
+        value = self._next[model]
+        self._next[model] += 1
+        return value
+
+
+def _meals(rng, user_id, day, catalog, ids, rows) -> None:
+    for meal_number in range(1, rng.randint(3, 5) + 1):
+        if rng.random() < 0.1:
+            continue
+        ingestion_id = ids.take(Ingestion)
+        rows[Ingestion].append((
+            ingestion_id, user_id,
+            _db_at(day, 7 + 3 * meal_number, rng.randrange(60)),
+            meal_number, _tenths(rng.uniform(50, 600)),
+        ))
+        for food_id in rng.sample(catalog.food_ids,
+                                  min(len(catalog.food_ids),
+                                      rng.randint(1, 3))):
+            rows[FoodIngestion].append((food_id, ingestion_id))
+
+
+def _workout(rng, user_id, day, week, plan, ids, rows) -> None:
+    workout_id = ids.take(WorkoutHistory)
+    moment = _db_at(day, rng.choice([7, 12, 18, 19]), rng.randrange(60))
+    adherences = []
+    for name, base_weight in plan:
+        reps_goal = rng.choice([8, 10, 12])
+        weight_goal = int(base_weight * (1 + 0.01 * week))
+        reps_real = max(0, reps_goal + rng.randint(-3, 1))
+        weight_real = max(0, weight_goal + rng.randint(-5, 2))
+        adherence = min(MAX_ADHERENCE, _tenths(
+            100 * (reps_real * weight_real) / (reps_goal * weight_goal)
+        ))
+        adherences.append(adherence)
+        exercise_id = ids.take(ExerciseHistory)
+        rows[ExerciseHistory].append((
+            exercise_id, user_id, name, moment, reps_real, weight_real,
+            rng.randint(45, 120), reps_goal, weight_goal, 90, adherence,
+        ))
+        rows[ExerciseWorkoutHistory].append((exercise_id, workout_id))
+    rows[WorkoutHistory].append((
+        workout_id, user_id, moment,
+        _tenths(sum(adherences) / len(adherences)),
+    ))
+
+
+def _user_history(
+    seed: int, user, start: date, days: int, catalog: Catalog, ids: _Ids,
+    rows: Dict[type, list],
+) -> None:
+    """Append every history row of one user to ``rows``."""
+    rng = random.Random(f'{seed}:{user.email}')
+    male = user.sex == 'M'
+    height = rng.gauss(176 if male else 163, 7)
+    weight = rng.gauss(82 if male else 68, 12)
+    drift = rng.uniform(-0.4, 0.15)
+    workout_days = [index for index, flag in
+                    enumerate(user.available_workout_days) if flag == '1']
+    plan = [(name, rng.randint(10, 80)) for name in
+            rng.sample(catalog.exercise_names,
+                       min(len(catalog.exercise_names), 5))]
+
+    rows[NutritionHistory].append(NutritionHistory(
+        user_id=user.id, date=_at(start, 0),
+        carbohydrates_goal=rng.randint(150, 300),
+        proteins_goal=rng.randint(80, 180), fats_goal=rng.randint(50, 90),
+        fibers_goal=rng.randint(25, 35), sodium_goal=2300,
+        calories_goal=rng.randint(1600, 2800),
+    ))
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        week = offset // WEEKDAYS
+        if rng.random() < 0.95:
+            _meals(rng, user.id, day, catalog, ids, rows)
+        if day.weekday() in workout_days and rng.random() < 0.85:
+            _workout(rng, user.id, day, week, plan, ids, rows)
+        if rng.random() < 0.9:
+            rows[SleepHistory].append((
+                ids.take(SleepHistory), user.id, catalog.sleep_question_id,
+                connection.ops.adapt_datefield_value(day),
+                max(1, min(10, round(rng.gauss(7, 1.5)))),
+            ))
+        if offset % WEEKDAYS == 0 and rng.random() < 0.7:
+            weight += drift + rng.gauss(0, 0.5)
+            waist = weight * (0.95 if male else 1.0) + rng.gauss(5, 3)
+            measurement = AntrhopometricHistory(
+                user=user, date=day, height=round(height, 1),
+                weight=round(weight, 1), neck=round(rng.gauss(
+                    39 if male else 33, 1.5), 1),
+                waist=round(waist, 1),
+                hip=round(waist + rng.gauss(8 if male else 18, 3), 1),
+            )
+            derive(measurement)
+            rows[AntrhopometricHistory].append(measurement)
+
+
+def _batches(items: List, size: int) -> Iterator[List]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _insert(model, rows: List[tuple], size: int) -> None:
+    """Insert tuples holding the RAW_COLUMNS of ``model``."""
+    quote = connection.ops.quote_name
+    columns = {field.attname: field.column
+               for field in model._meta.concrete_fields}
+    names = RAW_COLUMNS[model]
+    sql = (
+        f'INSERT INTO {quote(model._meta.db_table)} '
+        f'({", ".join(quote(columns[name]) for name in names)}) '
+        f'VALUES ({", ".join(["%s"] * len(names))})'
+    )
+    with connection.cursor() as cursor:
+        for batch in _batches(rows, size):
+            cursor.executemany(sql, batch)
+
+
+def generate(
+    users: int = DEFAULT_USERS,
+    days: int = DEFAULT_DAYS,
+    seed: int = 42,
+    end: Optional[date] = None,
+    users_per_batch: int = DEFAULT_USERS_PER_BATCH,
+    insert_size: int = DEFAULT_INSERT_SIZE,
+    progress: Optional[Callable[[Dict[str, int]], None]] = None,
+) -> Dict[str, int]:
+    """
+    Write ``users`` synthetic users with ``days`` days of history ending
+    at ``end`` (today by default), then compute their training rollups
+    and nutrition totals. Returns the number of rows written per table.
+    """
+    end = end or timezone.localdate()
+    start = end - timedelta(days=days - 1)
+    User = get_user_model()
+    first = synthetic_users().count()
+    catalog = load_catalog(seed)
+    ids = _Ids([User, Ingestion, WorkoutHistory, ExerciseHistory,
+                SleepHistory])
+    password = make_password(None)
+    counts = {model._meta.object_name: 0 for model in (User,)
+              + HISTORY_MODELS}
+
+    for numbers in _batches(range(first, first + users), users_per_batch):
+        batch = []
+        for number in numbers:
+            rng = random.Random(f'{seed}:user:{number}')
+            workout_days = rng.sample(range(WEEKDAYS), rng.randint(2, 5))
+            batch.append(User(
+                id=ids.take(User), email=f'user{number}{SYNTHETIC_DOMAIN}',
+                name=f'Synthetic {number}', password=password,
+                sex=rng.choice(['M', 'F']),
+                available_workout_days=''.join(
+                    '1' if day in workout_days else '0'
+                    for day in range(WEEKDAYS)
+                ),
+            ))
+        rows = {model: [] for model in HISTORY_MODELS}
+        for user in batch:
+            _user_history(seed, user, start, days, catalog, ids, rows)
+
+        user_ids = [user.id for user in batch]
+        with transaction.atomic():
+            User.objects.bulk_create(batch, batch_size=insert_size)
+            for model, instances in rows.items():
+                if model in RAW_COLUMNS:
+                    _insert(model, instances, insert_size)
+                else:
+                    model.objects.bulk_create(
+                        instances, batch_size=insert_size
+                    )
+            rollups.refresh_users(user_ids)
+            nutrition.aggregate_users(user_ids)
+        counts[User._meta.object_name] += len(batch)
+        for model, instances in rows.items():
+            counts[model._meta.object_name] += len(instances)
+        if progress:
+            progress(counts)
+    return counts
+
+
+def clear(users_per_batch: int = DEFAULT_USERS_PER_BATCH) -> int:
+    """Delete every synthetic user and its history, a batch at a time."""
+    user_ids = list(synthetic_users().order_by('id')
+                    .values_list('id', flat=True))
+    for batch in _batches(user_ids, users_per_batch):
+        querysets = [
+            FoodIngestion.objects.filter(ingestion_id__user_id__in=batch),
+            ExerciseWorkoutHistory.objects.filter(
+                workout_history_id__user_id__in=batch
+            ),
+            *(model.objects.filter(user_id__in=batch)
+              for model in (*HISTORY_MODELS, TrainingRollup)
+              if model not in (FoodIngestion, ExerciseWorkoutHistory)),
+        ]
+        with transaction.atomic():
+            # Plain DELETE statements: the per row delete signals would
+            # refresh rollups and caches of users that are going away
+            for queryset in querysets:
+                queryset._raw_delete(queryset.db)
+            get_user_model().objects.filter(id__in=batch).delete()
+    return len(user_ids)
@@ -0,0 +1,110 @@
+from datetime import date
+from unittest import mock
+
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from core import synthetic
+from core.catalog_cache import catalog_cache
+from core.models import (
+    Excercises, ProgramType, ProgramTypeUser, Question, SleepQuestion,
+    Workouts,
+)
+
+# Queries of one changelist page, whatever its number of rows
+MAX_QUERIES = 10
+# Rows of each changelist, enough for one query per row to go over budget
+ROWS = 12
+# Rows of a changelist page, ROWS fill more than two
+PER_PAGE = 5
+
+
+class ChangelistQueriesTests(TestCase):
+    """
+    Every changelist registered in the admin stays within MAX_QUERIES,
+    unfiltered, on its second page and searched: a column reading a
+    foreign key without ``list_select_related`` runs one query per row.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        # Users, foods and a sleep question
+        synthetic.generate(users=ROWS, days=7, end=date(2024, 1, 7))
+        cls.superuser = get_user_model().objects.create_superuser(
+            'admin@example.com', 'admin'
+        )
+        # Rows of the other catalogs, each pointing to a different parent
+        programs = ProgramType.objects.bulk_create(
+            ProgramType(program_name=f'Program {number}', sex='M',
+                        available_workout_days='1010100')
+            for number in range(ROWS)
+        )
+        Workouts.objects.bulk_create(
+            Workouts(workout_type=f'Workout {number}', program_type=program)
+            for number, program in enumerate(programs)
+        )
+        ProgramTypeUser.objects.bulk_create(
+            ProgramTypeUser(user=user, program_type=program)
+            for user, program in zip(synthetic.synthetic_users(), programs)
+        )
+        SleepQuestion.objects.bulk_create(
+            SleepQuestion(question_id=Question.objects.create(
+                question_name=f'Question {number}', question_type='sleep',
+            ))
+            for number in range(ROWS)
+        )
+        Group.objects.bulk_create(
+            Group(name=f'Group {number}') for number in range(ROWS)
+        )
+        Excercises.objects.bulk_create(
+            Excercises(exercise_name=f'Exercise {number}',
+                       target_muscle='Chest', workout_type='Strength')
+            for number in range(ROWS)
+        )
+
+    def setUp(self):
+        catalog_cache.clear()
+        self.addCleanup(catalog_cache.clear)
+        self.client.force_login(self.superuser)
+        for model_admin in admin.site._registry.values():
+            patch = mock.patch.object(model_admin, 'list_per_page', PER_PAGE)
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_changelists(self):
+        for model, model_admin in admin.site._registry.items():
+            url = reverse(f'admin:{model._meta.app_label}_'
+                          f'{model._meta.model_name}_changelist')
+            pages = [{}, {'p': '2'}]
+            if model_admin.search_fields:
+                pages.append({'q': 'a'})
+            for params in pages:
+                with self.subTest(model=model._meta.label, **params):
+                    # Warm up the session, user and catalog caches
+                    self.client.get(url, params)
+                    with CaptureQueriesContext(connection) as queries:
+                        response = self.client.get(url, params)
+                    self.assertEqual(response.status_code, 200)
+                    if 'p' in params:
+                        # Django ignores the page number of a single page
+                        self.assertTrue(response.context['cl'].multi_page)
+                    self.assertLessEqual(
+                        len(queries), MAX_QUERIES,
+                        '\n'.join(query['sql'] for query in queries),
+                    )
+
+    def test_values_filter(self):
+        url = reverse('admin:core_excercises_changelist')
+        response = self.client.get(url, {'workout_type': 'Strength'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cl'].result_count, ROWS)
+        # Choices come from the catalog cache once read
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.assertFalse([query for query in queries
+                          if 'DISTINCT' in query['sql']])
@@ -0,0 +1,74 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TransactionTestCase
+from django.utils import timezone
+
+from core import duplicates
+from core.models import (
+    ExerciseMuscle, Excercises, Food, FoodIngestion, Ingestion,
+)
+
+
+class MergeTests(TransactionTestCase):
+    """Rows stored before the natural keys were unique are merged."""
+
+    def setUp(self):
+        # Back to a database created before the unique constraints
+        for model in (Food, Excercises):
+            constraints = model._meta.constraints
+            # SQLite rebuilds the table from the constraints of the model
+            with mock.patch.object(model._meta, 'constraints', []), \
+                    connection.schema_editor() as editor:
+                for constraint in constraints:
+                    editor.remove_constraint(model, constraint)
+            for constraint in constraints:
+                self.addCleanup(self.add_constraint, model, constraint)
+
+    @staticmethod
+    def add_constraint(model, constraint):
+        with connection.schema_editor() as editor:
+            editor.add_constraint(model, constraint)
+
+    def food(self):
+        return Food.objects.create(
+            name='Oats', brand='Acme', enter_by='load', type='solid',
+        )
+
+    def test_food(self):
+        kept, duplicate = self.food(), self.food()
+        other = Food.objects.create(
+            name='Oats', brand='Other', enter_by='load', type='solid',
+        )
+        user = get_user_model().objects.create_user('a@b.c', 'secret')
+        meal = Ingestion.objects.create(
+            user=user, date=timezone.now(), meal_number=1, value=100,
+        )
+        eaten = FoodIngestion.objects.create(food_id=duplicate,
+                                             ingestion_id=meal)
+
+        self.assertEqual(duplicates.merge(Food), 1)
+        self.assertQuerysetEqual(
+            Food.objects.order_by('id'), [kept, other]
+        )
+        eaten.refresh_from_db()
+        self.assertEqual(eaten.food_id, kept)
+        self.assertEqual(duplicates.merge(Food), 0)
+
+    def test_exercise_muscles(self):
+        exercises = [
+            Excercises.objects.create(exercise_name='Squat',
+                                      target_muscle='Legs',
+                                      workout_type='Strength')
+            for _ in range(3)
+        ]
+        # Saves link each exercise to its muscles
+        self.assertEqual(ExerciseMuscle.objects.count(), 3)
+
+        self.assertEqual(duplicates.merge(Excercises), 2)
+        self.assertQuerysetEqual(Excercises.objects.all(), exercises[:1])
+        self.assertQuerysetEqual(
+            ExerciseMuscle.objects.values_list('exercise_id', flat=True),
+            [exercises[0].id],
+        )
@@ -0,0 +1,33 @@
+from datetime import date, datetime, timezone
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+
+from core.models import TrainingRollup, WorkoutHistory
+
+
+class TrainingRollupSignalTests(TestCase):
+    """Saving a history row refreshes the buckets it enters and leaves."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(
+            'rollups@example.com', 'secret'
+        )
+
+    def day_rollups(self):
+        return set(TrainingRollup.objects.filter(
+            user=self.user, period='day', workouts__gt=0,
+        ).values_list('period_start', flat=True))
+
+    def test_moved_row(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            workout = WorkoutHistory.objects.create(
+                user=self.user, date=datetime(2024, 1, 3, 12,
+                                              tzinfo=timezone.utc),
+            )
+        self.assertEqual(self.day_rollups(), {date(2024, 1, 3)})
+        workout.date = datetime(2024, 2, 7, 12, tzinfo=timezone.utc)
+        with self.captureOnCommitCallbacks(execute=True):
+            workout.save()
+        self.assertEqual(self.day_rollups(), {date(2024, 2, 7)})
@@ -0,0 +1,70 @@
+from django.test import TestCase
+from django.urls import reverse
+
+from core.catalog_cache import catalog_cache
+from core.models import Excercises
+from user.views import EXCERCISES_PAGE_SIZE
+
+
+class UserViewQueriesTests(TestCase):
+    """The exercise listing costs one query per page, none once cached."""
+
+    @classmethod
+    def setUpTestData(cls):
+        Excercises.objects.bulk_create(
+            Excercises(
+                exercise_name=f'Exercise {number}',
+                target_muscle='Chest' if number % 2 else 'Back',
+                workout_type='Strength',
+            )
+            for number in range(EXCERCISES_PAGE_SIZE * 3)
+        )
+
+    def setUp(self):
+        catalog_cache.clear()
+        self.addCleanup(catalog_cache.clear)
+
+    def get(self, **params):
+        response = self.client.get(reverse('user'), params)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_first_page(self):
+        with self.assertNumQueries(1):
+            response = self.get()
+        self.assertEqual(len(response.context['excercises']),
+                         EXCERCISES_PAGE_SIZE)
+        self.assertIsNotNone(response.context['next_query'])
+        with self.assertNumQueries(0):
+            self.get()
+
+    def test_later_page(self):
+        after = Excercises.objects.order_by('id').values_list(
+            'id', flat=True
+        )[EXCERCISES_PAGE_SIZE * 2 - 1]
+        with self.assertNumQueries(1):
+            response = self.get(after=after)
+        self.assertEqual(len(response.context['excercises']),
+                         EXCERCISES_PAGE_SIZE)
+        self.assertIsNone(response.context['next_query'])
+        with self.assertNumQueries(0):
+            self.get(after=after)
+
+    def test_filtered_page(self):
+        with self.assertNumQueries(1):
+            response = self.get(target_muscle='Chest', after=0)
+        self.assertEqual(len(response.context['excercises']),
+                         EXCERCISES_PAGE_SIZE)
+        with self.assertNumQueries(0):
+            self.get(target_muscle='Chest', after=0)
+
+    def test_saved_exercise_drops_cached_pages(self):
+        self.get()
+        # The cache is invalidated once the save commits
+        with self.captureOnCommitCallbacks(execute=True):
+            Excercises.objects.create(
+                exercise_name='Exercise new', target_muscle='Legs',
+                workout_type='Strength',
+            )
+        with self.assertNumQueries(1):
+            self.get()
@@ -0,0 +1,105 @@
+import json
+import tempfile
+from collections import Counter
+from pathlib import Path
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.db import DataError, OperationalError
+from django.test import TestCase, override_settings
+
+from api import write_behind
+
+
+class FlushTests(TestCase):
+    """Failures of one flush stay within a group, or within the batch."""
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.users = [
+            User.objects.create_user(f'flush{number}@example.com', 'secret')
+            for number in range(2)
+        ]
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(WRITE_BEHIND={
+            'PATH': str(Path(directory.name) / 'queue.sqlite3'),
+            'MAX_ATTEMPTS': 2,
+        })
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.queue = write_behind.queue()
+        self.addCleanup(self.queue.connection.close)
+        for user in self.users:
+            self.queue.put('meals', user.id, [
+                (f'{user.id}-{number}', json.dumps({'value': number}))
+                for number in range(3)
+            ], max_pending=100)
+
+    def attempts(self):
+        return [row[0] for row in self.queue.connection.execute(
+            'SELECT attempts FROM records ORDER BY id'
+        )]
+
+    def test_failing_group(self):
+        failing, stored = self.users
+
+        def sync_batch(kind, user, items):
+            if user == failing:
+                raise DataError('Data too long')
+            return [{'status': 'created'} for _ in items]
+
+        with mock.patch.object(write_behind, 'sync_batch', sync_batch):
+            stats = write_behind.flush()
+        self.assertEqual(stats['records'], 6)
+        self.assertEqual(stats['created'], 3)
+        self.assertEqual(stats['failed'], 3)
+        self.assertEqual(self.queue.pending(), 0)
+        self.assertEqual(self.queue.failures(), 3)
+
+    def test_transient_error(self):
+        error = OperationalError('Lost connection')
+        with mock.patch.object(write_behind, 'sync_batch',
+                               side_effect=error):
+            with self.assertRaises(OperationalError):
+                write_behind.flush()
+        # Leased again right away, without an attempt counted
+        self.assertEqual(self.attempts(), [0] * 6)
+        self.assertEqual(self.queue.failures(), 0)
+
+    def test_too_many_attempts(self):
+        for _ in range(2):
+            records, exhausted = self.queue.lease(10, -1, 2)
+            self.assertEqual((len(records), exhausted), (6, 0))
+        self.assertEqual(self.attempts(), [2] * 6)
+        stats = write_behind.flush()
+        self.assertEqual(stats['records'], 6)
+        self.assertEqual(stats['failed'], 6)
+        self.assertEqual(self.queue.failures(), 6)
+
+    def test_poisoned_record(self):
+        poisoned = (self.users[0], {'value': 0})
+        stats = Counter()
+
+        def sync_batch(kind, user, items):
+            if (user, items[0]) == poisoned:
+                raise OperationalError('Incorrect datetime value')
+            return [{'status': 'created'} for _ in items]
+
+        config = {**write_behind.options(), 'TRANSIENT_RETRIES': 3}
+        with override_settings(WRITE_BEHIND=config), \
+                mock.patch.object(write_behind, 'sync_batch', sync_batch):
+            for _ in range(20):
+                try:
+                    stats += write_behind.flush()
+                except OperationalError:
+                    continue
+                if not self.queue.pending():
+                    break
+        # Split away from the other records, then failed on its own
+        self.assertEqual(self.queue.pending(), 0)
+        self.assertEqual(stats['created'], 5)
+        self.assertEqual(self.queue.failures(), 1)
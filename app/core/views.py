@@ -0,0 +1,94 @@
+import hmac
+import tempfile
+from typing import BinaryIO, Iterable
+
+from django.core.exceptions import PermissionDenied
+from django.core.handlers.asgi import ASGIRequest
+from django.http import (
+    FileResponse, Http404, HttpResponse, HttpResponseForbidden,
+    JsonResponse, StreamingHttpResponse,
+)
+from django.utils.dateparse import parse_date
+
+from core.exports import DATASETS, csv_stream, gzip_stream
+from core.instrumentation import options, registry
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _authorized(request) -> bool:
+    if request.user.is_authenticated and request.user.is_staff:
+        return True
+    # Scrapers authenticate with a bearer token instead of a session
+    token = options()['TOKEN']
+    header = request.headers.get('Authorization', '')
+    return bool(token) and hmac.compare_digest(header, f'Bearer {token}')
+
+
+def metrics_view(request):
+    """ Request histograms of this worker, as JSON or Prometheus text """
+    if not _authorized(request):
+        return HttpResponseForbidden()
+    if request.GET.get('format') == 'prometheus' \
+            or 'text/plain' in request.headers.get('Accept', ''):
+        return HttpResponse(
+            registry.prometheus(), content_type=PROMETHEUS_CONTENT_TYPE
+        )
+    return JsonResponse(registry.snapshot())
+
+
+def _spool(pieces: Iterable[bytes]) -> BinaryIO:
+    spool = tempfile.TemporaryFile()
+    for piece in pieces:
+        spool.write(piece)
+    spool.seek(0)
+    return spool
+
+
+def _export_filters(request, user) -> dict:
+    """Export filters of the query string, ValueError when malformed."""
+    users = request.GET.get('users')
+    user_ids = [int(value) for value in users.split(',')] if users else None
+    if not user.is_staff:
+        # Users other than staff (coaches) export their own history
+        if user_ids not in (None, [user.id]):
+            raise PermissionDenied
+        user_ids = [user.id]
+    filters = {'user_ids': user_ids}
+    for name in ('start', 'end'):
+        if request.GET.get(name):
+            filters[name] = parse_date(request.GET[name])
+            if filters[name] is None:
+                raise ValueError(f'{name} must be a YYYY-MM-DD date')
+    return filters
+
+
+def export_view(request, dataset):
+    """ History dataset as CSV, gzip compressed with ?gzip=1 """
+    if dataset not in DATASETS:
+        raise Http404
+    user = request.user
+    if not user.is_authenticated:
+        return HttpResponseForbidden()
+    try:
+        filters = _export_filters(request, user)
+    except PermissionDenied:
+        return HttpResponseForbidden()
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    content = csv_stream(dataset, **filters)
+    filename, content_type = f'{dataset}.csv', 'text/csv'
+    if request.GET.get('gzip'):
+        content = gzip_stream(content)
+        filename, content_type = f'{filename}.gz', 'application/gzip'
+    if isinstance(request, ASGIRequest):
+        # Django 4.0 iterates streaming responses inside the event loop,
+        # where the ORM can't run: under ASGI the export is spooled to
+        # disk from the view's thread and the file is streamed from there
+        spool = _spool(content)
+        return FileResponse(spool, as_attachment=True, filename=filename,
+                            content_type=content_type)
+    response = StreamingHttpResponse(content, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
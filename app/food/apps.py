@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class FoodConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'food'
+
+    def ready(self):
+        # Keeps the in-process search index in sync with Food rows
+        from . import signals  # noqa: F401
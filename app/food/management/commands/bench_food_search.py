@@ -0,0 +1,105 @@
+import random
+from statistics import median
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models.functions import Length
+
+from core.models import Food
+from food.search import FoodSearchIndex
+
+WORDS = [
+    'Lomo', 'de', 'cerdo', 'res', 'magro', 'Pechuga', 'pollo', 'Fríjol',
+    'pinto', 'Arroz', 'integral', 'blanco', 'Avena', 'hojuelas', 'Leche',
+    'descremada', 'entera', 'Queso', 'campesino', 'Atún', 'agua', 'aceite',
+    'Plátano', 'maduro', 'verde', 'Papa', 'criolla', 'Yuca', 'Huevo',
+    'Salsa', 'tomate', 'Pan', 'tajado', 'Manzana', 'Piña', 'Lenteja',
+]
+BRANDS = ['Generic', 'Alpina', 'Colanta', 'Zenú', 'Diana', 'Heinz', 'Éxito']
+TYPES = ['Proteinas', 'Lacteos', 'Cereales', 'Frutas', 'Leguminosas']
+
+
+class Command(BaseCommand):
+    """ BaseCommand Wrapper """
+    help = '''
+    Compare the in-process food search index with an ORM
+    name__icontains scan over a synthetic catalog. The synthetic rows
+    are rolled back at the end.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=100000)
+        parser.add_argument('--queries', type=int, default=500)
+        parser.add_argument('--limit', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        rng = random.Random(options['seed'])
+        with transaction.atomic():
+            self.create_catalog(rng, options['items'])
+            queries = self.make_queries(rng, options['queries'])
+
+            index = FoodSearchIndex()
+            start = perf_counter()
+            index.build()
+            build_time = perf_counter() - start
+            print(f"🏗️ Index of {len(index)} foods built in {build_time:.2f}s")
+
+            limit = options['limit']
+            self.report('index', [
+                self.timed(index.search, query, limit) for query in queries
+            ])
+            self.report('orm scan', [
+                self.timed(self.orm_search, query, limit)
+                for query in queries
+            ])
+            transaction.set_rollback(True)
+
+    def create_catalog(self, rng, items: int) -> None:
+        foods = (
+            Food(
+                name=' '.join(rng.sample(WORDS, rng.randint(2, 5))),
+                enter_by='Admin',
+                brand=rng.choice(BRANDS),
+                type=rng.choice(TYPES),
+            )
+            for _ in range(items)
+        )
+        # Random names repeat now and then, (name, brand) is unique
+        Food.objects.bulk_create(foods, batch_size=5000,
+                                 ignore_conflicts=True)
+
+    def make_queries(self, rng, count: int) -> list:
+        """Prefixes of one or two words, as typed in a search box."""
+        queries = []
+        for _ in range(count):
+            words = rng.sample(WORDS, rng.randint(1, 2))
+            words[-1] = words[-1][:rng.randint(2, len(words[-1]))]
+            queries.append(' '.join(words))
+        return queries
+
+    @staticmethod
+    def orm_search(query: str, limit: int) -> list:
+        """Baseline: substring scan ranked by name length, like the index."""
+        queryset = Food.objects.order_by(Length('name'), 'id')
+        for token in query.split():
+            queryset = queryset.filter(name__icontains=token)
+        return list(queryset.values('id', 'name', 'brand', 'type')[:limit])
+
+    @staticmethod
+    def timed(function, *args) -> float:
+        start = perf_counter()
+        function(*args)
+        return (perf_counter() - start) * 1000
+
+    @staticmethod
+    def report(label: str, timings: list) -> None:
+        timings = sorted(timings)
+        p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+        print(
+            f"⏱️ \033[94m{label:>8}\033[m: p50 {median(timings):.3f} ms, "
+            f"p99 {p99:.3f} ms, max {timings[-1]:.3f} ms "
+            f"over {len(timings)} queries"
+        )
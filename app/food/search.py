@@ -0,0 +1,264 @@
+"""
+In-process search index for the Food catalog.
+
+Food names are normalized (lower case, accents removed) and split into
+tokens. A sorted token vocabulary answers prefix lookups with a binary
+search. Posting lists are kept sorted by rank (shorter names first), so
+the top matches are found by merging them lazily and stopping after
+``limit`` hits instead of ranking every candidate. A trigram index is
+used as a fallback for misspelled queries.
+The index is kept in sync incrementally through model signals and checks
+the table signature (row count, max id and latest ``updated_at``)
+periodically to pick up bulk loads and edits made by other processes.
+"""
+import heapq
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+from itertools import islice
+from typing import (
+    Dict, Iterable, Iterator, List, NamedTuple, Optional, Set
+)
+
+from django.db.models import Count, Max
+
+from core.models import Food
+
+DEFAULT_LIMIT = 10
+# Seconds between checks of the table signature
+REFRESH_INTERVAL = 30
+# Share of query trigrams a name must contain to be a fuzzy match
+MIN_TRIGRAM_SIMILARITY = 0.5
+
+_NON_WORD = re.compile(r'[^a-z0-9]+')
+# Posting entries pack the rank and the id in one int: (tokens << 32) | id
+_ID_BITS = 32
+_ID_MASK = (1 << _ID_BITS) - 1
+
+
+def normalize(text: str) -> str:
+    """Lower case ``text`` and strip accents, e.g. 'Fríjol' -> 'frijol'."""
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    stripped = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return _NON_WORD.sub(' ', stripped.casefold()).strip()
+
+
+def tokenize(text: str) -> List[str]:
+    return normalize(text).split()
+
+
+def trigrams(token: str) -> Set[str]:
+    padded = f'  {token} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class FoodDocument(NamedTuple):
+    """Fields of a Food row kept in memory by the index."""
+    id: int
+    name: str
+    brand: str
+    type: str
+    tokens: tuple
+
+    def as_dict(self) -> dict:
+        return {
+            'id': self.id,
+            'name': self.name,
+            'brand': self.brand,
+            'type': self.type,
+        }
+
+
+class FoodSearchIndex:
+    """Prefix and trigram index over Food names and brands."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._documents: Dict[int, FoodDocument] = {}
+        self._postings: Dict[str, List[int]] = defaultdict(list)
+        self._trigrams: Dict[str, Set[int]] = defaultdict(set)
+        self._vocabulary: List[str] = []
+        self._vocabulary_dirty = False
+        self._signature = None
+        self._checked_at = 0.0
+        self.built = False
+
+    def __len__(self):
+        return len(self._documents)
+
+    # Building ---------
+
+    def build(self, foods: Optional[Iterable] = None) -> None:
+        """(Re)build the index from ``foods`` or from the Food table."""
+        if foods is None:
+            foods = Food.objects.values_list(
+                'id', 'name', 'brand', 'type'
+            ).iterator(chunk_size=5000)
+        with self._lock:
+            self._documents.clear()
+            self._postings.clear()
+            self._trigrams.clear()
+            for row in foods:
+                self._add(*row, keep_sorted=False)
+            for entries in self._postings.values():
+                entries.sort()
+            self._vocabulary = sorted(self._postings)
+            self._vocabulary_dirty = False
+            self._signature = self._table_signature()
+            self._checked_at = time.monotonic()
+            self.built = True
+
+    def update(self, food: Food) -> None:
+        """Add or replace a single Food row."""
+        with self._lock:
+            self._remove(food.id)
+            self._add(food.id, food.name, food.brand, food.type)
+            self._vocabulary_dirty = True
+            self._signature = None
+
+    def remove(self, food_id: int) -> None:
+        with self._lock:
+            self._remove(food_id)
+            self._vocabulary_dirty = True
+            self._signature = None
+
+    def _add(self, food_id, name, brand, type_, keep_sorted=True) -> None:
+        tokens = tuple(tokenize(f'{name} {brand}'))
+        self._documents[food_id] = FoodDocument(
+            food_id, name, brand, type_, tokens
+        )
+        entry = (len(tokens) << _ID_BITS) | food_id
+        for token in set(tokens):
+            if keep_sorted:
+                insort(self._postings[token], entry)
+            else:
+                self._postings[token].append(entry)
+            for trigram in trigrams(token):
+                self._trigrams[trigram].add(food_id)
+
+    def _remove(self, food_id: int) -> None:
+        document = self._documents.pop(food_id, None)
+        if document is None:
+            return
+        entry = (len(document.tokens) << _ID_BITS) | food_id
+        for token in set(document.tokens):
+            entries = self._postings.get(token, [])
+            position = bisect_left(entries, entry)
+            if position < len(entries) and entries[position] == entry:
+                del entries[position]
+            if not entries:
+                self._postings.pop(token, None)
+            for trigram in trigrams(token):
+                self._discard(self._trigrams, trigram, food_id)
+
+    @staticmethod
+    def _discard(index: dict, key: str, food_id: int) -> None:
+        ids = index.get(key)
+        if ids is not None:
+            ids.discard(food_id)
+            if not ids:
+                del index[key]
+
+    @staticmethod
+    def _table_signature():
+        return tuple(Food.objects.aggregate(
+            Count('id'), Max('id'), Max('updated_at')
+        ).values())
+
+    def ensure_fresh(self) -> None:
+        """
+        Build the index on first use and rebuild it when the table was
+        changed by a bulk operation that didn't send model signals.
+        """
+        if not self.built:
+            self.build()
+            return
+        now = time.monotonic()
+        if now - self._checked_at < REFRESH_INTERVAL:
+            return
+        self._checked_at = now
+        signature = self._table_signature()
+        if self._signature is None:
+            self._signature = signature
+        elif signature != self._signature:
+            self.build()
+
+    # Searching ---------
+
+    def search(self, query: str, limit: int = DEFAULT_LIMIT) -> List[dict]:
+        """Return the ``limit`` best matches for ``query``."""
+        query_tokens = tokenize(query)
+        if not query_tokens or limit <= 0:
+            return []
+        with self._lock:
+            if self._vocabulary_dirty:
+                self._vocabulary = sorted(self._postings)
+                self._vocabulary_dirty = False
+            ranked = list(islice(self._ranked_ids(query_tokens), limit))
+            if not ranked:
+                ranked = self._fuzzy_matches(query_tokens, limit)
+            return [self._documents[food_id].as_dict() for food_id in ranked]
+
+    def _ranked_ids(self, query_tokens: List[str]) -> Iterator[int]:
+        """
+        Yield ids of documents where every query token prefixes some
+        document token, best first.
+
+        The longest query token drives the lookup (it is usually the most
+        selective): documents containing it as a whole word come first,
+        then those where it is only a prefix, each group ordered by rank.
+        The remaining tokens are checked on the yielded documents only.
+        """
+        ordered = sorted(query_tokens, key=len, reverse=True)
+        primary, others = ordered[0], ordered[1:]
+        vocabulary = self._vocabulary
+        position = bisect_left(vocabulary, primary)
+        prefixed = []
+        while position < len(vocabulary) \
+                and vocabulary[position].startswith(primary):
+            if vocabulary[position] != primary:
+                prefixed.append(self._postings[vocabulary[position]])
+            position += 1
+        streams = [
+            self._postings.get(primary, ()),
+            heapq.merge(*prefixed),
+        ]
+
+        seen = set()
+        for stream in streams:
+            for entry in stream:
+                food_id = entry & _ID_MASK
+                if food_id in seen:
+                    continue
+                seen.add(food_id)
+                tokens = self._documents[food_id].tokens
+                if all(any(token.startswith(prefix) for token in tokens)
+                       for prefix in others):
+                    yield food_id
+
+    def _fuzzy_matches(self, query_tokens: List[str], limit: int) -> list:
+        """Rank documents by the share of query trigrams they contain."""
+        query_trigrams = set()
+        for token in query_tokens:
+            query_trigrams |= trigrams(token)
+        shared = Counter()
+        for trigram in query_trigrams:
+            shared.update(self._trigrams.get(trigram, ()))
+        threshold = MIN_TRIGRAM_SIMILARITY * len(query_trigrams)
+        matches = [
+            (-count, len(self._documents[food_id].tokens), food_id)
+            for food_id, count in shared.items() if count >= threshold
+        ]
+        return [food_id for *_, food_id in heapq.nsmallest(limit, matches)]
+
+
+food_index = FoodSearchIndex()
+
+
+def search_foods(query: str, limit: int = DEFAULT_LIMIT) -> List[dict]:
+    """Search the shared process-wide index, building it if needed."""
+    food_index.ensure_fresh()
+    return food_index.search(query, limit)
@@ -0,0 +1,36 @@
+"""
+Signal handlers keeping the food search index up to date.
+
+The index is changed once the transaction commits, so a rolled back save
+leaves no entry behind.
+"""
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from core.models import Food
+
+from .search import food_index
+
+
+@receiver(post_save, sender=Food)
+def index_food(sender, instance, **kwargs):
+    # The fields as saved, the instance may change before the commit
+    food = Food(id=instance.id, name=instance.name, brand=instance.brand,
+                type=instance.type)
+
+    def index():
+        if food_index.built:
+            food_index.update(food)
+    transaction.on_commit(index)
+
+
+@receiver(post_delete, sender=Food)
+def unindex_food(sender, instance, **kwargs):
+    # delete() clears the instance's id before the commit
+    food_id = instance.id
+
+    def unindex():
+        if food_index.built:
+            food_index.remove(food_id)
+    transaction.on_commit(unindex)
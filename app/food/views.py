@@ -0,0 +1,19 @@
+from django.http import HttpResponseNotAllowed, JsonResponse
+
+from .search import DEFAULT_LIMIT, search_foods
+
+MAX_LIMIT = 50
+
+
+def food_search_view(request):
+    """ Search-as-you-type lookup over the Food catalog """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    query = request.GET.get('q', '')
+    try:
+        limit = min(int(request.GET.get('limit', DEFAULT_LIMIT)), MAX_LIMIT)
+    except ValueError:
+        return JsonResponse({'error': 'limit must be an integer'}, status=400)
+
+    results = search_foods(query, limit)
+    return JsonResponse({'query': query, 'results': results})
@@ -0,0 +1,30 @@
+"""
+Gunicorn settings for the production serving profile.
+
+Runs the WSGI application with threaded workers by default, which keep
+their database connections open between requests (CONN_MAX_AGE). Set
+GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker and
+GUNICORN_APP=app.asgi:application to serve the ASGI application instead:
+Django does not reuse database connections there, so app/asgi.py
+turns persistent connections off.
+"""
+import multiprocessing
+import os
+
+wsgi_app = os.environ.get('GUNICORN_APP', 'app.wsgi:application')
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(
+    os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1)
+)
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+keepalive = 5
+timeout = 30
+graceful_timeout = 30
+# Recycle workers now and then to bound memory growth
+max_requests = 2000
+max_requests_jitter = 200
+# Each worker opens its own database connections, so the application is
+# not preloaded in the master process
+preload_app = False
+accesslog = '-'
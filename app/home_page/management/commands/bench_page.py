@@ -0,0 +1,87 @@
+import re
+from statistics import median
+from time import perf_counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.template import engines
+from django.test import Client
+
+SCENARIOS = {
+    # name: (server caches warm, assets downloaded, Accept-Encoding)
+    'cold, identity': (False, True, 'identity'),
+    'cold, compressed': (False, True, 'br, gzip'),
+    'warm': (True, False, 'br, gzip'),
+}
+
+
+class Command(BaseCommand):
+    """ BaseCommand Wrapper """
+    help = '''
+    Time a page load (the page and the static assets it links) cold, with
+    empty template and fragment caches and an empty browser cache, and
+    warm, when the browser kept the immutable assets of a previous visit.
+    Run it with DEBUG=0 after collectstatic, as served in production.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/')
+        parser.add_argument('--repeat', type=int, default=50)
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        if settings.DEBUG:
+            raise CommandError(
+                'Run with DEBUG=0 after collectstatic, so templates and '
+                'static files are served as in production'
+            )
+        client = Client(HTTP_HOST=settings.ALLOWED_HOSTS[0])
+        print(f"\033[94mbench_page\033[m loading {options['path']}")
+        for name, (warm, assets, encoding) in SCENARIOS.items():
+            timings, size, requests = [], 0, 0
+            if warm:
+                self.load(client, options['path'], assets, encoding)
+            for _ in range(max(1, options['repeat'])):
+                if not warm:
+                    self.reset_caches()
+                start = perf_counter()
+                size, requests = self.load(
+                    client, options['path'], assets, encoding
+                )
+                timings.append((perf_counter() - start) * 1000)
+            print(
+                f"⏱️ \033[94m{name:>16}\033[m: p50 {median(timings):.2f} ms, "
+                f"{size / 1024:.1f} KiB in {requests} requests"
+            )
+
+    @staticmethod
+    def reset_caches() -> None:
+        for loader in engines['django'].engine.template_loaders:
+            if hasattr(loader, 'reset'):
+                loader.reset()
+        caches['fragments'].clear()
+
+    @staticmethod
+    def body(response) -> bytes:
+        if response.streaming:
+            return b''.join(response.streaming_content)
+        return response.content
+
+    def load(self, client, path: str, assets: bool, encoding: str):
+        """Bytes received and requests made to load ``path``."""
+        response = client.get(path, HTTP_ACCEPT_ENCODING=encoding)
+        if response.status_code != 200:
+            raise CommandError(f'{path} answered {response.status_code}')
+        page = self.body(response)
+        size, requests = len(page), 1
+        if not assets:
+            return size, requests
+        pattern = rf'(?:href|src)="({re.escape(settings.STATIC_URL)}[^"]+)"'
+        for url in re.findall(pattern, page.decode()):
+            response = client.get(url, HTTP_ACCEPT_ENCODING=encoding)
+            if response.status_code != 200:
+                raise CommandError(f'{url} answered {response.status_code}')
+            size += len(self.body(response))
+            requests += 1
+        return size, requests
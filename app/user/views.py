@@ -1,12 +1,50 @@
 from django.shortcuts import render
+from django.utils.http import urlencode
 
 # Core App import
+from core.catalog_cache import catalog_cache
 from core.models import Excercises
 
 
 # User App import
 from .forms import UserForm
 
+EXCERCISES_PAGE_SIZE = 25
+EXCERCISES_MAX_PAGE_SIZE = 100
+
+# Query string filters, each backed by an index on Excercises
+EXCERCISES_FILTERS = ('target_muscle', 'workout_type')
+
+
+def _positive_int(value, default):
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return default
+
+
+def excercises_page(filters: dict, after: int, page_size: int) -> tuple:
+    """
+    Keyset paginated exercises after the id ``after``. Returns the page
+    rows as (id, exercise_name) tuples and whether a next page exists.
+    Pages go through the catalog cache, which drops them whenever an
+    exercise is saved, deleted or bulk loaded.
+    """
+    key = 'page:' + urlencode(
+        sorted({**filters, 'after': after, 'size': page_size}.items())
+    )
+
+    def load_page():
+        rows = list(
+            Excercises.objects
+            .filter(id__gt=after, **filters)
+            .order_by('id')
+            .values_list('id', 'exercise_name')[:page_size + 1]
+        )
+        return rows[:page_size], len(rows) > page_size
+
+    return catalog_cache.get_or_load(Excercises, key, load_page)
+
 
 def user_view(request):
     """ Home page view method definition """
@@ -14,11 +52,26 @@ def user_view(request):
         form = UserForm(request.POST)
     else:
         form = UserForm()
-    print(dir(list(Excercises.objects.all())[0]))
-    # print(form.fields)
-    # [print(item) for item in dir(form)]
+
+    filters = {
+        name: request.GET[name]
+        for name in EXCERCISES_FILTERS if request.GET.get(name)
+    }
+    after = _positive_int(request.GET.get('after'), 0)
+    page_size = min(
+        _positive_int(request.GET.get('page_size'), EXCERCISES_PAGE_SIZE)
+        or EXCERCISES_PAGE_SIZE,
+        EXCERCISES_MAX_PAGE_SIZE,
+    )
+    excercises, has_next = excercises_page(filters, after, page_size)
+    next_query = None
+    if has_next:
+        next_query = urlencode(
+            {**filters, 'after': excercises[-1][0], 'page_size': page_size}
+        )
 
     return (render(request, "user.html", {
         'form': form,
-        'excercises': enumerate(list(Excercises.objects.all()))
+        'excercises': excercises,
+        'next_query': next_query,
     }))